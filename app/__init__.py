@@ -0,0 +1,4 @@
+import time
+
+# Taken as early as possible, to measure the startup time of the process
+STARTED_AT = time.monotonic()
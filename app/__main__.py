@@ -1,95 +1,152 @@
+import argparse
 import asyncio
+import logging
+import time
+from typing import List, Sequence
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.redis import RedisStorage
-from apscheduler.jobstores.redis import RedisJobStore
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.utils.token import extract_bot_id
 
-from .bot import commands
+from . import STARTED_AT
 from .bot.handlers import include_routers
-from .bot.middlewares import register_middlewares
+from .bot.middlewares import TenantMiddleware, register_middlewares
+from .bot.middlewares.first_update import FirstUpdateMiddleware
+from .bot.session import RetryMiddleware, TunedAiohttpSession
+from .bot.tenant import Tenant, create_tenant, stop_tenants
+from .bot.utils.health_server import HealthServer
+from .bot.utils.loop_monitor import LoopMonitor
+from .bot.utils.profiler import SamplingProfiler
+from .bot.utils.recorder import UpdateRecorder
+from .bot.utils.redis import FallbackStorage, RedisHealth, TenantKeyBuilder, create_redis
 from .config import load_config, Config
 from .logger import setup_logger
+from .metrics import registry
+from .profiling import StartupProfiler
+from .runtime import install_uvloop
+from .serialization import json_dumps, json_loads
+
+STARTUP_READY = registry.gauge("startup_ready_seconds", "Time from process start until polling begins.")
 
 
 async def on_shutdown(
-    apscheduler: AsyncIOScheduler,
+    tenants: List[Tenant],
+    redis_health: RedisHealth,
+    loop_monitor: LoopMonitor,
     dispatcher: Dispatcher,
-    config: Config,
-    bot: Bot,
+    health_server: HealthServer | None = None,
 ) -> None:
     """
     Shutdown event handler. This runs when the bot shuts down.
 
-    :param apscheduler: AsyncIOScheduler: The apscheduler instance.
+    :param tenants: List[Tenant]: The bots served by the process with their services.
+    :param redis_health: RedisHealth: The Redis health monitor.
+    :param loop_monitor: LoopMonitor: The event loop monitor.
     :param dispatcher: Dispatcher: The bot dispatcher.
-    :param config: Config: The config instance.
-    :param bot: Bot: The bot instance.
+    :param health_server: HealthServer: The health endpoints or None if they are disabled.
     """
-    # Stop apscheduler
-    apscheduler.shutdown()
-    # Delete commands and close storage when shutting down
-    await commands.delete(bot, config)
+    if health_server is not None:
+        # Stop routing traffic to the replica while it drains
+        health_server.polling = False
+    # Finish or persist the in-flight work of every bot and stop their services
+    await stop_tenants(*tenants)
+    # Stop the health check and write the local journal to Redis
+    await redis_health.stop()
+    # Close storage when shutting down, commands are kept for the next start
     await dispatcher.storage.close()
-    await bot.delete_webhook()
-    await bot.session.close()
+    for tenant in tenants:
+        await tenant.bot.delete_webhook()
+    # The bots share the session
+    await tenants[0].bot.session.close()
+    if health_server is not None:
+        await health_server.stop()
+    await loop_monitor.stop()
 
 
 async def on_startup(
-    apscheduler: AsyncIOScheduler,
-    config: Config,
-    bot: Bot,
+    tenants: List[Tenant],
+    redis_health: RedisHealth,
+    loop_monitor: LoopMonitor,
+    dispatcher: Dispatcher,
+    health_server: HealthServer | None = None,
 ) -> None:
     """
     Startup event handler. This runs when the bot starts up.
 
-    :param apscheduler: AsyncIOScheduler: The apscheduler instance.
-    :param config: Config: The config instance.
-    :param bot: Bot: The bot instance.
+    :param tenants: List[Tenant]: The bots served by the process with their services.
+    :param redis_health: RedisHealth: The Redis health monitor.
+    :param loop_monitor: LoopMonitor: The event loop monitor.
+    :param dispatcher: Dispatcher: The bot dispatcher.
+    :param health_server: HealthServer: The health endpoints or None if they are disabled.
     """
-    # Start apscheduler
-    apscheduler.start()
-    # Setup commands when starting up
-    await commands.setup(bot, config)
+    # Measure the event loop lag from the start, the restore of the persisted work included
+    loop_monitor.start()
+    if health_server is not None:
+        # Answer the liveness checks while the persisted work is restored
+        await health_server.start()
+    # Start checking Redis health
+    redis_health.start()
+    # Restore the persisted work of every bot and start their services
+    await asyncio.gather(*(tenant.start(dispatcher) for tenant in tenants))
+    # Record the time from process start until polling begins
+    STARTUP_READY.set(time.monotonic() - STARTED_AT)
+    if health_server is not None:
+        health_server.polling = True
+    logging.info(f"Started in {time.monotonic() - STARTED_AT:.2f}s")
 
 
-async def main() -> None:
-    """
-    Main function that initializes the bot and starts the event loop.
+def create_bot(token: str, session: TunedAiohttpSession) -> Bot:
     """
-    # Load config
-    config = load_config()
-
-    # Initialize apscheduler
-    job_store = RedisJobStore(
-        host=config.redis.HOST,
-        port=config.redis.PORT,
-        db=config.redis.DB,
-    )
-    apscheduler = AsyncIOScheduler(
-        jobstores={"default": job_store},
-    )
-
-    # Initialize Redis storage
-    storage = RedisStorage.from_url(
-        url=config.redis.dsn(),
-    )
+    Create a Bot instance.
 
-    # Create Bot and Dispatcher instances
-    bot = Bot(
-        token=config.bot.TOKEN,
+    :param token: The bot token.
+    :param session: The HTTP session, it is shared by the bots.
+    :return: The Bot instance.
+    """
+    return Bot(
+        token=token,
+        session=session,
         default=DefaultBotProperties(
             parse_mode=ParseMode.HTML,
         ),
     )
+
+
+def create_dispatcher(
+        config: Config,
+        bot: Bot,
+        storage: RedisStorage,
+        recorder: UpdateRecorder | None = None,
+        tenant_bots: Sequence[Bot] = (),
+) -> Dispatcher:
+    """
+    Create the Dispatcher with all routers, middlewares and lifecycle handlers.
+
+    :param config: Config: The config instance.
+    :param bot: Bot: The bot instance.
+    :param storage: RedisStorage: The FSM storage, it is served locally while Redis is unavailable.
+    :param recorder: UpdateRecorder: The update recorder or None if recording is disabled.
+    :param tenant_bots: Sequence[Bot]: The bots of config.tenants in the multi-bot mode, in the same order.
+    :return: The configured Dispatcher.
+    """
+    redis_health = RedisHealth(storage.redis, config.redis)
     dp = Dispatcher(
-        apscheduler=apscheduler,
-        storage=storage,
-        config=config,
+        redis_health=redis_health,
+        storage=FallbackStorage(storage, redis_health, config.redis.CACHE_SIZE),
         bot=bot,
     )
+    tenants = [
+        create_tenant(dp, config, bot_config, bot_, storage.redis, redis_health)
+        for bot_config, bot_ in zip([config.bot, *config.tenants], [bot, *tenant_bots])
+    ]
+    dp["tenants"] = tenants
+    # The process is profiled as a whole, so the bots share the profiler
+    dp["profiler"] = SamplingProfiler(config.profiler.INTERVAL, config.profiler.MAX_DURATION)
+    dp["loop_monitor"] = LoopMonitor(config.loop)
+    # The services of the main bot are the defaults, the other bots replace them in the TenantMiddleware
+    dp.workflow_data.update(tenants[0].workflow_data)
 
     # Register startup handler
     dp.startup.register(on_startup)
@@ -98,18 +155,119 @@ async def main() -> None:
 
     # Include routes
     include_routers(dp)
+    # Register TenantMiddleware first, so every middleware gets the services of the bot
+    dp.update.outer_middleware.register(TenantMiddleware({tenant.bot.id: tenant for tenant in tenants}))
+    # Measure the time from process start until the first update is handled
+    dp.update.outer_middleware.register(FirstUpdateMiddleware(STARTED_AT))
     # Register middlewares
     register_middlewares(
-        dp, config=config, redis=storage.redis, apscheduler=apscheduler
+        dp,
+        config=config,
+        redis=storage.redis,
+        redis_health=redis_health,
+        recorder=recorder,
     )
+    return dp
+
+
+async def main(profile_output: str | None = None) -> None:
+    """
+    Main function that initializes the bot and starts the event loop.
+
+    :param profile_output: The file the startup profile is written to. If set, the bot only goes through the
+        startup and shutdown handlers and exits without polling.
+    """
+    profiler = StartupProfiler()
+    profiler.stages.append(("imports", time.monotonic() - STARTED_AT))
+
+    # Load config
+    with profiler.stage("load config"):
+        config = load_config()
+    # Set up logging
+    with profiler.stage("set up logging"):
+        setup_logger(config.logging)
+
+    # Initialize Redis storage
+    with profiler.stage("create storage"):
+        storage = RedisStorage(
+            # A single node, the master of the sentinels or a cluster, see REDIS_MODE
+            redis=create_redis(config.redis),
+            # The states of the other bots are kept apart from the ones of the main bot
+            key_builder=TenantKeyBuilder({
+                extract_bot_id(bot_config.TOKEN): bot_config for bot_config in config.tenants
+            }),
+            # The FSM data is encoded like the Bot API requests and the users
+            json_loads=json_loads,
+            json_dumps=json_dumps,
+        )
+
+    # Initialize the update recorder if enabled
+    recorder = None
+    if config.recorder.ENABLED:
+        recorder = UpdateRecorder(
+            path=config.recorder.PATH,
+            rotate_size=config.recorder.ROTATE_SIZE,
+            rotate_interval=config.recorder.ROTATE_INTERVAL,
+            backup_count=config.recorder.BACKUP_COUNT,
+        )
+        recorder.start()
+
+    # Create Bot and Dispatcher instances, the bots of the multi-bot mode share the session
+    with profiler.stage("create bot"):
+        session = TunedAiohttpSession(config.session)
+        # Apply one retry policy to all Bot API calls
+        retry = RetryMiddleware(config.retry)
+        session.middleware(retry)
+        bot = create_bot(config.bot.TOKEN, session)
+        tenant_bots = [create_bot(bot_config.TOKEN, session) for bot_config in config.tenants]
+    with profiler.stage("create dispatcher"):
+        dp = create_dispatcher(config, bot, storage, recorder, tenant_bots)
+        if config.health.ENABLED:
+            dp["health_server"] = HealthServer(
+                config.health, dp["tenants"], dp["redis_health"], dp["loop_monitor"], retry,
+            )
 
     # Start the bot
-    await bot.delete_webhook()
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    try:
+        with profiler.stage("delete webhook"):
+            for bot_ in (bot, *tenant_bots):
+                await bot_.delete_webhook()
+
+        if profile_output is not None:
+            # Same startup and shutdown data as start_polling provides
+            workflow_data = {"dispatcher": dp, "bots": [bot, *tenant_bots], **dp.workflow_data}
+            workflow_data.pop("bot", None)
+
+            with profiler.stage("startup handlers"):
+                await dp.emit_startup(bot=bot, **workflow_data)
+            with profiler.stage("shutdown handlers"):
+                await dp.emit_shutdown(bot=bot, **workflow_data)
+
+            profiler.write(profile_output)
+            logging.info(f"Startup profile written to {profile_output}")
+            return
+
+        await dp.start_polling(bot, *tenant_bots, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        if recorder is not None:
+            recorder.stop()
 
 
 if __name__ == "__main__":
-    # Set up logging
-    setup_logger()
+    parser = argparse.ArgumentParser(description="Support bot.")
+    parser.add_argument(
+        "--profile-startup",
+        nargs="?",
+        const=".logs/startup_profile.txt",
+        default=None,
+        metavar="PATH",
+        help="Go through startup and shutdown, write the import and initialization breakdown to PATH and exit.",
+    )
+    args = parser.parse_args()
+
+    # The event loop is chosen before it is created
+    if load_config().runtime.UVLOOP:
+        install_uvloop()
+
     # Run the bot
-    asyncio.run(main())
+    asyncio.run(main(args.profile_startup))
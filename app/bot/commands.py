@@ -1,22 +1,34 @@
+import asyncio
+import hashlib
+
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SetMyCommands
 from aiogram.types import (
     BotCommand,
     BotCommandScopeChat,
     BotCommandScopeAllGroupChats,
     BotCommandScopeAllPrivateChats,
 )
+from redis.asyncio import Redis
 
 from app.bot.utils.texts import SUPPORTED_LANGUAGES
 from app.config import Config
 
+# Redis key of the hash of the registered command sets
+HASH_KEY = "commands_hash"
+
 
-async def setup(bot: Bot, config: Config) -> None:
+async def setup(bot: Bot, config: Config, redis: Redis) -> None:
     """
     Set up bot commands for various scopes and languages.
 
+    A hash of the registered command sets is kept in Redis, so the calls are skipped when nothing changed since the
+    last start. Otherwise, all scopes are set concurrently.
+
     :param bot: The Bot object.
     :param config: The Config object.
+    :param redis: The Redis instance.
     """
     # Define bot commands for different languages
     commands = {
@@ -50,6 +62,11 @@ async def setup(bot: Bot, config: Config) -> None:
         ]
     }
 
+    if config.stats.ENABLED:
+        # The statistics are only offered when they are counted
+        group_commands["en"].append(BotCommand(command="stats", description="Support statistics"))
+        group_commands["es"].append(BotCommand(command="stats", description="Estadísticas del soporte"))
+
     admin_commands = {
         "en":
             commands["en"].copy() +
@@ -59,52 +76,77 @@ async def setup(bot: Bot, config: Config) -> None:
             [BotCommand(command="newsletter", description="Menú de boletines")],
     }
 
-    try:
+    if config.profiler.ENABLED:
+        # The live profiler is only offered when it is enabled
+        admin_commands["en"].append(BotCommand(command="profile", description="Profile the bot"))
+        admin_commands["es"].append(BotCommand(command="profile", description="Perfilar el bot"))
+
+    calls = [
         # Set commands for dev or admin in English language
-        await bot.set_my_commands(
+        SetMyCommands(
             commands=admin_commands["en"],
             scope=BotCommandScopeChat(chat_id=config.bot.DEV_ID),
-        )
+        ),
         # Set commands for dev or admin in Spanish language
-        await bot.set_my_commands(
+        SetMyCommands(
             commands=admin_commands["es"],
             scope=BotCommandScopeChat(chat_id=config.bot.DEV_ID),
             language_code="es",
-        )
-    except TelegramBadRequest:
-        raise ValueError(f"Chat with DEV_ID {config.bot.DEV_ID} not found.")
+        ),
+        # Set commands for all private chats in English language
+        SetMyCommands(
+            commands=commands["en"],
+            scope=BotCommandScopeAllPrivateChats(),
+        ),
+        # Set commands for all private chats in Spanish language
+        SetMyCommands(
+            commands=commands["es"],
+            scope=BotCommandScopeAllPrivateChats(),
+            language_code="es",
+        ),
+        # Set commands for all group chats in English language
+        SetMyCommands(
+            commands=group_commands["en"],
+            scope=BotCommandScopeAllGroupChats(),
+        ),
+        # Set commands for all group chats in Spanish language
+        SetMyCommands(
+            commands=group_commands["es"],
+            scope=BotCommandScopeAllGroupChats(),
+            language_code="es"
+        ),
+    ]
 
-    # Set commands for all private chats in English language
-    await bot.set_my_commands(
-        commands=commands["en"],
-        scope=BotCommandScopeAllPrivateChats(),
-    )
-    # Set commands for all private chats in Spanish language
-    await bot.set_my_commands(
-        commands=commands["es"],
-        scope=BotCommandScopeAllPrivateChats(),
-        language_code="es",
-    )
-    # Set commands for all group chats in English language
-    await bot.set_my_commands(
-        commands=group_commands["en"],
-        scope=BotCommandScopeAllGroupChats(),
-    )
-    # Set commands for all group chats in Spanish language
-    await bot.set_my_commands(
-        commands=group_commands["es"],
-        scope=BotCommandScopeAllGroupChats(),
-        language_code="es"
-    )
+    # Skip the calls if the same command sets were already registered
+    key = f"{HASH_KEY}_{bot.id}"
+    commands_hash = hashlib.sha256(
+        "\n".join(call.model_dump_json() for call in calls).encode()
+    ).hexdigest()
+    if await redis.get(key) == commands_hash.encode():
+        return
+
+    results = await asyncio.gather(*(bot(call) for call in calls), return_exceptions=True)
+    for call, result in zip(calls, results):
+        if isinstance(result, TelegramBadRequest) and isinstance(call.scope, BotCommandScopeChat):
+            raise ValueError(f"Chat with DEV_ID {config.bot.DEV_ID} not found.")
+        if isinstance(result, BaseException):
+            raise result
 
+    await redis.set(key, commands_hash)
 
-async def delete(bot: Bot, config: Config) -> None:
+
+async def delete(bot: Bot, config: Config, redis: Redis) -> None:
     """
     Delete bot commands for various scopes and languages.
 
+    Commands are kept on an ordinary shutdown, so users keep them between deploys. Use this to remove them for good.
+
     :param config: The Config object.
     :param bot: The Bot object.
+    :param redis: The Redis instance.
     """
+    # Forget the registered command sets, so the next setup registers them again
+    await redis.delete(f"{HASH_KEY}_{bot.id}")
 
     try:
         # Delete commands for dev or admin in any language
@@ -1,5 +1,4 @@
 from aiogram import Dispatcher
-from aiogram_newsletter.handlers import AiogramNewsletterHandlers
 
 from . import errors
 from . import group
@@ -10,6 +9,8 @@ def include_routers(dp: Dispatcher) -> None:
     """
     Include bot routers.
 
+    The newsletter handlers are included later, when the newsletter subsystem is loaded (see NewsletterLoader).
+
     :param dp: Dispatcher object.
     :return: None
     """
@@ -20,7 +21,6 @@ def include_routers(dp: Dispatcher) -> None:
             errors.router,
         ]
     )
-    AiogramNewsletterHandlers().register(dp)
 
 
 __all__ = [
@@ -4,5 +4,6 @@ from . import message
 routers = [
     command.router,
     command.router_id,
+    command.router_stats,
     message.router,
 ]
@@ -7,7 +7,10 @@ from aiogram.types import Message
 from aiogram.utils.markdown import hcode
 
 from app.bot.manager import Manager
-from app.bot.utils.redis import RedisStorage
+from app.bot.utils.groups import get_group_key
+from app.bot.utils.redis import RedisStorage, StatsStorage
+from app.bot.utils.redis.stats import RESPONSE_BUCKETS
+from app.bot.utils.texts import format_duration
 
 router_id = Router()
 router_id.message.filter(
@@ -26,11 +29,65 @@ async def handler(message: Message) -> None:
     await message.reply(hcode(message.chat.id))
 
 
+router_stats = Router()
+router_stats.message.filter(
+    F.chat.type.in_(["group", "supergroup"]),
+    MagicData(F.event_chat.id.in_(F.config.bot.GROUP_IDS)),  # type: ignore
+    MagicData(F.config.stats.ENABLED),  # type: ignore
+)
+
+
+@router_stats.message(Command("stats"))
+async def handler(message: Message, manager: Manager, stats: StatsStorage) -> None:
+    """
+    Sends the support statistics of the day in response to the /stats command.
+
+    The statistics are counted by the relay handlers (see StatsStorage), so they are read in constant time.
+
+    :param message: Message object.
+    :param manager: Manager object.
+    :param stats: StatsStorage object.
+    :return: None
+    """
+    day = await stats.get()
+    if day is None:
+        # Reply with the specified text, the reply is deleted after 5 seconds
+        await manager.reply(message, manager.text_message.get("stats_unavailable"))
+        return
+
+    busiest_hour = max(day.incoming, key=day.incoming.get, default=None)
+    # The median is known up to its bucket of RESPONSE_BUCKETS
+    median = day.median_response
+    if median is None:
+        median_text = "—"
+    elif median == float("inf"):
+        median_text = f"> {format_duration(RESPONSE_BUCKETS[-1])}"
+    else:
+        median_text = f"≤ {format_duration(median)}"
+    text = manager.text_message.get("stats")
+    await message.reply(
+        text.format(
+            day=day.day,
+            users=day.users,
+            users_week=day.users_week,
+            incoming=sum(day.incoming.values()),
+            outgoing=sum(day.outgoing.values()),
+            busiest_hour="—" if busiest_hour is None else f"{busiest_hour:02d}:00",
+            busiest_count=day.incoming.get(busiest_hour, 0),
+            waiting=day.waiting,
+            longest_wait=format_duration(day.longest_wait),
+            answered=day.answered,
+            average=format_duration(day.average_response),
+            median=median_text,
+        )
+    )
+
+
 router = Router()
 router.message.filter(
     F.message_thread_id.is_not(None),
     F.chat.type.in_(["group", "supergroup"]),
-    MagicData(F.event_chat.id == F.config.bot.GROUP_ID),  # type: ignore
+    MagicData(F.event_chat.id.in_(F.config.bot.GROUP_IDS)),  # type: ignore
 )
 
 
@@ -45,7 +102,8 @@ async def handler(message: Message, manager: Manager, redis: RedisStorage) -> No
     :param redis: RedisStorage object.
     :return: None
     """
-    user_data = await redis.get_by_message_thread_id(message.message_thread_id)
+    group_id = get_group_key(manager.config, message.chat.id)
+    user_data = await redis.get_by_message_thread_id(message.message_thread_id, group_id)
     if not user_data: return None  # noqa
 
     if user_data.message_silent_mode:
@@ -87,7 +145,8 @@ async def handler(message: Message, manager: Manager, redis: RedisStorage) -> No
     :param redis: RedisStorage object.
     :return: None
     """
-    user_data = await redis.get_by_message_thread_id(message.message_thread_id)
+    group_id = get_group_key(manager.config, message.chat.id)
+    user_data = await redis.get_by_message_thread_id(message.message_thread_id, group_id)
     if not user_data: return None  # noqa
 
     text = manager.text_message.get("user_information")
@@ -96,7 +155,12 @@ async def handler(message: Message, manager: Manager, redis: RedisStorage) -> No
 
 
 @router.message(Command(commands=["ban"]))
-async def handler(message: Message, manager: Manager, redis: RedisStorage) -> None:
+async def handler(
+        message: Message,
+        manager: Manager,
+        redis: RedisStorage,
+        stats: StatsStorage | None = None,
+) -> None:
     """
     Toggles the ban status for a user in the group.
     If the user is banned, they will be unbanned, and vice versa.
@@ -104,9 +168,11 @@ async def handler(message: Message, manager: Manager, redis: RedisStorage) -> No
     :param message: Message object.
     :param manager: Manager object.
     :param redis: RedisStorage object.
+    :param stats: StatsStorage object or None if the statistics are disabled.
     :return: None
     """
-    user_data = await redis.get_by_message_thread_id(message.message_thread_id)
+    group_id = get_group_key(manager.config, message.chat.id)
+    user_data = await redis.get_by_message_thread_id(message.message_thread_id, group_id)
     if not user_data: return None  # noqa
 
     if user_data.is_banned:
@@ -115,6 +181,9 @@ async def handler(message: Message, manager: Manager, redis: RedisStorage) -> No
     else:
         user_data.is_banned = True
         text = manager.text_message.get("user_blocked")
+        if stats is not None:
+            # The messages of a banned user are ignored, so the topic no longer waits for a reply
+            await stats.close(user_data.id)
 
     # Reply with the specified text
     await message.reply(text)
@@ -1,28 +1,40 @@
 import asyncio
-from typing import Optional
+from typing import Any, Optional
 
 from aiogram import Router, F
 from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import MagicData
-from aiogram.types import Message
+from aiogram.methods import SendMessage
+from aiogram.types import Message, ReplyParameters
 from aiogram.utils.markdown import hlink
 
 from app.bot.manager import Manager
 from app.bot.types.album import Album
-from app.bot.utils.redis import RedisStorage
+from app.bot.utils.delivery import BLOCKED, get_delivery_error
+from app.bot.utils.groups import get_group_id, get_group_key
+from app.bot.utils.outbox import Operation, Outbox, outbox_callback, result_message_ids
+from app.bot.utils.redis import MessageStorage, RedisStorage, StatsStorage
+from app.bot.utils.sync_edit import sync_edit
+from app.bot.utils.texts import TextMessage
 
 router = Router()
 router.message.filter(
-    MagicData(F.event_chat.id == F.config.bot.GROUP_ID),  # type: ignore
+    MagicData(F.event_chat.id.in_(F.config.bot.GROUP_IDS)),  # type: ignore
+    F.chat.type.in_(["group", "supergroup"]),
+    F.message_thread_id.is_not(None),
+)
+router.edited_message.filter(
+    MagicData(F.event_chat.id.in_(F.config.bot.GROUP_IDS)),  # type: ignore
     F.chat.type.in_(["group", "supergroup"]),
     F.message_thread_id.is_not(None),
 )
 
 
 @router.message(F.forum_topic_created)
-async def handler(message: Message, manager: Manager, redis: RedisStorage) -> None:
+async def handler(message: Message, manager: Manager, redis: RedisStorage, outbox: Outbox) -> None:
     await asyncio.sleep(3)
-    user_data = await redis.get_by_message_thread_id(message.message_thread_id)
+    group_id = get_group_key(manager.config, message.chat.id)
+    user_data = await redis.get_by_message_thread_id(message.message_thread_id, group_id)
     if not user_data: return None  # noqa
 
     # Generate a URL for the user's profile
@@ -31,65 +43,197 @@ async def handler(message: Message, manager: Manager, redis: RedisStorage) -> No
     # Get the appropriate text based on the user's state
     text = manager.text_message.get("user_started_bot")
 
-    message = await message.bot.send_message(
-        chat_id=manager.config.bot.GROUP_ID,
-        text=text.format(name=hlink(user_data.full_name, url)),
-        message_thread_id=user_data.message_thread_id
+    # Send the message and pin it
+    await outbox.enqueue(
+        SendMessage(
+            chat_id=message.chat.id,
+            text=text.format(name=hlink(user_data.full_name, url)),
+            message_thread_id=user_data.message_thread_id,
+        ),
+        key=f"topic:{message.chat.id}:{message.message_thread_id}",
+        callback="pin",
     )
 
-    # Pin the message
-    await message.pin()
-
 
 @router.message(F.pinned_message | F.forum_topic_edited | F.forum_topic_closed | F.forum_topic_reopened)
-async def handler(message: Message) -> None:
+async def handler(message: Message, outbox: Outbox) -> None:
     """
     Delete service messages such as pinned, edited, closed, or reopened forum topics.
 
     :param message: Message object.
+    :param outbox: Outbox object.
     :return: None
     """
-    await message.delete()
+    await outbox.enqueue(message.delete(), key=f"delete:{message.chat.id}:{message.message_id}")
+
+
+@router.edited_message(F.from_user[F.is_bot.is_(False)])
+async def handler(message: Message, manager: Manager, messages: MessageStorage) -> None:
+    """
+    Propagate edited messages to the copies sent to the user.
+    If the copy can not be edited (e.g. the message is older than the mapping TTL), the moderator is told so.
+
+    :param message: The edited message.
+    :param manager: Manager object.
+    :param messages: MessageStorage object.
+    :return: None
+    """
+    user_message = await messages.get_user_message(message.message_id, get_group_key(manager.config, message.chat.id))
+    if not user_message: return None  # noqa
+
+    if not await sync_edit(message, *user_message):
+        text = manager.text_message.get("message_edited_not_sent")
+        # Reply to the edited message with the specified text, the reply is deleted after 5 seconds
+        await manager.reply(message, text)
+
+
+@outbox_callback("relay_to_user")
+async def relayed_to_user(
+        outbox: Outbox,
+        operation: Operation,
+        result: Any,
+        error: Optional[TelegramAPIError],
+) -> None:
+    """
+    Map the copies sent to the user to the moderator's messages and report the outcome in the forum topic.
+
+    :param outbox: Outbox object.
+    :param operation: The copy operation.
+    :param result: The copies or None.
+    :param error: The error or None.
+    :return: None
+    """
+    context = operation.context
+    text_message = TextMessage(context["language_code"])
+    delivery_error = None if error is None else get_delivery_error(error)
+
+    if delivery_error is not None:
+        # The user blocked the bot or deleted the account, the next messages are skipped
+        redis = RedisStorage(outbox.redis, outbox.health, outbox.config.bot.key(RedisStorage.NAME, tag=True))
+        await redis.mark_undeliverable(context["user_id"], delivery_error, outbox.config.redis.UNDELIVERABLE_TTL)
+        text = text_message.get("blocked_by_user" if delivery_error == BLOCKED else "user_unreachable")
+    elif error is not None:
+        # Retries are done by the RetryMiddleware and the outbox, the message could not be sent
+        text = text_message.get("message_not_sent")
+    else:
+        messages = MessageStorage(
+            outbox.redis, outbox.health, outbox.config.redis.MESSAGES_TTL, outbox.config.bot.key(MessageStorage.NAME),
+        )
+        await messages.add(
+            context["user_id"],
+            zip(result_message_ids(result), context["message_ids"]),
+            context.get("group_id"),
+        )
+        text = text_message.get("message_sent_to_user")
+
+    # The moderator gets the outcome after the last copy, and after any failed one
+    if context["reply_to"] is None and error is None:
+        return None
+
+    # Reply with the specified text, the reply is deleted after 5 seconds
+    reply_to = context["reply_to"] or context["message_ids"][0]
+    chat_id = get_group_id(outbox.config, context.get("group_id"))
+    await outbox.enqueue(
+        SendMessage(
+            chat_id=chat_id,
+            message_thread_id=context["message_thread_id"],
+            text=text,
+            reply_parameters=ReplyParameters(message_id=reply_to, allow_sending_without_reply=True),
+        ),
+        key=f"reply:{chat_id}:{reply_to}:0",
+        callback="delete_later",
+        context={"delay": 5},
+    )
 
 
 @router.message(F.media_group_id, F.from_user[F.is_bot.is_(False)])
 @router.message(F.media_group_id.is_(None), F.from_user[F.is_bot.is_(False)])
-async def handler(message: Message, manager: Manager, redis: RedisStorage, album: Optional[Album] = None) -> None:
+async def handler(
+        message: Message,
+        manager: Manager,
+        redis: RedisStorage,
+        messages: MessageStorage,
+        outbox: Outbox,
+        stats: Optional[StatsStorage] = None,
+        album: Optional[Album] = None,
+) -> None:
     """
     Handles user messages and sends them to the respective user.
     If silent mode is enabled for the user, the messages are ignored.
 
+    The copies are enqueued to the outbox, they are mapped to the messages and the outcome is reported once sent.
+
     :param message: Message object.
     :param manager: Manager object.
     :param redis: RedisStorage object.
+    :param messages: MessageStorage object.
+    :param outbox: Outbox object.
+    :param stats: StatsStorage object or None if the statistics are disabled.
     :param album: Album object or None.
     :return: None
     """
-    user_data = await redis.get_by_message_thread_id(message.message_thread_id)
+    group_id = get_group_key(manager.config, message.chat.id)
+    user_data = await redis.get_by_message_thread_id(message.message_thread_id, group_id)
     if not user_data: return None  # noqa
 
     if user_data.message_silent_mode:
         # If silent mode is enabled, ignore all messages.
         return
 
-    text = manager.text_message.get("message_sent_to_user")
-
-    try:
-        if not album:
-            await message.copy_to(chat_id=user_data.id)
-        else:
-            await album.copy_to(chat_id=user_data.id)
-
-    except TelegramAPIError as ex:
-        if "blocked" in ex.message:
-            text = manager.text_message.get("blocked_by_user")
-
-    except (Exception,):
-        text = manager.text_message.get("message_not_sent")
+    if user_data.is_undeliverable():
+        # The user can not receive messages, so the API is not called until the user comes back
+        text = manager.text_message.get("blocked_by_user" if user_data.undeliverable == BLOCKED else "user_unreachable")
+        # Reply to the message with the specified text, the reply is deleted after 5 seconds
+        await manager.reply(message, text)
+        return
 
-    # Reply to the edited message with the specified text
-    msg = await message.reply(text)
-    # Wait for 5 seconds before deleting the reply
-    await asyncio.sleep(5)
-    # Delete the reply to the edited message
-    await msg.delete()
+    # Reply to the user's message the moderator replied to, if it is still mapped
+    reply_to_message_id = None
+    if message.reply_to_message and not message.reply_to_message.forum_topic_created:
+        user_message = await messages.get_user_message(message.reply_to_message.message_id, group_id)
+        if user_message and user_message[0] == user_data.id:
+            reply_to_message_id = user_message[1]
+
+    if not album:
+        copies = [(
+            message.copy_to(
+                chat_id=user_data.id,
+                reply_parameters=ReplyParameters(
+                    message_id=reply_to_message_id,
+                    allow_sending_without_reply=True,
+                ) if reply_to_message_id else None,
+            ),
+            [message.message_id],
+        )]
+    elif reply_to_message_id:
+        # copyMessages has no reply parameters, so an album sent as a reply is rebuilt as a media group
+        copies = [(
+            album.copy_to(
+                chat_id=user_data.id,
+                reply_to_message_id=reply_to_message_id,
+                allow_sending_without_reply=True,
+            ),
+            [m.message_id for m in album.media_messages],
+        )]
+    else:
+        copies = [(method, method.message_ids) for method in album.copy_messages_to(chat_id=user_data.id)]
+
+    for i, (method, message_ids) in enumerate(copies):
+        await outbox.enqueue(
+            method,
+            key=f"relay:{message.chat.id}:{message_ids[0]}",
+            callback="relay_to_user",
+            context={
+                "user_id": user_data.id,
+                "message_ids": message_ids,
+                "group_id": group_id,
+                "message_thread_id": message.message_thread_id,
+                "language_code": manager.text_message.language_code,
+                # The moderator gets the outcome once, after the last copy
+                "reply_to": message.message_id if i == len(copies) - 1 else None,
+            },
+        )
+
+    if stats is not None:
+        # The first reply since the user wrote is the first response of the topic
+        await stats.moderator_message(user_data.id, sum(len(message_ids) for _, message_ids in copies))
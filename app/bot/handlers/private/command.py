@@ -1,14 +1,22 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from aiogram import Router, F
-from aiogram.filters import Command, MagicData
-from aiogram.types import Message
-from aiogram_newsletter.manager import ANManager
+from aiogram.filters import Command, CommandObject, MagicData
+from aiogram.types import BufferedInputFile, Message
 
 from app.bot.handlers.private.windows import Window
 from app.bot.manager import Manager
 from app.bot.utils.create_forum_topic import get_or_create_forum_topic
-from app.bot.utils.redis import RedisStorage
+from app.bot.utils.profiler import SamplingProfiler
+from app.bot.utils.redis import RedisStorage, Segment
 from app.bot.utils.redis.models import UserData
 
+if TYPE_CHECKING:
+    from app.bot.newsletter import NewsletterEngine
+    from app.bot.newsletter.handlers import NewsletterManager
+
 router = Router()
 router.message.filter(F.chat.type == "private")
 
@@ -82,19 +90,70 @@ async def handler(message: Message, manager: Manager) -> None:
 )
 async def handler(
         message: Message,
+        command: CommandObject,
         manager: Manager,
-        an_manager: ANManager,
-        redis: RedisStorage,
+        an_manager: NewsletterManager,
+        newsletter_engine: NewsletterEngine,
 ) -> None:
     """
     Handles the /newsletter command.
 
+    The arguments select the users the newsletters are sent to, e.g. /newsletter language=en active=30.
+
     :param message: Message object.
+    :param command: CommandObject with the segment filters.
     :param manager: Manager object.
-    :param redis: RedisStorage object.
-    :param an_manager: Manager object from aiogram_newsletter.
+    :param an_manager: Manager object of the newsletter menu.
+    :param newsletter_engine: NewsletterEngine object.
+    :return: None
+    """
+    try:
+        segment = Segment.parse(command.args)
+    except ValueError:
+        text = manager.text_message.get("newsletter_segment_invalid")
+        await manager.send_message(text)
+    else:
+        total = await newsletter_engine.segments.count(segment)
+        await an_manager.newsletter_menu(segment, total, Window.main_menu)
+    await manager.delete_message(message)
+
+
+@router.message(
+    Command("profile"),
+    MagicData(F.event_from_user.id == F.config.bot.DEV_ID),  # type: ignore
+    MagicData(F.config.profiler.ENABLED),  # type: ignore
+)
+async def handler(
+        message: Message,
+        command: CommandObject,
+        manager: Manager,
+        profiler: SamplingProfiler,
+) -> None:
+    """
+    Handles the /profile command.
+
+    Profiles the live process for the given number of seconds, e.g. /profile 30, the report is sent as a document.
+
+    :param message: Message object.
+    :param command: CommandObject with the duration.
+    :param manager: Manager object.
+    :param profiler: SamplingProfiler object.
     :return: None
     """
-    users_ids = await redis.get_all_users_ids()
-    await an_manager.newsletter_menu(users_ids, Window.main_menu)
+    try:
+        seconds = float(command.args) if command.args else manager.config.profiler.DURATION
+    except ValueError:
+        seconds = manager.config.profiler.DURATION
+    seconds = min(max(seconds, 1), profiler.max_duration)
+
+    async def send(summary: str, report: str) -> None:
+        document = BufferedInputFile(report.encode(), filename=f"profile_{int(message.date.timestamp())}.txt")
+        await message.answer_document(document, caption=summary)
+
+    # The profile runs in the background, so the update is not held while it runs
+    if profiler.start(seconds, send):
+        text = manager.text_message.get("profile_started").format(seconds=seconds)
+    else:
+        text = manager.text_message.get("profile_busy")
+    await manager.send_message(text)
     await manager.delete_message(message)
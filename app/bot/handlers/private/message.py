@@ -1,40 +1,165 @@
-import asyncio
+from typing import Any, Optional
 
 from aiogram import Router, F
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import StateFilter
-from aiogram.types import Message
+from aiogram.methods import SendMessage
+from aiogram.types import Message, ReplyParameters
 
 from app.bot.manager import Manager
 from app.bot.types.album import Album
 from app.bot.utils.create_forum_topic import (
-    create_forum_topic,
+    create_user_topic,
     get_or_create_forum_topic,
 )
-from app.bot.utils.redis import RedisStorage
+from app.bot.utils.exceptions import CreateForumTopicException, NotAForumException, NotEnoughRightsException
+from app.bot.utils.groups import get_group_id, get_group_key, get_user_group
+from app.bot.utils.outbox import Operation, Outbox, outbox_callback, result_message_ids
+from app.bot.utils.redis import MessageStorage, RedisStorage, StatsStorage
 from app.bot.utils.redis.models import UserData
+from app.bot.utils.sync_edit import sync_edit
+from app.bot.utils.texts import TextMessage
 
 router = Router()
 router.message.filter(F.chat.type == "private", StateFilter(None))
+router.edited_message.filter(F.chat.type == "private")
 
 
 @router.edited_message()
-async def handle_edited_message(message: Message, manager: Manager) -> None:
+async def handle_edited_message(
+        message: Message,
+        manager: Manager,
+        messages: MessageStorage,
+        user_data: UserData,
+) -> None:
     """
     Handle edited messages.
+    The edit is propagated to the copy in the forum topic. If it can not be (e.g. the message is older than the
+    mapping TTL), the user is told that the message was edited only in their chat.
 
     :param message: The edited message.
     :param manager: Manager object.
+    :param messages: MessageStorage object.
+    :param user_data: UserData object.
     :return: None
     """
+    # Check if the user is banned
+    if user_data.is_banned:
+        return
+
+    group_message = await messages.get_group_message(message.chat.id, message.message_id)
+    if group_message is not None:
+        group_id, group_message_id = group_message
+        if await sync_edit(message, get_group_id(manager.config, group_id), group_message_id):
+            return
+
     # Get the text for the edited message
     text = manager.text_message.get("message_edited")
-    # Reply to the edited message with the specified text
-    msg = await message.reply(text)
-    # Wait for 5 seconds before deleting the reply
-    await asyncio.sleep(5)
-    # Delete the reply to the edited message
-    await msg.delete()
+    # Reply to the edited message with the specified text, the reply is deleted after 5 seconds
+    await manager.reply(message, text)
+
+
+@outbox_callback("relay_to_group")
+async def relayed_to_group(
+        outbox: Outbox,
+        operation: Operation,
+        result: Any,
+        error: Optional[TelegramAPIError],
+) -> None:
+    """
+    Map the copies in the forum topic to the user's messages and confirm them to the user.
+    If the forum topic was deleted, a new one is created and the copy is enqueued again. Any other error is reported
+    to DEV_ID and the user is told that the message was not sent.
+
+    :param outbox: Outbox object.
+    :param operation: The copy operation.
+    :param result: The copies or None.
+    :param error: The error or None.
+    :return: None
+    """
+    context = operation.context
+
+    if error is not None:
+        if "message thread not found" not in error.message:
+            # E.g. the bot lost its rights in the group
+            await outbox.report(operation, error)
+            await _not_sent(outbox, operation)
+            return None
+
+        redis = RedisStorage(outbox.redis, outbox.health, outbox.config.bot.key(RedisStorage.NAME, tag=True))
+        user_data = await redis.get_user(context["user_id"])
+        if not user_data: return None  # noqa
+
+        # The other copies to the deleted topic find the new one already created
+        if (
+                user_data.message_thread_id == operation.method.message_thread_id
+                and get_user_group(outbox.config, user_data) == operation.method.chat_id
+        ):
+            try:
+                await create_user_topic(outbox.bot, outbox.config, user_data)
+            except Exception as ex:
+                # The configuration errors are sent as their message, like the errors router does
+                known = isinstance(ex, (CreateForumTopicException, NotEnoughRightsException, NotAForumException))
+                await outbox.report(operation, ex, ex.message if known else None)
+                await _not_sent(outbox, operation)
+                return None
+            await redis.update_user(user_data.id, user_data)
+
+        await outbox.enqueue(
+            operation.method.model_copy(update={
+                "chat_id": get_user_group(outbox.config, user_data),
+                "message_thread_id": user_data.message_thread_id,
+            }),
+            key=f"{operation.key}:{user_data.message_thread_id}",
+            callback=operation.callback,
+            context=context,
+        )
+        return None
+
+    messages = MessageStorage(
+        outbox.redis, outbox.health, outbox.config.redis.MESSAGES_TTL, outbox.config.bot.key(MessageStorage.NAME),
+    )
+    await messages.add(
+        context["user_id"],
+        zip(context["message_ids"], result_message_ids(result)),
+        get_group_key(outbox.config, operation.method.chat_id),
+    )
+
+    if context["reply_to"] is not None:
+        # Send a confirmation message to the user, it is deleted after 5 seconds
+        await outbox.enqueue(
+            SendMessage(
+                chat_id=context["user_id"],
+                text=TextMessage(context["language_code"]).get("message_sent"),
+                reply_parameters=ReplyParameters(
+                    message_id=context["reply_to"],
+                    allow_sending_without_reply=True,
+                ),
+            ),
+            key=f"reply:{context['user_id']}:{context['reply_to']}:0",
+            callback="delete_later",
+            context={"delay": 5},
+        )
+
+
+async def _not_sent(outbox: Outbox, operation: Operation) -> None:
+    """
+    Tell the user that the messages of a copy operation were not sent to the forum topic.
+
+    :param outbox: Outbox object.
+    :param operation: The copy operation.
+    :return: None
+    """
+    context = operation.context
+    reply_to = context["reply_to"] or context["message_ids"][0]
+    await outbox.enqueue(
+        SendMessage(
+            chat_id=context["user_id"],
+            text=TextMessage(context["language_code"]).get("message_not_sent"),
+            reply_parameters=ReplyParameters(message_id=reply_to, allow_sending_without_reply=True),
+        ),
+        key=f"not_sent:{context['user_id']}:{reply_to}",
+    )
 
 
 @router.message(F.media_group_id)
@@ -43,17 +168,25 @@ async def handle_incoming_message(
         message: Message,
         manager: Manager,
         redis: RedisStorage,
+        messages: MessageStorage,
+        outbox: Outbox,
         user_data: UserData,
+        stats: StatsStorage | None = None,
         album: Album | None = None,
 ) -> None:
     """
     Handles incoming messages and copies them to the forum topic.
     If the user is banned, the messages are ignored.
 
+    The copies are enqueued to the outbox, they are mapped to the messages and confirmed to the user once sent.
+
     :param message: The incoming message.
     :param manager: Manager object.
     :param redis: RedisStorage object.
+    :param messages: MessageStorage object.
+    :param outbox: Outbox object.
     :param user_data: UserData object.
+    :param stats: StatsStorage object or None if the statistics are disabled.
     :param album: Album object or None.
     :return: None
     """
@@ -61,48 +194,69 @@ async def handle_incoming_message(
     if user_data.is_banned:
         return
 
-    async def copy_message_to_topic():
-        """
-        Copies the message or album to the forum topic.
-        If no album is provided, the message is copied. Otherwise, the album is copied.
-        """
-        message_thread_id = await get_or_create_forum_topic(
-            message.bot,
-            redis,
-            manager.config,
-            user_data,
-        )
+    message_thread_id = await get_or_create_forum_topic(
+        message.bot,
+        redis,
+        manager.config,
+        user_data,
+    )
+
+    group_id = get_user_group(manager.config, user_data)
 
-        if not album:
-            await message.forward(
-                chat_id=manager.config.bot.GROUP_ID,
+    # Reply to the copy of the message the user replied to, if it is still mapped to the current topic
+    reply_to_message_id = None
+    if message.reply_to_message:
+        group_message = await messages.get_group_message(message.chat.id, message.reply_to_message.message_id)
+        if group_message is not None and group_message[0] == user_data.group_id:
+            reply_to_message_id = group_message[1]
+
+    if not album:
+        # Copied rather than forwarded, so the copy can be edited when the message is
+        copies = [(
+            message.copy_to(
+                chat_id=group_id,
                 message_thread_id=message_thread_id,
-            )
-        else:
-            await album.copy_to(
-                chat_id=manager.config.bot.GROUP_ID,
+                reply_parameters=ReplyParameters(
+                    message_id=reply_to_message_id,
+                    allow_sending_without_reply=True,
+                ) if reply_to_message_id else None,
+            ),
+            [message.message_id],
+        )]
+    elif reply_to_message_id:
+        # copyMessages has no reply parameters, so an album sent as a reply is rebuilt as a media group
+        copies = [(
+            album.copy_to(
+                chat_id=group_id,
+                message_thread_id=message_thread_id,
+                reply_to_message_id=reply_to_message_id,
+                allow_sending_without_reply=True,
+            ),
+            [m.message_id for m in album.media_messages],
+        )]
+    else:
+        copies = [
+            (method, method.message_ids)
+            for method in album.copy_messages_to(
+                chat_id=group_id,
                 message_thread_id=message_thread_id,
             )
+        ]
 
-    try:
-        await copy_message_to_topic()
-    except TelegramBadRequest as ex:
-        if "message thread not found" in ex.message:
-            user_data.message_thread_id = await create_forum_topic(
-                message.bot,
-                manager.config,
-                user_data.full_name,
-            )
-            await redis.update_user(user_data.id, user_data)
-            await copy_message_to_topic()
-        else:
-            raise
-
-    # Send a confirmation message to the user
-    text = manager.text_message.get("message_sent")
-    # Reply to the edited message with the specified text
-    msg = await message.reply(text)
-    # Wait for 5 seconds before deleting the reply
-    await asyncio.sleep(5)
-    # Delete the reply to the edited message
-    await msg.delete()
+    for i, (method, message_ids) in enumerate(copies):
+        await outbox.enqueue(
+            method,
+            key=f"relay:{message.chat.id}:{message_ids[0]}",
+            callback="relay_to_group",
+            context={
+                "user_id": user_data.id,
+                "message_ids": message_ids,
+                "language_code": manager.text_message.language_code,
+                # The user is confirmed once, after the last copy
+                "reply_to": message.message_id if i == len(copies) - 1 else None,
+            },
+        )
+
+    if stats is not None:
+        # The topic waits for a reply from now on
+        await stats.user_message(user_data.id, sum(len(message_ids) for _, message_ids in copies))
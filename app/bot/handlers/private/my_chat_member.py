@@ -4,6 +4,8 @@ from aiogram.types import ChatMemberUpdated
 from aiogram.utils.markdown import hlink
 
 from app.bot.manager import Manager
+from app.bot.utils.delivery import BLOCKED
+from app.bot.utils.groups import get_user_group
 from app.bot.utils.redis import RedisStorage
 from app.bot.utils.redis.models import UserData
 
@@ -30,6 +32,12 @@ async def handle_chat_member_update(
     # Update the user's state based on the new chat member status
     user_data.state = update.new_chat_member.status
     await redis.update_user(user_data.id, user_data)
+    if user_data.state == ChatMemberStatus.MEMBER:
+        # The user came back, messages are delivered again
+        await redis.clear_undeliverable(user_data.id)
+    elif user_data.state == ChatMemberStatus.KICKED:
+        # The user blocked the bot, messages are skipped without calling the API
+        await redis.mark_undeliverable(user_data.id, BLOCKED, manager.config.redis.UNDELIVERABLE_TTL)
 
     if user_data.state == ChatMemberStatus.MEMBER:
         text = manager.text_message.get("user_restarted_bot")
@@ -39,7 +47,7 @@ async def handle_chat_member_update(
     url = f"https://t.me/{user_data.username[1:]}" if user_data.username != "-" else f"tg://user?id={user_data.id}"
 
     await update.bot.send_message(
-        chat_id=manager.config.bot.GROUP_ID,
+        chat_id=get_user_group(manager.config, user_data),
         text=text.format(name=hlink(user_data.full_name, url)),
         message_thread_id=user_data.message_thread_id,
     )
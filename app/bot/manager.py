@@ -17,6 +17,8 @@ from aiogram.types.base import (
     UNSET_PARSE_MODE,
 )
 
+from app.bot.utils.drain import Drainer
+from app.bot.utils.outbox import Outbox
 from app.bot.utils.texts import TextMessage
 from app.config import Config
 
@@ -49,6 +51,8 @@ class Manager:
         self.user: User = data.get("event_from_user")
 
         self.config: Config = data.get("config")
+        self.drainer: Drainer = data.get("drainer")
+        self.outbox: Outbox = data.get("outbox")
         self.text_message = TextMessage(language_code)
 
         self.__emoji = emoji
@@ -112,6 +116,32 @@ class Manager:
         with suppress(TelegramBadRequest):
             await message.delete()
 
+    def delete_message_later(self, message: Message, delay: float = 5) -> None:
+        """
+        Delete a message after a delay without holding the handler.
+
+        Pending deletions are persisted on shutdown and rescheduled on the next start.
+
+        :param message: The message to be deleted.
+        :param delay: The delay in seconds.
+        """
+        self.drainer.delete_later(message.chat.id, message.message_id, delay)
+
+    async def reply(self, message: Message, text: str, delay: float = 5) -> None:
+        """
+        Reply to a message through the outbox, the reply is deleted after a delay.
+
+        :param message: The message to reply to.
+        :param text: The text of the reply.
+        :param delay: The delay in seconds.
+        """
+        await self.outbox.enqueue(
+            message.reply(text),
+            key=f"reply:{message.chat.id}:{message.message_id}:{message.edit_date or 0}",
+            callback="delete_later",
+            context={"delay": delay},
+        )
+
     async def delete_previous_message(self) -> None | Message:
         """
         Delete the previous message.
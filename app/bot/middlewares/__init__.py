@@ -1,9 +1,14 @@
 from aiogram import Dispatcher
-from aiogram_newsletter.middleware import AiogramNewsletterMiddleware
 
 from .album import AlbumMiddleware
+from .dedup import DedupMiddleware
+from .drain import DrainMiddleware
+from .log_context import LogContextMiddleware
 from .manager import ManagerMiddleware
+from .newsletter import NewsletterMiddleware
+from .recorder import RecorderMiddleware
 from .redis import RedisMiddleware
+from .tenant import TenantMiddleware
 from .throttling import ThrottlingMiddleware
 
 
@@ -18,8 +23,30 @@ def register_middlewares(dp: Dispatcher, **kwargs) -> None:
     Returns:
         None
     """
-    # Register RedisMiddleware with the provided Redis instance
-    dp.update.outer_middleware.register(RedisMiddleware(kwargs["redis"]))
+    if kwargs["config"].redis.DEDUP_TTL:
+        # Register DedupMiddleware first, so the updates delivered twice are neither handled nor persisted on shutdown
+        dp.update.outer_middleware.register(
+            DedupMiddleware(kwargs["redis"], kwargs.get("redis_health"), kwargs["config"].redis.DEDUP_TTL)
+        )
+
+    # Register DrainMiddleware next, so every handled update is tracked until it is finished
+    dp.update.outer_middleware.register(DrainMiddleware())
+
+    # Register LogContextMiddleware to attach update_id, chat_id and handler name to log records
+    log_context = LogContextMiddleware()
+    dp.update.outer_middleware.register(log_context)
+    for observer in dp.observers.values():
+        if observer.event_name not in ("update", "error"):
+            observer.middleware.register(log_context)
+
+    if kwargs.get("recorder") is not None:
+        # Register RecorderMiddleware after the dedup, drain and log context middlewares and before the others, so
+        # every update that is handled is recorded once (the updates delivered twice are dropped before it)
+        dp.update.outer_middleware.register(RecorderMiddleware(kwargs["recorder"]))
+    # Register RedisMiddleware with the provided Redis instance, serving users locally while Redis is unavailable
+    dp.update.outer_middleware.register(
+        RedisMiddleware(kwargs["redis"], kwargs.get("redis_health"), kwargs["config"].redis.MESSAGES_TTL)
+    )
     # Register ManagerMiddleware
     dp.update.outer_middleware.register(ManagerMiddleware())
 
@@ -28,10 +55,11 @@ def register_middlewares(dp: Dispatcher, **kwargs) -> None:
     # Register ThrottlingMiddleware for message processing
     dp.message.middleware.register(ThrottlingMiddleware())
 
-    # Register AiogramNewsletterMiddleware for newsletter processing
-    dp.update.middleware.register(AiogramNewsletterMiddleware(kwargs["apscheduler"]))
+    # Register NewsletterMiddleware for newsletter processing, it loads the newsletter subsystem on first use
+    dp.update.middleware.register(NewsletterMiddleware())
 
 
 __all__ = [
+    "TenantMiddleware",
     "register_middlewares",
 ]
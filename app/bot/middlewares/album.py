@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from asyncio import sleep
+from asyncio import Event, sleep
 from typing import Any, Awaitable, Callable, Dict, MutableMapping, Optional, Tuple, cast
 
 from aiogram import BaseMiddleware
@@ -71,25 +71,32 @@ class AlbumMiddleware(BaseMiddleware):
 
             # If the media group ID is already in the cache
             if key in self.cache:
-                if content_type not in self.cache[key]:
-                    self.cache[key][content_type] = [media]
-                    return None
                 self.cache[key]["messages"].append(event)
-                self.cache[key][content_type].append(media)
+                self.cache[key].setdefault(content_type, []).append(media)
+                # Stay in flight until the album is handled, so a shutdown drain persists all of its parts
+                await self.cache[key]["handled"].wait()
                 return None
 
             # If the media group ID is not in the cache, add it with the media data
+            handled = Event()
             self.cache[key] = {
                 content_type: [media],
                 "messages": [event],
                 "caption": event.html_text,
+                "handled": handled,
             }
             await sleep(self.latency)
 
-            # Validate the album data using the Album model
-            data[self.album_key] = Album.model_validate(
-                self.cache[key], context={"bot": data["bot"]}
-            )
+            try:
+                # Validate the album data using the Album model
+                album_data = {k: v for k, v in self.cache[key].items() if k != "handled"}
+                data[self.album_key] = Album.model_validate(
+                    album_data, context={"bot": data["bot"]}
+                )
+                # Call the handler function with the event and data
+                return await handler(event, data)
+            finally:
+                handled.set()
 
         # Call the handler function with the event and data
         return await handler(event, data)
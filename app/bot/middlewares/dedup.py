@@ -0,0 +1,71 @@
+from typing import Callable, Dict, Any, Awaitable, MutableMapping, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from cachetools import LRUCache
+from redis.asyncio import Redis
+
+from app.bot.utils.redis import RedisHealth
+from app.bot.utils.redis.updates import UpdateStorage
+from app.config import Config
+from app.metrics import registry
+
+DUPLICATES = registry.counter("updates_duplicate_total", "Duplicate updates dropped, by where they were detected.")
+
+
+class DedupMiddleware(BaseMiddleware):
+    """
+    Middleware for dropping the updates delivered twice, e.g. refetched after a restart during polling.
+
+    The recently seen updates are remembered locally, so a duplicate within the process is dropped without a Redis
+    call. The others are claimed in Redis (see UpdateStorage), which catches the duplicates across restarts and
+    replicas. The updates restored by the drainer were claimed before the shutdown, so they are not checked.
+    """
+
+    def __init__(self, redis: Redis, health: RedisHealth | None = None, ttl: int = 60 * 60, size: int = 10_000) -> None:
+        """
+        Initializes the DedupMiddleware instance.
+
+        :param redis: The Redis instance for data storage.
+        :param health: The RedisHealth instance or None to always use Redis.
+        :param ttl: The number of seconds the claims are kept in Redis.
+        :param size: The number of updates remembered locally.
+        """
+        self.redis = redis
+        self.health = health
+        self.ttl = ttl
+        self.seen: MutableMapping[Tuple[str, int], bool] = LRUCache(maxsize=size)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function, None for a duplicate.
+        """
+        if not isinstance(event, Update) or data.get("restored"):
+            return await handler(event, data)
+
+        # The updates of each bot are claimed under its own keys
+        config: Config = data["config"]
+        updates = UpdateStorage(self.redis, self.health, self.ttl, config.bot.key(UpdateStorage.NAME))
+
+        key = (updates.NAME, event.update_id)
+        if key in self.seen:
+            DUPLICATES.inc(source="local")
+            return None
+        self.seen[key] = True
+
+        if not await updates.claim(event.update_id):
+            DUPLICATES.inc(source="redis")
+            return None
+
+        # Call the handler function with the event and data
+        return await handler(event, data)
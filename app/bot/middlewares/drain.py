@@ -0,0 +1,43 @@
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.bot.utils.drain import Drainer
+
+
+class DrainMiddleware(BaseMiddleware):
+    """
+    Middleware for tracking the in-flight updates, so they are finished or persisted on shutdown.
+
+    Each bot has its own Drainer, it is taken from the handler data.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        drainer: Drainer = data["drainer"]
+        if drainer.draining:
+            # Updates that arrive while draining are handled on the next start
+            return await drainer.persist_update(event)
+
+        drainer.begin(event)
+        try:
+            # Call the handler function with the event and data
+            return await handler(event, data)
+        finally:
+            drainer.end(event)
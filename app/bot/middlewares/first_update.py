@@ -0,0 +1,51 @@
+import logging
+import time
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.metrics import registry
+
+STARTUP_FIRST_UPDATE = registry.gauge(
+    "startup_first_update_seconds", "Time from process start until the first update is handled."
+)
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """
+    Middleware for measuring the time from process start until the first update is handled.
+    """
+
+    def __init__(self, started_at: float) -> None:
+        """
+        Initializes the FirstUpdateMiddleware instance.
+
+        :param started_at: The time.monotonic() value taken when the process started.
+        """
+        self.started_at = started_at
+        self.measured = False
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        try:
+            # Call the handler function with the event and data
+            return await handler(event, data)
+        finally:
+            if not self.measured:
+                self.measured = True
+                elapsed = time.monotonic() - self.started_at
+                STARTUP_FIRST_UPDATE.set(elapsed)
+                logging.info(f"First update handled {elapsed:.2f}s after process start")
@@ -0,0 +1,44 @@
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import TelegramObject, Update, Chat
+
+from app.logger import update_id_var, chat_id_var, handler_var
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Middleware for attaching the update context to log records.
+
+    Registered as an outer update middleware it sets update_id and chat_id, registered as an inner event middleware
+    it sets the name of the handler.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        if isinstance(event, Update):
+            chat: Chat | None = data.get("event_chat")
+            update_id_var.set(event.update_id)
+            chat_id_var.set(chat.id if chat else None)
+
+        handler_object: HandlerObject | None = data.get("handler")
+        if handler_object is not None:
+            # Handlers share names within a module, so the line number tells them apart
+            callback = handler_object.callback
+            handler_var.set(f"{callback.__module__}.{callback.__name__}:{callback.__code__.co_firstlineno}")
+
+        # Call the handler function with the event and data
+        return await handler(event, data)
@@ -0,0 +1,42 @@
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from app.bot.newsletter import NewsletterLoader
+from app.config import Config
+
+
+class NewsletterMiddleware(BaseMiddleware):
+    """
+    Middleware for passing the newsletter manager to DEV_ID updates.
+
+    The newsletter subsystem is loaded on the first update from DEV_ID, other users never pay for it. Each bot has
+    its own NewsletterLoader and DEV_ID, they are taken from the handler data.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        user: User | None = data.get("event_from_user")
+        config: Config = data["config"]
+
+        if user is not None and user.id == config.bot.DEV_ID:
+            # Delegate to AiogramNewsletterMiddleware, which passes an_manager to the handlers
+            loader: NewsletterLoader = data["newsletter"]
+            middleware = await loader.load()
+            return await middleware(handler, event, data)
+
+        # Call the handler function with the event and data
+        return await handler(event, data)
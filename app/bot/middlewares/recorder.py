@@ -0,0 +1,41 @@
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.bot.utils.recorder import UpdateRecorder
+
+
+class RecorderMiddleware(BaseMiddleware):
+    """
+    Middleware for recording incoming updates for later replay.
+    """
+
+    def __init__(self, recorder: UpdateRecorder) -> None:
+        """
+        Initializes the RecorderMiddleware instance.
+
+        :param recorder: The UpdateRecorder instance the updates are written to.
+        """
+        self.recorder = recorder
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        if isinstance(event, Update):
+            # Dump the update as the Bot API sent it, the rest is done by the recorder thread
+            self.recorder.record(event.model_dump(mode="json", exclude_unset=True))
+
+        # Call the handler function with the event and data
+        return await handler(event, data)
@@ -4,9 +4,10 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, User, Chat
 from redis.asyncio import Redis
 
-from app.bot.utils.redis import RedisStorage
+from app.bot.utils.redis import MessageStorage, RedisHealth, RedisStorage, StatsStorage
 from app.bot.utils.redis.models import UserData
 from app.bot.utils.texts import SUPPORTED_LANGUAGES
+from app.config import Config
 
 
 class RedisMiddleware(BaseMiddleware):
@@ -15,15 +16,21 @@ class RedisMiddleware(BaseMiddleware):
 
     Args:
         redis (Redis): The Redis instance for data storage.
+        health (RedisHealth): The Redis health monitor serving users locally while Redis is unavailable.
+        messages_ttl (int): The number of seconds the mapping between user and group messages is kept.
     """
 
-    def __init__(self, redis: Redis) -> None:
+    def __init__(self, redis: Redis, health: RedisHealth | None = None, messages_ttl: int = 7 * 24 * 60 * 60) -> None:
         """
         Initializes the RedisMiddleware instance.
 
         :param redis: The Redis instance for data storage.
+        :param health: The RedisHealth instance or None to always use Redis.
+        :param messages_ttl: The number of seconds the mapping between user and group messages is kept.
         """
         self.redis = redis
+        self.health = health
+        self.messages_ttl = messages_ttl
 
     async def __call__(
             self,
@@ -39,8 +46,9 @@ class RedisMiddleware(BaseMiddleware):
         :param data: Additional data.
         :return: The result of the handler function.
         """
-        # Create an instance of RedisStorage using the provided Redis instance
-        redis = RedisStorage(self.redis)
+        # Create an instance of RedisStorage using the provided Redis instance, with the keys of the bot
+        config: Config = data["config"]
+        redis = RedisStorage(self.redis, self.health, config.bot.key(RedisStorage.NAME, tag=True))
 
         # Extract the chat and user objects from data
         chat: Chat = data.get("event_chat")
@@ -63,6 +71,12 @@ class RedisMiddleware(BaseMiddleware):
                 user_data.full_name = user.full_name
                 user_data.username = f"@{user.username}" if user.username else "-"
 
+            if user_data.undeliverable is not None and not getattr(event, "my_chat_member", None):
+                # The user wrote to the bot, so messages to the user are delivered again (a block is reported by
+                # my_chat_member, which sets the mark itself)
+                user_data.undeliverable, user_data.undeliverable_until = None, None
+                await redis.clear_undeliverable(user.id)
+
             if len(SUPPORTED_LANGUAGES.keys()) == 1:
                 # If only one language is supported, set user language_code to the first language
                 user_data.language_code = list(SUPPORTED_LANGUAGES.keys())[0]
@@ -73,8 +87,15 @@ class RedisMiddleware(BaseMiddleware):
             # For group chats or if the user object is None, set user_data to None
             user_data = None
 
-        # Add redis and user_data to data for use in subsequent handlers
+        # Add redis, messages, stats and user_data to data for use in subsequent handlers
         data["redis"] = redis
+        data["messages"] = MessageStorage(
+            self.redis, self.health, self.messages_ttl, config.bot.key(MessageStorage.NAME),
+        )
+        data["stats"] = StatsStorage(
+            self.redis, self.health, config.stats.RETENTION, config.stats.UTC_OFFSET,
+            config.bot.key(StatsStorage.NAME, tag=True),
+        ) if config.stats.ENABLED else None
         data["user_data"] = user_data
 
         # Call the handler function with the event and data
@@ -0,0 +1,49 @@
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject
+
+from app.bot.tenant import Tenant
+from app.metrics import tenant_var
+
+
+class TenantMiddleware(BaseMiddleware):
+    """
+    Middleware for passing the services of the bot an update was received by to the handlers.
+
+    The handler data of the main bot is replaced in place, so the error handlers see the same services.
+    """
+
+    def __init__(self, tenants: Dict[int, Tenant]) -> None:
+        """
+        Initializes the TenantMiddleware instance.
+
+        :param tenants: The Tenant instances by the ID of their bot.
+        """
+        self.tenants = tenants
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        bot: Bot = data["bot"]
+        tenant = self.tenants[bot.id]
+        data.update(tenant.workflow_data)
+
+        # Label the metrics of the update with the bot
+        token = tenant_var.set(tenant.namespace)
+        try:
+            # Call the handler function with the event and data
+            return await handler(event, data)
+        finally:
+            tenant_var.reset(token)
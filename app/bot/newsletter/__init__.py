@@ -0,0 +1,7 @@
+from .engine import NewsletterEngine
+from .loader import NewsletterLoader
+
+__all__ = [
+    "NewsletterEngine",
+    "NewsletterLoader",
+]
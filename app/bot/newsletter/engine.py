@@ -0,0 +1,532 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import Message
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.bot.utils.delivery import BLOCKED, DEACTIVATED, get_delivery_error
+from app.bot.utils.outbox import RENEW_LOCK, RateLimiter, TRANSIENT_ERRORS
+from app.bot.utils.redis import RedisStorage, Segment, SegmentIndex
+from app.bot.utils.texts import TextMessage, format_duration
+from app.config import NewsletterConfig
+from app.metrics import registry
+from app.serialization import json_dumps, json_loads
+
+NEWSLETTER_SENT = registry.counter("newsletter_sent_total", "Newsletter messages sent, by outcome.")
+NEWSLETTER_REMAINING = registry.gauge("newsletter_remaining", "Recipients a newsletter is not sent to yet, by ID.")
+
+DELIVERED = "delivered"
+FAILED = "failed"
+OUTCOMES = (DELIVERED, BLOCKED, DEACTIVATED, FAILED)
+
+# Number of attempts of a message failing with a network or server error
+ATTEMPTS = 3
+
+
+def get_outcome(delivery_error: str | None) -> str:
+    """
+    Get the outcome of a message that could not be sent.
+
+    :param delivery_error: The reason the user can not receive messages, see app.bot.utils.delivery.
+    :return: BLOCKED, DEACTIVATED or FAILED.
+    """
+    return delivery_error if delivery_error in (BLOCKED, DEACTIVATED) else FAILED
+
+
+@dataclass
+class Newsletter:
+    """
+    Data class representing a newsletter and its checkpointed progress.
+
+    Attributes:
+    - id (int): The ID of the newsletter.
+    - chat_id (int): The chat of the author, the progress is reported to it.
+    - language_code (str | None): The language of the progress reports.
+    - message (Message): The message copied to the recipients.
+    - segment (Segment): The users the newsletter is sent to.
+    - total (int): The number of recipients when the newsletter was created.
+    - cursor (int): The cursor of the next batch of recipients.
+    - scanned (bool): Whether all the batches of recipients were read.
+    - counts (Dict[str, int]): The number of recipients per outcome.
+    - started_at (float): The time the newsletter was created.
+    - progress_message_id (int | None): The ID of the progress report message.
+    """
+    id: int
+    chat_id: int
+    language_code: str | None
+    message: Message
+    segment: Segment
+    total: int
+    cursor: int = 0
+    scanned: bool = False
+    counts: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(OUTCOMES, 0))
+    started_at: float = field(default_factory=time.time)
+    progress_message_id: int | None = None
+
+    @property
+    def processed(self) -> int:
+        """
+        The number of recipients with an outcome.
+        """
+        return sum(self.counts.values())
+
+    def to_fields(self) -> Dict[str, str | int | float]:
+        """
+        Converts the newsletter to the fields of its Redis hash.
+        """
+        fields = {
+            "chat_id": self.chat_id,
+            "language_code": self.language_code or "",
+            "message": self.message.model_dump_json(exclude_none=True),
+            "segment": json_dumps(self.segment.to_dict()),
+            "total": self.total,
+            "cursor": self.cursor,
+            "scanned": int(self.scanned),
+            "started_at": self.started_at,
+            **self.counts,
+        }
+        if self.progress_message_id is not None:
+            fields["progress_message_id"] = self.progress_message_id
+        return fields
+
+    @classmethod
+    def from_fields(cls, id_: int, fields: Dict[bytes, bytes]) -> Newsletter:
+        """
+        Creates a newsletter from the fields of its Redis hash.
+        """
+        fields = {key.decode(): value.decode() for key, value in fields.items()}
+        return cls(
+            id=id_,
+            chat_id=int(fields["chat_id"]),
+            language_code=fields["language_code"] or None,
+            message=Message.model_validate_json(fields["message"]),
+            segment=Segment(**json_loads(fields["segment"])),
+            total=int(fields["total"]),
+            cursor=int(fields["cursor"]),
+            scanned=fields["scanned"] == "1",
+            counts={outcome: int(fields.get(outcome, 0)) for outcome in OUTCOMES},
+            started_at=float(fields["started_at"]),
+            progress_message_id=int(fields["progress_message_id"]) if "progress_message_id" in fields else None,
+        )
+
+
+class NewsletterEngine:
+    """
+    Sends newsletters to segments of users, resuming them where they stopped.
+
+    The recipients are streamed from the segment indexes, a batch at a time. The next cursor and the batch are
+    checkpointed in one transaction, and a recipient is removed from the batch in the same transaction that records
+    its outcome. After a restart the newsletter continues with the rest of the batch, on this or another replica
+    (a newsletter is locked by the replica sending it, which renews the lock every third of LOCK_TTL and stops
+    sending as soon as it loses it). Only the messages in flight when the process died may be delivered twice.
+
+    The messages are sent by CONCURRENCY workers at no more than RATE per second, within the outbox rate limiter, so
+    the relays keep their share of the global budget. Delivered recipients are counted, the blocked, deactivated and
+    failed ones are also kept in sets. The users who can not receive messages are marked as undeliverable, so the
+    next newsletters and relays skip them. The progress and the ETA are reported to the author by editing a message.
+    """
+
+    NAME = "newsletter"
+    USERS = RedisStorage.NAME
+
+    def __init__(
+            self,
+            redis: Redis,
+            bot: Bot,
+            config: NewsletterConfig,
+            limiter: RateLimiter,
+            undeliverable_ttl: int = 30 * 24 * 60 * 60,
+            name: str | None = None,
+            users: str | None = None,
+    ) -> None:
+        """
+        Initializes the NewsletterEngine instance.
+
+        :param redis: The Redis instance.
+        :param bot: The Bot instance used to send the newsletters.
+        :param config: The newsletter configuration.
+        :param limiter: The rate limiter shared with the outbox.
+        :param undeliverable_ttl: The number of seconds a user who can not receive messages is skipped.
+        :param name: The prefix of the keys, NAME by default (see BotConfig.key for the other bots).
+        :param users: The prefix of the keys of the recipients, USERS by default.
+        """
+        self.redis = redis
+        self.bot = bot
+        self.limiter = limiter
+        self.undeliverable_ttl = undeliverable_ttl
+        if name is not None:
+            self.NAME = name
+        if users is not None:
+            self.USERS = users
+
+        self.concurrency = config.CONCURRENCY
+        self.batch = config.BATCH
+        self.progress_interval = config.PROGRESS_INTERVAL
+        self.lock_ttl = config.LOCK_TTL
+        self.result_ttl = config.RESULT_TTL
+
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._limiter = RateLimiter(config.RATE)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._locked: Set[int] = set()
+        self._watch_task: asyncio.Task | None = None
+
+    @property
+    def segments(self) -> SegmentIndex:
+        """
+        The index the segments of recipients are resolved from.
+        """
+        return SegmentIndex(self.redis, self.USERS)
+
+    @property
+    def users(self) -> RedisStorage:
+        """
+        The storage of the recipients.
+        """
+        return RedisStorage(self.redis, name=self.USERS)
+
+    def _key(self, id_: int, suffix: str | None = None) -> str:
+        """
+        Get the Redis key of a newsletter, or of its batch, outcome set or lock with a suffix.
+        """
+        return f"{self.NAME}_{id_}" if suffix is None else f"{self.NAME}_{id_}_{suffix}"
+
+    async def create(
+            self,
+            chat_id: int,
+            language_code: str | None,
+            message: Message,
+            segment: Segment = Segment(),
+    ) -> int:
+        """
+        Create a newsletter and start sending it.
+
+        :param chat_id: The chat of the author, the progress is reported to it.
+        :param language_code: The language of the progress reports.
+        :param message: The message copied to the recipients.
+        :param segment: The users the newsletter is sent to, members who are not banned by default.
+        :return: The ID of the newsletter.
+        """
+        id_ = await self.redis.incr(f"{self.NAME}_ids")
+        total = await self.segments.count(segment)
+        newsletter = Newsletter(id_, chat_id, language_code, message, segment, total)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(id_), mapping=newsletter.to_fields())
+            pipe.sadd(f"{self.NAME}_active", id_)
+            await pipe.execute()
+
+        logging.info(f"Newsletter #{id_} created for {newsletter.total} users")
+        self._spawn(id_)
+        return id_
+
+    async def get(self, id_: int) -> Newsletter | None:
+        """
+        Get a newsletter with its progress.
+
+        :param id_: The ID of the newsletter.
+        :return: The newsletter or None if not found (or expired).
+        """
+        fields = await self.redis.hgetall(self._key(id_))
+        return Newsletter.from_fields(id_, fields) if fields else None
+
+    def _spawn(self, id_: int) -> None:
+        """
+        Start sending a newsletter, unless it is already sent by this replica.
+        """
+        if id_ not in self._tasks:
+            self._tasks[id_] = asyncio.create_task(self._run(id_))
+
+    async def _lock(self, id_: int) -> bool:
+        """
+        Acquire or renew the lock of a newsletter.
+
+        :return: True if the newsletter is locked by this replica.
+        """
+        lock = self._key(id_, "lock")
+        if await self.redis.set(lock, self.consumer, nx=True, px=int(self.lock_ttl * 1000)):
+            self._locked.add(id_)
+            return True
+        if await self.redis.eval(RENEW_LOCK, 1, lock, self.consumer, int(self.lock_ttl * 1000)):
+            return True
+        self._locked.discard(id_)
+        return False
+
+    async def _run(self, id_: int) -> None:
+        """
+        Send a newsletter while it is locked by this replica, pausing while Redis is unavailable.
+        """
+        try:
+            while True:
+                try:
+                    if not await self._lock(id_):
+                        return
+                    newsletter = await self.get(id_)
+                    if newsletter is None:
+                        await self.redis.srem(f"{self.NAME}_active", id_)
+                        return
+                    await self._deliver(newsletter)
+                    return
+                except RedisError as ex:
+                    # The progress is checkpointed, the newsletter continues from it
+                    logging.warning(f"Newsletter #{id_} paused: {ex!r}")
+                    await asyncio.sleep(5)
+        except Exception as ex:
+            logging.exception(f"Newsletter #{id_} failed: {ex!r}")
+        finally:
+            self._tasks.pop(id_, None)
+
+    async def _deliver(self, newsletter: Newsletter) -> None:
+        """
+        Send a newsletter to the rest of its recipients and report the result.
+        """
+        if newsletter.progress_message_id is None:
+            message = await self.bot.send_message(newsletter.chat_id, self._progress_text(newsletter, None))
+            newsletter.progress_message_id = message.message_id
+            await self.redis.hset(self._key(newsletter.id), "progress_message_id", message.message_id)
+
+        reporter = asyncio.create_task(self._report(newsletter))
+        sender = asyncio.create_task(self._send_batches(newsletter))
+        heartbeat = asyncio.create_task(self._keep_lock(newsletter.id))
+        try:
+            await asyncio.wait((sender, heartbeat), return_when=asyncio.FIRST_COMPLETED)
+            if not sender.done():
+                # The lock was lost (or could not be renewed), the workers are stopped before another replica sends
+                sender.cancel()
+                with suppress(asyncio.CancelledError):
+                    await sender
+                heartbeat.result()
+                logging.warning(f"Newsletter #{newsletter.id} was taken over by another replica")
+                return
+            sender.result()
+        finally:
+            for task in (reporter, sender, heartbeat):
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+
+        await self._finish(newsletter)
+
+    async def _send_batches(self, newsletter: Newsletter) -> None:
+        """
+        Send a newsletter batch by batch until all the batches are done.
+        """
+        while (recipients := await self._next_batch(newsletter)) is not None:
+            await self._send_batch(newsletter, recipients)
+
+    async def _keep_lock(self, id_: int) -> None:
+        """
+        Renew the lock of a newsletter every third of LOCK_TTL, however long a batch takes.
+
+        :return: When the lock is lost.
+        :raise RedisError: If the lock could not be renewed.
+        """
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            if not await self._lock(id_):
+                return
+
+    async def _next_batch(self, newsletter: Newsletter) -> List[int] | None:
+        """
+        Get the recipients of the current batch, reading the next batch when it is done.
+
+        :return: The IDs of the recipients or None if all the batches are done.
+        """
+        pending = self._key(newsletter.id, "pending")
+        recipients = await self.redis.smembers(pending)
+        while not recipients:
+            if newsletter.scanned:
+                return None
+            # The scan returns each user present during the whole scan, and resumes from a saved cursor
+            cursor, users = await self.segments.scan(newsletter.segment, newsletter.cursor, self.batch)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if users:
+                    pipe.sadd(pending, *users)
+                pipe.hset(self._key(newsletter.id), mapping={"cursor": cursor, "scanned": int(cursor == 0)})
+                await pipe.execute()
+            newsletter.cursor, newsletter.scanned = cursor, cursor == 0
+            recipients = users
+        return [int(user_id) for user_id in recipients]
+
+    async def _send_batch(self, newsletter: Newsletter, recipients: List[int]) -> None:
+        """
+        Send a newsletter to a batch of recipients with bounded concurrency.
+        """
+        queue = iter(recipients)
+
+        async def worker() -> None:
+            for user_id in queue:
+                outcome, delivery_error = await self._send(newsletter.message, user_id)
+                await self._record(newsletter, user_id, outcome)
+                if delivery_error is not None:
+                    await self.users.mark_undeliverable(user_id, delivery_error, self.undeliverable_ttl)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(recipients)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # Stop the other workers too, the batch is resumed from the checkpoint
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+
+    async def _send(self, message: Message, user_id: int) -> Tuple[str, str | None]:
+        """
+        Copy the message to a recipient.
+
+        :return: The outcome and the reason the recipient can not receive messages, if so.
+        """
+        method = message.send_copy(chat_id=user_id, reply_markup=message.reply_markup).as_(self.bot)
+        attempt = 0
+        while True:
+            await self._limiter.wait()
+            await self.limiter.wait()
+            try:
+                await method
+            except TelegramRetryAfter as ex:
+                # The global budget is exceeded, so every sender waits
+                self.limiter.hold(ex.retry_after)
+            except TRANSIENT_ERRORS:
+                attempt += 1
+                if attempt >= ATTEMPTS:
+                    return FAILED, None
+                await asyncio.sleep(2 ** attempt)
+            except TelegramAPIError as ex:
+                delivery_error = get_delivery_error(ex)
+                return get_outcome(delivery_error), delivery_error
+            else:
+                return DELIVERED, None
+
+    async def _record(self, newsletter: Newsletter, user_id: int, outcome: str) -> None:
+        """
+        Record the outcome of a recipient and remove it from the batch, in one transaction.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.srem(self._key(newsletter.id, "pending"), user_id)
+            pipe.hincrby(self._key(newsletter.id), outcome, 1)
+            if outcome != DELIVERED:
+                pipe.sadd(self._key(newsletter.id, outcome), user_id)
+            await pipe.execute()
+
+        newsletter.counts[outcome] += 1
+        NEWSLETTER_SENT.inc(outcome=outcome)
+
+    def _progress_text(self, newsletter: Newsletter, rate: float | None) -> str:
+        """
+        Build the progress report of a newsletter.
+
+        :param rate: The number of recipients processed per second since the newsletter was resumed.
+        """
+        remaining = max(newsletter.total - newsletter.processed, 0)
+        NEWSLETTER_REMAINING.set(remaining, newsletter=str(newsletter.id))
+
+        text = TextMessage(newsletter.language_code).get("newsletter_progress")
+        return text.format(
+            id=newsletter.id,
+            processed=newsletter.processed,
+            total=newsletter.total,
+            percent=100 * newsletter.processed / newsletter.total if newsletter.total else 100,
+            rate=rate or 0,
+            eta=format_duration(remaining / rate if rate else None),
+            **newsletter.counts,
+        )
+
+    async def _report(self, newsletter: Newsletter) -> None:
+        """
+        Edit the progress report every PROGRESS_INTERVAL seconds.
+        """
+        resumed_at, resumed_processed = time.monotonic(), newsletter.processed
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            rate = (newsletter.processed - resumed_processed) / (time.monotonic() - resumed_at)
+            try:
+                await self.bot.edit_message_text(
+                    text=self._progress_text(newsletter, rate),
+                    chat_id=newsletter.chat_id,
+                    message_id=newsletter.progress_message_id,
+                )
+            except TelegramAPIError as ex:
+                logging.debug(f"Newsletter #{newsletter.id} progress not reported: {ex!r}")
+
+    async def _finish(self, newsletter: Newsletter) -> None:
+        """
+        Mark a newsletter as finished, keep its outcomes for RESULT_TTL and report the result.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.srem(f"{self.NAME}_active", newsletter.id)
+            pipe.hset(self._key(newsletter.id), "finished_at", time.time())
+            for key in (self._key(newsletter.id), *(self._key(newsletter.id, o) for o in OUTCOMES[1:])):
+                pipe.expire(key, self.result_ttl)
+            pipe.delete(self._key(newsletter.id, "lock"))
+            await pipe.execute()
+        self._locked.discard(newsletter.id)
+        NEWSLETTER_REMAINING.set(0, newsletter=str(newsletter.id))
+
+        text = TextMessage(newsletter.language_code).get("newsletter_finished").format(
+            id=newsletter.id,
+            processed=newsletter.processed,
+            elapsed=format_duration(time.time() - newsletter.started_at),
+            **newsletter.counts,
+        )
+        logging.info(f"Newsletter #{newsletter.id} finished: {newsletter.counts}")
+        try:
+            await self.bot.send_message(newsletter.chat_id, text)
+            await self.bot.delete_message(newsletter.chat_id, newsletter.progress_message_id)
+        except TelegramAPIError as ex:
+            logging.warning(f"Newsletter #{newsletter.id} result not reported: {ex!r}")
+
+    async def _watch(self) -> None:
+        """
+        Pick up the unfinished newsletters, after a restart or when the replica sending them stopped.
+        The users written before the segment indexes existed are indexed first.
+        """
+        try:
+            await self.segments.build()
+        except RedisError as ex:
+            logging.warning(f"Failed to build the segment indexes: {ex!r}")
+
+        while True:
+            try:
+                for id_ in await self.redis.smembers(f"{self.NAME}_active"):
+                    self._spawn(int(id_))
+            except RedisError as ex:
+                logging.warning(f"Failed to check the unfinished newsletters: {ex!r}")
+            await asyncio.sleep(self.lock_ttl / 2)
+
+    def start(self) -> None:
+        """
+        Start resuming the unfinished newsletters.
+        """
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        """
+        Stop sending and release the newsletters, they are resumed after the next start.
+        """
+        tasks = [task for task in (self._watch_task, *self._tasks.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._watch_task = None
+
+        for id_ in self._locked:
+            lock = self._key(id_, "lock")
+            try:
+                if await self.redis.get(lock) == self.consumer.encode():
+                    await self.redis.delete(lock)
+            except RedisError:
+                break
+        self._locked.clear()
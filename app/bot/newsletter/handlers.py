@@ -0,0 +1,185 @@
+"""
+Integration of the aiogram_newsletter menu with the NewsletterEngine.
+
+The menu of aiogram_newsletter is kept (composing, previewing and scheduling), but the newsletters are sent by the
+NewsletterEngine instead of the library, which sends to a list of all user IDs kept in the FSM state and the job
+store. This module imports aiogram_newsletter and apscheduler, so it is only imported by NewsletterLoader.load().
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+from aiogram_newsletter.handlers import AiogramNewsletterHandlers
+from aiogram_newsletter.manager import ANManager
+from aiogram_newsletter.middleware import AiogramNewsletterMiddleware
+from aiogram_newsletter.utils.states import ANState
+from apscheduler.triggers.date import DateTrigger
+
+from app.bot.utils.redis import Segment
+from .engine import NewsletterEngine
+
+# The engines of the bots by name, registered by NewsletterLoader.load() for the scheduled newsletters
+ENGINES: Dict[str, NewsletterEngine] = {}
+
+
+async def run_scheduled_newsletter(
+        user_data: dict,
+        message_data: dict,
+        segment_data: dict,
+        engine: str = NewsletterEngine.NAME,
+) -> None:
+    """
+    Start a scheduled newsletter, called by apscheduler.
+
+    :param user_data: The author of the newsletter.
+    :param message_data: The message copied to the recipients.
+    :param segment_data: The users the newsletter is sent to.
+    :param engine: The name of the engine of the bot, the jobs scheduled before the multi-bot mode use the main one.
+    """
+    user = User(**user_data)
+    await ENGINES[engine].create(user.id, user.language_code, Message(**message_data), Segment(**segment_data))
+
+
+class NewsletterManager(ANManager):
+    """
+    ANManager keeping the segment and its number of users in the FSM state instead of the list of their IDs.
+    """
+
+    async def newsletter_menu(
+            self,
+            segment: Segment,
+            total: int,
+            return_callback: Callable[..., Awaitable],
+    ) -> Message:
+        """
+        Open the newsletter menu.
+
+        :param segment: The users the newsletters are sent to.
+        :param total: The number of users in the segment.
+        :param return_callback: The callback opening the window the menu returns to.
+        :return: The menu message.
+        """
+        await self.data_storage.set_data(return_callback, "return_callback")
+        await self.state.update_data(segment=segment.to_dict(), users_total=total, page=1)
+        return await self.open_newsletters_window()
+
+    async def get_segment(self) -> Segment:
+        """
+        Get the segment the newsletter menu was opened for.
+
+        :return: The segment.
+        """
+        state_data = await self.state.get_data()
+        return Segment(**state_data.get("segment", {}))
+
+    async def open_newsletters_window(self) -> Message:
+        """
+        Open the list of scheduled newsletters.
+
+        :return: The menu message.
+        """
+        state_data = await self.state.get_data()
+        page, page_size = state_data.get("page", 1), 5
+        items = sorted(
+            [
+                (job.trigger.run_date.strftime("%Y-%m-%d %H:%M"), f"id:{job.id}")
+                for job in self.apscheduler.get_jobs()
+            ],
+            key=lambda x: x[0],
+        )
+        page_items = items[(page - 1) * page_size: page * page_size]
+        total_pages = (len(items) + page_size - 1) // page_size
+        text = self.text_message.get("newsletters").format(total=state_data.get("users_total", 0))
+        reply_markup = self.inline_keyboard.newsletters(page_items, page, total_pages)
+
+        message = await self.send_message(text, reply_markup=reply_markup)
+        await self.state.set_state(ANState.newsletters)
+        return message
+
+
+class NewsletterManagerMiddleware(AiogramNewsletterMiddleware):
+    """
+    AiogramNewsletterMiddleware passing a NewsletterManager to the handlers.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        """
+        Call the middleware.
+
+        :param handler: The handler function.
+        :param event: The Telegram event.
+        :param data: Additional data.
+        :return: The result of the handler function.
+        """
+        async def wrapper(event_: TelegramObject, data_: Dict[str, Any]) -> Any:
+            an_manager: ANManager | None = data_.get("an_manager")
+            if an_manager is not None:
+                data_["an_manager"] = NewsletterManager(
+                    apscheduler=an_manager.apscheduler,
+                    text_message=an_manager.text_message,
+                    inline_keyboard=an_manager.inline_keyboard,
+                    data=data_,
+                )
+            return await handler(event_, data_)
+
+        return await super().__call__(wrapper, event, data)
+
+
+class NewsletterHandlers(AiogramNewsletterHandlers):
+    """
+    AiogramNewsletterHandlers starting the confirmed newsletters with the NewsletterEngine.
+    """
+
+    @classmethod
+    async def _confirmation_now_callback_handler(
+            cls,
+            call: CallbackQuery,
+            an_manager: NewsletterManager,
+            newsletter_engine: NewsletterEngine,
+    ) -> None:
+        if call.data == "back":
+            await an_manager.open_choose_options_window()
+        elif call.data == "confirm":
+            message_data = await an_manager.data_storage.get_data("message_data")
+            await newsletter_engine.create(
+                an_manager.user.id,
+                an_manager.user.language_code,
+                Message(**message_data),
+                await an_manager.get_segment(),
+            )
+            await an_manager.open_newsletters_window()
+
+        await call.answer()
+
+    @classmethod
+    async def _confirmation_later_callback_handler(
+            cls,
+            call: CallbackQuery,
+            an_manager: NewsletterManager,
+            newsletter_engine: NewsletterEngine,
+    ) -> None:
+        if call.data == "back":
+            await an_manager.open_send_datetime_window()
+        elif call.data == "confirm":
+            message_data = await an_manager.data_storage.get_data("message_data")
+            datetime_obj = await an_manager.data_storage.get_data("datetime_obj")
+
+            # The job keeps the message and the segment, the recipients are read when it runs
+            segment = await an_manager.get_segment()
+            an_manager.apscheduler.add_job(
+                func=run_scheduled_newsletter,
+                trigger=DateTrigger(datetime_obj),
+                kwargs={
+                    "user_data": an_manager.user.model_dump(),
+                    "message_data": message_data,
+                    "segment_data": segment.to_dict(),
+                    "engine": newsletter_engine.NAME,
+                },
+            )
+            await an_manager.open_newsletters_window()
+
+        await call.answer()
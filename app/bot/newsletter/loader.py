@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from aiogram import Bot, Dispatcher
+from redis.asyncio import Redis
+
+from app.bot.utils.redis.connection import create_sync_redis
+from app.config import Config
+from .engine import NewsletterEngine
+
+if TYPE_CHECKING:
+    from aiogram_newsletter.middleware import AiogramNewsletterMiddleware
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+# Prefix of the hash of the jobs and of the sorted set of their next run times kept by the apscheduler RedisJobStore
+JOBS_PREFIX = "apscheduler"
+
+
+class NewsletterLoader:
+    """
+    Loads the newsletter subsystem (aiogram_newsletter and apscheduler) on first use.
+
+    Only DEV_ID uses the newsletter, so importing and starting it is deferred until DEV_ID sends an update or a
+    scheduled newsletter is found in the job store at startup. In the multi-bot mode each bot has its own loader and
+    job store, the handlers are included into the shared Dispatcher once.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, config: Config, engine: NewsletterEngine) -> None:
+        """
+        Initializes the NewsletterLoader instance.
+
+        :param dp: The Dispatcher the newsletter handlers are included into.
+        :param bot: The Bot instance used by the scheduled newsletters.
+        :param config: The Config object.
+        :param engine: The NewsletterEngine instance sending the newsletters.
+        """
+        self.dp = dp
+        self.bot = bot
+        self.config = config
+        self.engine = engine
+
+        self.apscheduler: AsyncIOScheduler | None = None
+        self.middleware: AiogramNewsletterMiddleware | None = None
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the newsletter subsystem is loaded.
+        """
+        return self.middleware is not None
+
+    async def load(self) -> AiogramNewsletterMiddleware:
+        """
+        Import and start the newsletter subsystem if it is not loaded yet.
+
+        :return: The AiogramNewsletterMiddleware instance.
+        """
+        async with self._lock:
+            if self.middleware is None:
+                from .handlers import ENGINES, NewsletterHandlers, NewsletterManagerMiddleware
+
+                self.apscheduler = self.create_apscheduler(self.config)
+                self.apscheduler.start()
+                # aiogram_newsletter looks the bot up on the loop, the scheduled newsletters find their engine by name
+                asyncio.get_running_loop().__setattr__("bot", self.bot)
+                ENGINES[self.engine.NAME] = self.engine
+
+                if not self.dp.get("newsletter_handlers"):
+                    NewsletterHandlers().register(self.dp)
+                    self.dp["newsletter_handlers"] = True
+                self.middleware = NewsletterManagerMiddleware(self.apscheduler)
+                logging.info("Newsletter subsystem loaded")
+
+        return self.middleware
+
+    async def load_if_scheduled(self, redis: Redis) -> None:
+        """
+        Load the newsletter subsystem if there are scheduled newsletters waiting in the job store.
+
+        :param redis: The Redis instance of the job store.
+        """
+        try:
+            if await redis.zcard(self.run_times_key(self.config)):
+                await self.load()
+        except Exception as ex:
+            logging.exception(f"Failed to load the newsletter subsystem: {ex!r}")
+
+    def start(self, redis: Redis) -> None:
+        """
+        Check for scheduled newsletters in the background, so the startup is not delayed.
+
+        :param redis: The Redis instance of the job store.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.load_if_scheduled(redis))
+
+    def shutdown(self) -> None:
+        """
+        Stop apscheduler if it was started.
+        """
+        if self.apscheduler is not None:
+            self.apscheduler.shutdown()
+
+    @staticmethod
+    def run_times_key(config: Config) -> str:
+        """
+        Get the key of the next run times of the jobs of the bot.
+
+        :param config: Config: The config instance.
+        :return: The key.
+        """
+        # Both keys are used in the transactions of the job store
+        return f"{config.bot.key(JOBS_PREFIX, tag=True)}.run_times"
+
+    @staticmethod
+    def create_apscheduler(config: Config) -> AsyncIOScheduler:
+        """
+        Create the apscheduler instance backed by the Redis job store, with the keys of the bot.
+
+        :param config: Config: The config instance.
+        :return: The AsyncIOScheduler instance.
+        """
+        from apscheduler.jobstores.redis import RedisJobStore
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+        job_store = RedisJobStore(
+            jobs_key=f"{config.bot.key(JOBS_PREFIX, tag=True)}.jobs",
+            run_times_key=NewsletterLoader.run_times_key(config),
+        )
+        # The client of the configured mode replaces the one the job store creates
+        job_store.redis = create_sync_redis(config.redis, job_store.jobs_key)
+        return AsyncIOScheduler(
+            jobstores={"default": job_store},
+        )
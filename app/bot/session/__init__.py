@@ -0,0 +1,7 @@
+from .retry import RetryMiddleware
+from .tuned import TunedAiohttpSession
+
+__all__ = [
+    "RetryMiddleware",
+    "TunedAiohttpSession",
+]
@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramEntityTooLarge,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from app.bot.utils.circuit_breaker import CircuitBreaker
+from app.config import RetryConfig
+from app.metrics import registry
+
+RETRIES = registry.counter("bot_api_retries_total", "Bot API calls retried, by method and reason.")
+REJECTED = registry.counter("bot_api_breaker_rejected_total", "Bot API calls rejected by the open circuit breaker.")
+PAUSES = registry.counter("bot_api_pauses_total", "Method group pauses caused by RetryAfter.")
+
+# Methods that deliver something to a chat, repeating them after a timeout may deliver it twice
+SEND_METHODS = {
+    "copyMessage",
+    "copyMessages",
+    "forwardMessage",
+    "forwardMessages",
+}
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Data class representing how the calls of a method are retried.
+
+    Attributes:
+    - group (str): The method group, a RetryAfter pauses the whole group for the bot and the chat.
+    - idempotent (bool): Whether the call is safe to repeat after a timeout or a server error.
+    - wait_retry_after (bool): Whether RetryAfter is waited out by the middleware, otherwise it is raised at once and
+      the caller waits however long it takes (the call must not be given up on).
+    """
+    group: str
+    idempotent: bool
+    wait_retry_after: bool = True
+
+
+def get_policy(method_name: str) -> RetryPolicy:
+    """
+    Get the retry policy of a Bot API method.
+
+    :param method_name: The Bot API method name.
+    :return: The retry policy.
+    """
+    if method_name == "createForumTopic":
+        # A user without a topic has nowhere to write to, so topic creation waits out even long flood waits
+        return RetryPolicy("topics", idempotent=False, wait_retry_after=False)
+    if method_name.startswith("send") or method_name in SEND_METHODS:
+        return RetryPolicy("sends", idempotent=False)
+    # Reads, edits and deletions have the same effect when repeated
+    return RetryPolicy(method_name, idempotent=True)
+
+
+class RetryMiddleware(BaseRequestMiddleware):
+    """
+    Request middleware applying one retry policy to all Bot API calls.
+
+    - RetryAfter pauses the whole method group for the bot and the chat, so the callers wait together instead of each
+      hitting the limit again. Waits longer than MAX_RETRY_AFTER fail the call. The groups whose callers handle
+      RetryAfter get it at once (see RetryPolicy.wait_retry_after).
+    - Network and server errors are retried with jittered exponential backoff, for calls that are safe to repeat.
+      Calls that deliver something are only retried if the connection was never made.
+    - A circuit breaker counts the network and server errors and fails the calls fast while the Bot API is degraded.
+    """
+
+    def __init__(self, config: RetryConfig) -> None:
+        """
+        Initializes the RetryMiddleware instance.
+
+        :param config: The retry configuration.
+        """
+        self.config = config
+        self.breaker = CircuitBreaker("bot_api", config.BREAKER_THRESHOLD, config.BREAKER_RECOVERY)
+        self._paused_until: Dict[str, float] = {}
+
+    @property
+    def paused(self) -> int:
+        """
+        The number of method groups paused by a RetryAfter, the Bot API is throttling them.
+        """
+        now = time.monotonic()
+        return sum(until > now for until in self._paused_until.values())
+
+    async def _wait_pause(self, key: str) -> None:
+        """
+        Wait until the pause of the method group for the bot and the chat is over.
+        """
+        while (delay := self._paused_until.get(key, 0) - time.monotonic()) > 0:
+            # Spread the waiting callers, so they do not hit the limit again all at once
+            await asyncio.sleep(delay + random.uniform(0, self.config.BACKOFF_CAP / 10))
+        self._paused_until.pop(key, None)
+
+    def _pause(self, key: str, seconds: float) -> None:
+        """
+        Pause the method group for the bot and the chat.
+        """
+        now = time.monotonic()
+        if self._paused_until.get(key, 0) <= now:
+            PAUSES.inc(group=key.split(":", 1)[0])
+        self._paused_until[key] = max(self._paused_until.get(key, 0), now + seconds)
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Get the delay before the next attempt (exponential backoff with full jitter).
+        """
+        return random.uniform(0, min(self.config.BACKOFF_CAP, self.config.BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def _retryable(policy: RetryPolicy, ex: TelegramAPIError) -> bool:
+        """
+        Check whether a network or server error may be retried under the policy.
+        """
+        if isinstance(ex, TelegramEntityTooLarge):
+            return False
+        if policy.idempotent:
+            return True
+        # The request never reached the Bot API, so nothing was delivered
+        return isinstance(ex, TelegramNetworkError) and ex.message.startswith("ClientConnectorError")
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        """
+        Make the request, retrying it according to the policy of the method.
+
+        :param make_request: The next request handler.
+        :param bot: The Bot instance.
+        :param method: The Bot API method.
+        :return: The response.
+        """
+        name = method.__api_method__
+        policy = get_policy(name)
+        # The bots sharing the session are throttled apart
+        key = f"{policy.group}:{bot.id}:{getattr(method, 'chat_id', None)}"
+
+        for attempt in range(1, self.config.ATTEMPTS + 1):
+            last_attempt = attempt == self.config.ATTEMPTS
+            await self._wait_pause(key)
+
+            if not self.breaker.allow():
+                REJECTED.inc(method=name)
+                raise TelegramNetworkError(method=method, message="Circuit breaker is open, the Bot API is degraded")
+
+            try:
+                response = await make_request(bot, method)
+
+            except TelegramRetryAfter as ex:
+                # The Bot API answered, it is only rate limiting
+                self.breaker.record_success()
+                if not policy.wait_retry_after or last_attempt or ex.retry_after > self.config.MAX_RETRY_AFTER:
+                    raise
+                self._pause(key, ex.retry_after)
+                RETRIES.inc(method=name, reason="retry_after")
+
+            except (TelegramNetworkError, TelegramServerError) as ex:
+                self.breaker.record_failure()
+                if last_attempt or not self._retryable(policy, ex):
+                    raise
+                RETRIES.inc(method=name, reason="network" if isinstance(ex, TelegramNetworkError) else "server")
+                await asyncio.sleep(self._backoff(attempt - 1))
+
+            except TelegramAPIError:
+                # Client errors (bad request, forbidden, ...) are not retried and mean the Bot API is healthy
+                self.breaker.record_success()
+                raise
+
+            else:
+                self.breaker.record_success()
+                return response
@@ -0,0 +1,57 @@
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from app.config import SessionConfig
+from app.serialization import json_dumps, json_loads
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """
+    AiohttpSession with a sized connection pool, keep-alive, DNS caching, per-method timeouts and fast JSON.
+    """
+
+    def __init__(self, config: SessionConfig, **kwargs: Any) -> None:
+        """
+        Initializes the TunedAiohttpSession instance.
+
+        :param config: The session configuration.
+        :param kwargs: Additional keyword arguments passed to AiohttpSession (e.g. api).
+        """
+        super().__init__(
+            json_loads=json_loads,
+            json_dumps=json_dumps,
+            timeout=config.TIMEOUT,
+            **kwargs,
+        )
+        self.timeouts: Dict[str, float] = config.TIMEOUTS
+
+        if self.proxy is None:
+            # Keep connections to the Bot API open and reuse them instead of a new TLS handshake per burst
+            self._connector_init.update(
+                limit=config.POOL_SIZE,
+                keepalive_timeout=config.KEEPALIVE,
+                use_dns_cache=True,
+                ttl_dns_cache=config.DNS_CACHE_TTL,
+            )
+
+    async def make_request(
+            self,
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+            timeout: Optional[int] = None,
+    ) -> TelegramType:
+        """
+        Make a request with the timeout configured for the method, unless one is given explicitly.
+
+        :param bot: The Bot instance.
+        :param method: The Bot API method.
+        :param timeout: The request timeout in seconds.
+        :return: The result of the method.
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(method.__api_method__, self.timeout)
+        return await super().make_request(bot, method, timeout)
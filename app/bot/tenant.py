@@ -0,0 +1,165 @@
+import asyncio
+import dataclasses
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from redis.asyncio import Redis
+
+from app.config import BotConfig, Config
+from app.metrics import tenant_var
+from . import commands
+from .newsletter import NewsletterEngine, NewsletterLoader
+from .utils.drain import Drainer
+from .utils.error_reporter import ErrorReporter
+from .utils.outbox import Outbox
+from .utils.redis import RedisHealth, RedisStorage
+
+
+@dataclass
+class Tenant:
+    """
+    Data class representing a bot served by the process, with the services keeping its state.
+
+    All the bots share the Dispatcher, the Redis pool, the HTTP session and the Redis health monitor. Each bot gets
+    its own config, drainer, outbox, newsletters and error digests, their Redis keys are prefixed with the namespace
+    of the bot (see BotConfig.key), so the main bot keeps the keys it had before the multi-bot mode.
+
+    Attributes:
+    - config (Config): The config with the BotConfig of the bot.
+    - bot (Bot): The Bot instance.
+    - drainer (Drainer): The in-flight work tracker.
+    - outbox (Outbox): The outbound queue.
+    - newsletter_engine (NewsletterEngine): The newsletter delivery engine.
+    - newsletter (NewsletterLoader): The newsletter subsystem loader.
+    - error_reporter (ErrorReporter): The error reporter.
+    """
+    config: Config
+    bot: Bot
+    drainer: Drainer
+    outbox: Outbox
+    newsletter_engine: NewsletterEngine
+    newsletter: NewsletterLoader
+    error_reporter: ErrorReporter
+
+    @property
+    def namespace(self) -> str:
+        """
+        The namespace of the bot, empty for the main bot.
+        """
+        return self.config.bot.NAMESPACE
+
+    @property
+    def workflow_data(self) -> Dict[str, Any]:
+        """
+        The handler data of the updates of the bot, it replaces the data of the main bot.
+        """
+        return {
+            "config": self.config,
+            "drainer": self.drainer,
+            "outbox": self.outbox,
+            "newsletter_engine": self.newsletter_engine,
+            "newsletter": self.newsletter,
+            "error_reporter": self.error_reporter,
+        }
+
+    async def start(self, dp: Dispatcher) -> None:
+        """
+        Start the services of the bot.
+
+        The background tasks are created within the tenant context, so their metrics are labelled with the bot.
+
+        :param dp: The Dispatcher the persisted updates are fed into.
+        """
+        token = tenant_var.set(self.namespace)
+        try:
+            # Restore the work persisted on the previous shutdown
+            await self.drainer.restore(dp)
+            # Load the newsletter subsystem in the background if scheduled newsletters are waiting
+            self.newsletter.start(self.drainer.redis)
+            # Start the outbox workers
+            self.outbox.start()
+            # Resume the unfinished newsletters
+            self.newsletter_engine.start()
+            # Start sending error digests
+            self.error_reporter.start()
+            # Setup commands when starting up
+            await commands.setup(self.bot, self.config, self.drainer.redis)
+        finally:
+            tenant_var.reset(token)
+
+    async def stop(self) -> None:
+        """
+        Stop the services of the bot, the shared ones are stopped by the caller.
+        """
+        token = tenant_var.set(self.namespace)
+        try:
+            # Finish or persist the in-flight work before anything is closed
+            await self.drainer.drain()
+            # Stop the outbox workers, the operations not sent yet are sent after the next start
+            await self.outbox.stop()
+            # Stop sending newsletters, they are resumed from the checkpoint after the next start
+            await self.newsletter_engine.stop()
+            # Stop apscheduler if the newsletter subsystem was loaded
+            self.newsletter.shutdown()
+            # Stop sending error digests
+            await self.error_reporter.stop()
+        finally:
+            tenant_var.reset(token)
+
+
+def create_tenant(
+        dp: Dispatcher,
+        config: Config,
+        bot_config: BotConfig,
+        bot: Bot,
+        redis: Redis,
+        redis_health: RedisHealth,
+) -> Tenant:
+    """
+    Create the services of a bot.
+
+    :param dp: The Dispatcher shared by the bots.
+    :param config: The config of the process.
+    :param bot_config: The config of the bot.
+    :param bot: The Bot instance.
+    :param redis: The Redis instance shared by the bots.
+    :param redis_health: The Redis health monitor shared by the bots.
+    :return: The Tenant instance.
+    """
+    config = dataclasses.replace(config, bot=bot_config, tenants=[])
+
+    # The keys of the drainer, the newsletters, the errors and the users are used in transactions and pipelines, so
+    # they share a slot per service in the cluster mode. The outbox partitions and the message mappings are spread.
+    drainer = Drainer(redis, bot, config.drain.TIMEOUT, bot_config.key(Drainer.NAME, tag=True))
+    error_reporter = ErrorReporter(redis, bot, config, bot_config.key(ErrorReporter.NAME, tag=True))
+    outbox = Outbox(redis, bot, config, redis_health, drainer, error_reporter, bot_config.key(Outbox.NAME))
+    # Newsletters share the rate limit of the outbox
+    newsletter_engine = NewsletterEngine(
+        redis, bot, config.newsletter, outbox.limiter, config.redis.UNDELIVERABLE_TTL,
+        bot_config.key(NewsletterEngine.NAME, tag=True), bot_config.key(RedisStorage.NAME, tag=True),
+    )
+
+    # The users of the bot are warmed up with the others
+    if newsletter_engine.USERS not in redis_health.names:
+        redis_health.names.append(newsletter_engine.USERS)
+
+    return Tenant(
+        config=config,
+        bot=bot,
+        drainer=drainer,
+        outbox=outbox,
+        newsletter_engine=newsletter_engine,
+        # The newsletter subsystem is loaded on first use
+        newsletter=NewsletterLoader(dp, bot, config, newsletter_engine),
+        error_reporter=error_reporter,
+    )
+
+
+async def stop_tenants(*tenants: Tenant) -> None:
+    """
+    Stop the services of the bots concurrently, so each one gets the whole drain timeout.
+
+    :param tenants: The Tenant instances.
+    """
+    await asyncio.gather(*(tenant.stop() for tenant in tenants))
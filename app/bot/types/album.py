@@ -1,7 +1,7 @@
 from typing import Dict, List, Optional, Type, Union, cast
 
 from aiogram import Bot
-from aiogram.methods import SendMediaGroup
+from aiogram.methods import CopyMessages, SendMediaGroup
 from aiogram.types import (
     Audio,
     Document,
@@ -17,6 +17,9 @@ from aiogram.types import (
 from aiogram.types.base import UNSET_PROTECT_CONTENT
 from pydantic import Field
 
+# The maximum number of items in a media group
+MEDIA_GROUP_SIZE = 10
+
 Media = Union[PhotoSize, Video, Audio, Document]
 InputMedia = Union[InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument]
 
@@ -49,6 +52,20 @@ class Album(TelegramObject):
         """
         return [media_type for media_type in INPUT_TYPES if getattr(self, media_type)]
 
+    @property
+    def media_messages(self) -> List[Message]:
+        """
+        Get the messages of the album in the order of the media group.
+
+        :return: A list of messages, the one of each item of as_media_group.
+        """
+        return [
+            message
+            for media_type in self.media_types
+            for message in self.messages
+            if getattr(message, media_type)
+        ]
+
     @property
     def as_media_group(self) -> List[InputMedia]:
         """
@@ -95,3 +112,35 @@ class Album(TelegramObject):
             reply_to_message_id=reply_to_message_id,
             allow_sending_without_reply=allow_sending_without_reply,
         ).as_(self._bot)
+
+    def copy_messages_to(
+            self,
+            chat_id: Union[int, str],
+            message_thread_id: Optional[int] = None,
+            disable_notification: Optional[bool] = None,
+            protect_content: Optional[bool] = None,
+    ) -> List[CopyMessages]:
+        """
+        Copy the album messages to CopyMessages objects, in chunks of MEDIA_GROUP_SIZE.
+
+        The messages are copied in their original order with their captions, and every chunk is delivered as a
+        media group, whatever the media types are. No InputMedia objects are built.
+
+        :param chat_id: The ID of the chat to copy the album to.
+        :param message_thread_id: The ID of the message thread.
+        :param disable_notification: Whether to disable notification for the messages.
+        :param protect_content: Whether to protect the content of the messages.
+        :return: A list of CopyMessages objects, the IDs of their copies are in the order of message_ids.
+        """
+        message_ids = sorted(message.message_id for message in self.messages)
+        return [
+            CopyMessages(
+                chat_id=chat_id,
+                from_chat_id=self.messages[0].chat.id,
+                message_ids=message_ids[i:i + MEDIA_GROUP_SIZE],
+                message_thread_id=message_thread_id,
+                disable_notification=disable_notification,
+                protect_content=protect_content,
+            ).as_(self._bot)
+            for i in range(0, len(message_ids), MEDIA_GROUP_SIZE)
+        ]
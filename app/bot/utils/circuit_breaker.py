@@ -0,0 +1,81 @@
+import logging
+import time
+
+from app.metrics import registry
+
+CIRCUIT_STATE = registry.gauge(
+    "circuit_breaker_state", "State of the circuit breaker: 0 closed, 1 half-open, 2 open."
+)
+CIRCUIT_OPENED = registry.counter("circuit_breaker_opened_total", "Times the circuit breaker opened.")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half-open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is degraded.
+
+    The breaker opens after a number of consecutive failures. While it is open, calls are not allowed. After the
+    recovery timeout a single trial call is allowed (half-open): its success closes the breaker, its failure opens it
+    again for another recovery timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float) -> None:
+        """
+        Initializes the CircuitBreaker instance.
+
+        :param name: The name of the protected dependency, used in the metrics and logs.
+        :param failure_threshold: The number of consecutive failures that open the breaker.
+        :param recovery_timeout: The number of seconds the breaker stays open before a trial call.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._set_state(CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        """
+        Change the state and report it.
+        """
+        if state != self.state:
+            logging.warning(f"Circuit breaker {self.name!r} is {state}")
+        self.state = state
+        CIRCUIT_STATE.set(STATE_VALUES[state], name=self.name)
+
+    def allow(self) -> bool:
+        """
+        Check whether a call is allowed.
+
+        :return: True if the call may be made.
+        """
+        if self.state == CLOSED:
+            return True
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            # Let a single trial call through, another one if it does not finish within the recovery timeout
+            self.opened_at = time.monotonic()
+            self._set_state(HALF_OPEN)
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """
+        Record a successful call.
+        """
+        self.failures = 0
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        """
+        Record a failed call.
+        """
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            CIRCUIT_OPENED.inc(name=self.name)
+            self._set_state(OPEN)
@@ -1,14 +1,23 @@
 import asyncio
 import logging
+import time
+from typing import Dict, MutableMapping, Tuple
+from weakref import WeakValueDictionary
 
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 from app.config import Config
 from .exceptions import CreateForumTopicException, NotEnoughRightsException, NotAForumException
+from .groups import get_group_key, get_user_group, rank_groups
 from .redis import RedisStorage
 from .redis.models import UserData
 
+# Locks of the users whose topic is being created, so concurrent updates do not create one each
+_topic_locks: MutableMapping[int, asyncio.Lock] = WeakValueDictionary()
+# Monotonic time until which topic creation is throttled in a group, by bot and group
+_throttled_until: Dict[Tuple[int, int], float] = {}
+
 
 async def get_or_create_forum_topic(
         bot: Bot,
@@ -16,49 +25,121 @@ async def get_or_create_forum_topic(
         config: Config,
         user_data: UserData,
 ) -> int:
-    if user_data.message_thread_id is None:
-        try:
-            # If message_thread_id is not found, create a forum topic
-            message_thread_id = await create_forum_topic(
-                bot, config, user_data.full_name,
-            )
-            user_data.message_thread_id = message_thread_id
-            await redis.update_user(user_data.id, user_data)
+    # The topic is created again when its group was removed from the configuration
+    if user_data.message_thread_id is None or get_user_group(config, user_data) not in config.bot.GROUP_IDS:
+        lock = _topic_locks.setdefault(user_data.id, asyncio.Lock())
+        async with lock:
+            # The topic may have been created by a concurrent update meanwhile
+            stored = await redis.get_user(user_data.id)
+            if (
+                    stored is not None and stored.message_thread_id is not None
+                    and get_user_group(config, stored) in config.bot.GROUP_IDS
+            ):
+                user_data.message_thread_id, user_data.group_id = stored.message_thread_id, stored.group_id
+                return user_data.message_thread_id
+
+            try:
+                # If message_thread_id is not found, create a forum topic
+                await create_user_topic(bot, config, user_data)
+                await redis.update_user(user_data.id, user_data)
 
-        except Exception as e:
-            await bot.send_message(config.bot.DEV_ID, str(e))
-            logging.exception(e)
+            except Exception as e:
+                await bot.send_message(config.bot.DEV_ID, str(e))
+                logging.exception(e)
 
     return user_data.message_thread_id
 
 
-async def create_forum_topic(bot: Bot, config: Config, name: str) -> int:
+async def create_user_topic(bot: Bot, config: Config, user_data: UserData) -> int:
+    """
+    Creates the forum topic of a user in the first group of the user's ranking that accepts it (see rank_groups),
+    and sets the group and the thread of the user.
+
+    A group throttled by a RetryAfter is skipped until the wait is over, so the topics go to the other groups
+    meanwhile. When every group that may take the topic is throttled, the first one to be free again is waited for.
+
+    :param bot: The Aiogram Bot instance.
+    :param config: The configuration object.
+    :param user_data: The user data.
+
+    :return: The message thread ID of the created forum topic.
+    :raises CreateForumTopicException: If no group accepts the topic, the error of the last group is raised.
+    """
+    groups = rank_groups(config, user_data.id)
+    while True:
+        error: Exception | None = None
+        throttled = []
+        for group_id in groups:
+            if _throttled_until.get((bot.id, group_id), 0) > time.monotonic():
+                throttled.append(group_id)
+                continue
+            try:
+                message_thread_id = await create_forum_topic(bot, config, user_data.full_name, group_id, wait=False)
+            except TelegramRetryAfter as ex:
+                # The group is throttled, the next one may take the topic right away
+                _throttled_until[(bot.id, group_id)] = time.monotonic() + ex.retry_after
+                throttled.append(group_id)
+                continue
+            except (CreateForumTopicException, NotEnoughRightsException, NotAForumException) as ex:
+                # The group can not take the topic (e.g. it reached the topic limit), the next one is tried
+                logging.warning(f"Forum topic not created in the group {group_id}: {ex}")
+                error = ex
+                continue
+
+            user_data.message_thread_id = message_thread_id
+            user_data.group_id = get_group_key(config, group_id)
+            return message_thread_id
+
+        if not throttled:
+            raise error
+        # Every group that may take the topic is throttled, the others are not tried again
+        groups = throttled
+        delay = min(_throttled_until[(bot.id, group_id)] for group_id in groups) - time.monotonic()
+        logging.warning(f"Topic creation is throttled in every group, retrying in {max(delay, 0):.0f} seconds")
+        await asyncio.sleep(max(delay, 0))
+
+
+async def create_forum_topic(
+        bot: Bot,
+        config: Config,
+        name: str,
+        chat_id: int | None = None,
+        wait: bool = True,
+) -> int:
     """
     Creates a forum topic in the specified chat.
 
+    RetryAfter is waited out and the call repeated however long the wait, the RetryMiddleware of the session leaves
+    it to this function (see RetryPolicy.wait_retry_after). Without wait, it is raised for the caller to try another
+    group meanwhile.
+
     :param bot: The Aiogram Bot instance.
     :param config: The configuration object.
     :param name: The name of the forum topic.
+    :param chat_id: The ID of the group, the first group by default.
+    :param wait: Whether RetryAfter is waited out, otherwise it is raised.
 
     :return: The message thread ID of the created forum topic.
     :raises NotEnoughRightsException: If the bot doesn't have enough rights to create a forum topic.
     :raises CreateForumTopicException: If an error occurs while creating the forum topic.
+    :raises TelegramRetryAfter: If the group is throttled and wait is False.
     """
     try:
         # Attempt to create a forum topic
         forum_topic = await bot.create_forum_topic(
-            chat_id=config.bot.GROUP_ID,
+            chat_id=config.bot.GROUP_ID if chat_id is None else chat_id,
             name=name,
             icon_custom_emoji_id=config.bot.BOT_EMOJI_ID,
-            request_timeout=30,
         )
         return forum_topic.message_thread_id
 
     except TelegramRetryAfter as ex:
+        if not wait:
+            raise
         # Handle Retry-After exception (rate limiting)
         logging.warning(ex.message)
         await asyncio.sleep(ex.retry_after)
-        return await create_forum_topic(bot, config, name)
+        return await create_forum_topic(bot, config, name, chat_id)
 
     except TelegramBadRequest as ex:
         if "not enough rights" in ex.message:
@@ -0,0 +1,22 @@
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
+
+BLOCKED = "blocked"
+DEACTIVATED = "deactivated"
+CHAT_NOT_FOUND = "chat_not_found"
+
+
+def get_delivery_error(error: TelegramAPIError) -> str | None:
+    """
+    Get the reason a user can not receive messages from an error of the Bot API.
+
+    :param error: The Bot API error.
+    :return: BLOCKED, DEACTIVATED, CHAT_NOT_FOUND or None if the error is not about the user.
+    """
+    if isinstance(error, TelegramForbiddenError):
+        if "blocked" in error.message:
+            return BLOCKED
+        if "deactivated" in error.message:
+            return DEACTIVATED
+    if isinstance(error, TelegramBadRequest) and "chat not found" in error.message:
+        return CHAT_NOT_FOUND
+    return None
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import Dict, Set, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.metrics import registry
+
+DRAIN_IN_FLIGHT = registry.gauge("drain_in_flight_updates", "Updates being handled.")
+DRAIN_PERSISTED = registry.counter("drain_persisted_total", "Work persisted to Redis on shutdown, by kind.")
+DRAIN_RESTORED = registry.counter("drain_restored_total", "Work restored from Redis on startup, by kind.")
+
+
+class Drainer:
+    """
+    Keeps track of the in-flight work, so it is finished or persisted on shutdown.
+
+    On shutdown new updates are no longer handled, the in-flight updates get until the deadline to finish, and
+    whatever is left (unfinished updates and deferred deletions) is persisted to Redis. On the next start the
+    deletions are rescheduled and the updates are fed into the dispatcher again.
+
+    A persisted update is handled again from the start, so a part of it may be done twice (e.g. the confirmation sent
+    to the user), but no user message is lost.
+    """
+
+    NAME = "drain"
+
+    def __init__(self, redis: Redis, bot: Bot, timeout: float, name: str | None = None) -> None:
+        """
+        Initializes the Drainer instance.
+
+        :param redis: The Redis instance.
+        :param bot: The Bot instance used to delete messages.
+        :param timeout: The number of seconds the in-flight updates get to finish on shutdown.
+        :param name: The prefix of the keys, NAME by default (see BotConfig.key for the other bots).
+        """
+        self.redis = redis
+        self.bot = bot
+        self.timeout = timeout
+        if name is not None:
+            self.NAME = name
+        self.draining = False
+        # The monotonic time the last update was handled at, None before the first one
+        self.handled_at: float | None = None
+
+        self._updates: Dict[int, Tuple[Update, asyncio.Task]] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self._deletions: Dict[Tuple[int, int], Tuple[float, asyncio.TimerHandle]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def begin(self, update: Update) -> None:
+        """
+        Start tracking an update being handled.
+
+        :param update: The update.
+        """
+        self._updates[update.update_id] = (update, asyncio.current_task())
+        self._idle.clear()
+        DRAIN_IN_FLIGHT.set(len(self._updates))
+
+    def end(self, update: Update) -> None:
+        """
+        Stop tracking a handled update.
+
+        :param update: The update.
+        """
+        self._updates.pop(update.update_id, None)
+        self.handled_at = time.monotonic()
+        if not self._updates:
+            self._idle.set()
+        DRAIN_IN_FLIGHT.set(len(self._updates))
+
+    def delete_later(self, chat_id: int, message_id: int, delay: float) -> None:
+        """
+        Delete a message after a delay without holding the handler.
+
+        :param chat_id: The chat ID of the message.
+        :param message_id: The message ID.
+        :param delay: The delay in seconds.
+        """
+        key = (chat_id, message_id)
+        handle = asyncio.get_running_loop().call_later(delay, self._spawn_delete, chat_id, message_id)
+        self._deletions[key] = (time.time() + delay, handle)
+
+    def _spawn_delete(self, chat_id: int, message_id: int) -> None:
+        """
+        Start deleting a message whose delay has passed.
+        """
+        self._deletions.pop((chat_id, message_id), None)
+        task = asyncio.create_task(self._delete(chat_id, message_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _delete(self, chat_id: int, message_id: int) -> None:
+        """
+        Delete a message, ignoring the messages that are already gone.
+        """
+        with suppress(TelegramAPIError):
+            await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+    async def drain(self) -> None:
+        """
+        Stop handling new updates, wait for the in-flight ones until the deadline and persist what is left.
+        """
+        self.draining = True
+        deadline = time.monotonic() + self.timeout
+
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._idle.wait(), self.timeout)
+        # Deletions already started are short, let them finish
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=max(deadline - time.monotonic(), 1))
+
+        updates = sorted(self._updates.values(), key=lambda item: item[0].update_id)
+        deletions = {f"{chat_id}:{message_id}": due for (chat_id, message_id), (due, _) in self._deletions.items()}
+        for _, handle in self._deletions.values():
+            handle.cancel()
+        self._deletions.clear()
+
+        if updates or deletions:
+            try:
+                await self._persist([update for update, _ in updates], deletions)
+            except RedisError as ex:
+                logging.error(f"Lost {len(updates)} unfinished updates and {len(deletions)} deletions: {ex!r}")
+
+        # The persisted updates are handled again on the next start
+        for _, task in updates:
+            if task is not None:
+                task.cancel()
+        self._updates.clear()
+        self._idle.set()
+
+    async def persist_update(self, update: Update) -> None:
+        """
+        Persist an update that arrived while draining.
+
+        :param update: The update.
+        """
+        await self._persist([update], {})
+
+    async def _persist(self, updates: list, deletions: Dict[str, float]) -> None:
+        """
+        Persist unfinished updates and pending deletions to Redis.
+
+        :param updates: The unfinished updates in the order they were received.
+        :param deletions: Mapping of "chat_id:message_id" to the time the message is due to be deleted.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if updates:
+                pipe.rpush(
+                    f"{self.NAME}_updates",
+                    *(update.model_dump_json(exclude_unset=True) for update in updates),
+                )
+            if deletions:
+                pipe.zadd(f"{self.NAME}_deletions", deletions)
+            await pipe.execute()
+
+        DRAIN_PERSISTED.inc(len(updates), kind="updates")
+        DRAIN_PERSISTED.inc(len(deletions), kind="deletions")
+        if updates or deletions:
+            logging.warning(f"Persisted {len(updates)} unfinished updates and {len(deletions)} deferred deletions")
+
+    async def restore(self, dp: Dispatcher) -> None:
+        """
+        Restore the work persisted on the previous shutdown.
+
+        Deletions are rescheduled with the delay that was left, updates are fed into the dispatcher in the order they
+        were received. Both are read and cleared atomically, so only one replica restores them.
+
+        :param dp: The Dispatcher the updates are fed into.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(f"{self.NAME}_updates", 0, -1)
+            pipe.zrange(f"{self.NAME}_deletions", 0, -1, withscores=True)
+            pipe.delete(f"{self.NAME}_updates", f"{self.NAME}_deletions")
+            raw_updates, deletions, _ = await pipe.execute()
+
+        now = time.time()
+        for member, due in deletions:
+            chat_id, message_id = map(int, member.decode().split(":"))
+            self.delete_later(chat_id, message_id, max(due - now, 0))
+
+        for raw in raw_updates:
+            update = Update.model_validate_json(raw, context={"bot": self.bot})
+            # Fed as tasks like polling does, so the parts of an album are handled together
+            # The updates were claimed before the shutdown, see DedupMiddleware
+            task = asyncio.create_task(dp.feed_update(self.bot, update, restored=True))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        DRAIN_RESTORED.inc(len(raw_updates), kind="updates")
+        DRAIN_RESTORED.inc(len(deletions), kind="deletions")
+        if raw_updates or deletions:
+            logging.info(f"Restored {len(raw_updates)} unfinished updates and {len(deletions)} deferred deletions")
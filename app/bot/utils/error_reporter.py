@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import logging
+import traceback
+from contextlib import suppress
+from typing import Any, Dict, List, MutableMapping
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, ErrorEvent
+from aiogram.utils.markdown import hbold, hcode
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.bot.utils.texts import format_duration
+from app.config import Config
+
+
+class ErrorReporter:
+    """
+    Reports handler errors to DEV_ID without flooding the chat.
+
+    Errors are fingerprinted by exception type and stack. The first occurrence of a fingerprint within the window is
+    sent in full, repeats are only counted in Redis and sent as a periodic digest with sample update IDs. Both the
+    fingerprints and the digest live in Redis, so replicas share them and only one of them sends each digest.
+
+    If Redis itself is failing, the fingerprints and repeats are kept in memory until it recovers.
+    """
+
+    NAME = "errors"
+
+    def __init__(self, redis: Redis, bot: Bot, config: Config, name: str | None = None) -> None:
+        """
+        Initializes the ErrorReporter instance.
+
+        :param redis: The Redis instance.
+        :param bot: The Bot instance used to send the reports.
+        :param config: The Config object.
+        :param name: The prefix of the keys, NAME by default (see BotConfig.key for the other bots).
+        """
+        self.redis = redis
+        self.bot = bot
+        if name is not None:
+            self.NAME = name
+        self.dev_id = config.bot.DEV_ID
+        self.window = config.errors.WINDOW
+        self.digest_interval = config.errors.DIGEST_INTERVAL
+        self.samples = config.errors.SAMPLES
+
+        self._task: asyncio.Task | None = None
+        self._local_seen: MutableMapping[str, None] = TTLCache(maxsize=1_000, ttl=self.window)
+        self._local_digest: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def fingerprint(exception: BaseException) -> str:
+        """
+        Get the fingerprint of an exception from its type and the frames of its stack.
+
+        :param exception: The exception.
+        :return: The fingerprint.
+        """
+        frames = traceback.extract_tb(exception.__traceback__)
+        stack = "|".join(f"{frame.filename}:{frame.name}:{frame.lineno}" for frame in frames)
+        key = f"{type(exception).__module__}.{type(exception).__qualname__}|{stack}"
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    async def report(self, event: ErrorEvent, text: str | None = None) -> None:
+        """
+        Report an error.
+
+        :param event: The ErrorEvent object.
+        :param text: The text sent on the first occurrence instead of the full report.
+        """
+        update_json = event.update.model_dump_json(indent=2, exclude_none=True)
+        await self.report_exception(event.exception, event.update.update_id, f"Update:\n{update_json}", text)
+
+    async def report_exception(
+            self,
+            exception: BaseException,
+            sample: int | str,
+            details: str,
+            text: str | None = None,
+    ) -> None:
+        """
+        Report an error raised outside of the handlers, e.g. by an outbox callback.
+
+        :param exception: The exception.
+        :param sample: The ID of the failed update or operation, listed in the digest.
+        :param details: The description of the update or operation, appended to the traceback of the full report.
+        :param text: The text sent on the first occurrence instead of the full report.
+        """
+        fingerprint = self.fingerprint(exception)
+        exc_text, exc_name = str(exception), type(exception).__name__
+
+        try:
+            first_occurrence = await self._count(sample, fingerprint, exc_name, exc_text)
+        except RedisError:
+            first_occurrence = fingerprint not in self._local_seen
+            self._local_seen[fingerprint] = None
+            if not first_occurrence:
+                entry = self._local_digest.setdefault(
+                    fingerprint, {"name": exc_name, "text": exc_text[:256], "count": 0, "samples": []},
+                )
+                entry["count"] += 1
+                entry["samples"] = [sample, *entry["samples"]][:self.samples]
+
+        if first_occurrence:
+            if text is None:
+                await self._send_full_report(exception, sample, details)
+            else:
+                await self.bot.send_message(self.dev_id, text)
+
+    async def _count(self, sample: int | str, fingerprint: str, exc_name: str, exc_text: str) -> bool:
+        """
+        Claim the first occurrence of the fingerprint in Redis, or count it as a repeat.
+
+        :return: True if this is the first occurrence within the window.
+        """
+        async with self.redis.client() as client:
+            if await client.set(f"{self.NAME}_seen_{fingerprint}", 1, nx=True, ex=self.window):
+                return True
+
+            # In one transaction, so the digest never reads a repeat counted halfway
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.sadd(f"{self.NAME}_digest", fingerprint)
+                pipe.hincrby(f"{self.NAME}_digest_{fingerprint}", "count", 1)
+                pipe.hset(f"{self.NAME}_digest_{fingerprint}", "name", exc_name)
+                pipe.hset(f"{self.NAME}_digest_{fingerprint}", "text", exc_text[:256])
+                pipe.lpush(f"{self.NAME}_samples_{fingerprint}", sample)
+                pipe.ltrim(f"{self.NAME}_samples_{fingerprint}", 0, self.samples - 1)
+                await pipe.execute()
+            return False
+
+    async def _send_full_report(self, exception: BaseException, sample: int | str, details: str) -> None:
+        """
+        Send the traceback and the update or operation as a single document.
+
+        :param exception: The exception.
+        :param sample: The ID of the failed update or operation.
+        :param details: The description of the update or operation.
+        """
+        exc_text, exc_name = str(exception), type(exception).__name__
+
+        document_data = "".join(traceback.format_exception(exception)) + "\n" + details
+        document_name = f'error_{sample}.txt'.replace(":", "_")
+
+        document = BufferedInputFile(document_data.encode(), filename=document_name)
+        caption = f'{hbold(exc_name)}:\n{hcode(exc_text[:1024 - len(exc_name) - 2])}'
+        await self.bot.send_document(self.dev_id, document, caption=caption)
+
+    async def send_digest(self) -> None:
+        """
+        Send the repeats counted since the last digest.
+        """
+        entries = list(self._local_digest.values())
+        self._local_digest.clear()
+        try:
+            entries.extend(await self._pop_digest())
+        except RedisError as ex:
+            logging.warning(f"Failed to read the error digest from Redis: {ex!r}")
+
+        lines = [
+            f"• {hbold(entry['name'])}: {hcode(entry['text'][:200])}\n"
+            f"  repeated {entry['count']} times, samples: {', '.join(map(str, entry['samples']))}"
+            for entry in entries
+        ]
+        if not lines:
+            return
+
+        # Split by entries, so no HTML tag is cut in half
+        chunk = f"{hbold('Error digest')} (last {format_duration(self.digest_interval)})"
+        for line in lines:
+            if len(chunk) + len(line) + 2 > 4096:
+                await self.bot.send_message(self.dev_id, chunk)
+                chunk = ""
+            chunk = f"{chunk}\n\n{line}" if chunk else line
+        await self.bot.send_message(self.dev_id, chunk)
+
+    async def _pop_digest(self) -> List[Dict[str, Any]]:
+        """
+        Read and clear the repeats counted in Redis.
+
+        A lock in Redis makes sure only one replica reads the digest per interval.
+
+        :return: The digest entries.
+        """
+        async with self.redis.client() as client:
+            # Redis rejects an expiry below one second
+            if not await client.set(f"{self.NAME}_digest_lock", 1, nx=True, ex=max(self.digest_interval - 1, 1)):
+                return []
+
+            fingerprints = await client.smembers(f"{self.NAME}_digest")
+            if not fingerprints:
+                return []
+
+            # Read and clear atomically, so repeats counted meanwhile are not lost
+            async with client.pipeline(transaction=True) as pipe:
+                for fingerprint in fingerprints:
+                    fingerprint = fingerprint.decode()
+                    pipe.hgetall(f"{self.NAME}_digest_{fingerprint}")
+                    pipe.lrange(f"{self.NAME}_samples_{fingerprint}", 0, -1)
+                    pipe.delete(f"{self.NAME}_digest_{fingerprint}", f"{self.NAME}_samples_{fingerprint}")
+                    pipe.srem(f"{self.NAME}_digest", fingerprint)
+                results = await pipe.execute()
+
+        return [
+            {
+                "name": data.get(b"name", b"").decode(),
+                "text": data.get(b"text", b"").decode(),
+                "count": int(data.get(b"count", 0)),
+                "samples": [sample.decode() for sample in samples],
+            }
+            for data, samples in zip(results[0::4], results[1::4]) if data
+        ]
+
+    async def _run(self) -> None:
+        """
+        Send the digest periodically.
+        """
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            try:
+                await self.send_digest()
+            except Exception as ex:
+                logging.warning(f"Failed to send the error digest: {ex!r}")
+
+    def start(self) -> None:
+        """
+        Start sending the periodic digest.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop sending the periodic digest.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
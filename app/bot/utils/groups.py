@@ -0,0 +1,59 @@
+import hashlib
+from typing import List
+
+from app.config import Config
+from .redis.models import UserData
+
+
+def get_group_key(config: Config, chat_id: int) -> int | None:
+    """
+    Get the key the topics and messages of a group are stored under.
+
+    The first group keeps the keys it had before the groups were sharded, so its key is None.
+
+    :param config: The configuration object.
+    :param chat_id: The ID of the group.
+    :return: None for the first group, the ID of the group otherwise.
+    """
+    return None if chat_id == config.bot.GROUP_ID else chat_id
+
+
+def get_group_id(config: Config, group_key: int | None) -> int:
+    """
+    Get the ID of a group from its key, see get_group_key.
+
+    :param config: The configuration object.
+    :param group_key: The key of the group.
+    :return: The ID of the group.
+    """
+    return config.bot.GROUP_ID if group_key is None else group_key
+
+
+def get_user_group(config: Config, user_data: UserData) -> int:
+    """
+    Get the ID of the group the topic of a user is in.
+
+    :param config: The configuration object.
+    :param user_data: The user data.
+    :return: The ID of the group.
+    """
+    return get_group_id(config, user_data.group_id)
+
+
+def rank_groups(config: Config, user_id: int) -> List[int]:
+    """
+    Rank the groups for the topic of a user with rendezvous hashing, the topic is created in the first one that
+    accepts it.
+
+    Every replica ranks the groups of a user the same way, so the topics spread evenly across the groups without
+    shared state. Adding a group only moves the new users ranked first on it, removing one only moves its own users.
+
+    :param config: The configuration object.
+    :param user_id: The ID of the user.
+    :return: The IDs of the groups, from the preferred one.
+    """
+    def weight(group_id: int) -> int:
+        digest = hashlib.blake2b(f"{group_id}:{user_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    return sorted(config.bot.GROUP_IDS, key=weight, reverse=True)
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence
+
+from redis.exceptions import RedisError
+
+from app.config import HealthConfig
+from app.metrics import registry
+from .circuit_breaker import OPEN
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+    from app.bot.session import RetryMiddleware
+    from app.bot.tenant import Tenant
+    from .loop_monitor import LoopMonitor
+    from .redis import RedisHealth
+
+READY = registry.gauge("health_ready", "Whether the last readiness check passed.")
+
+
+class HealthServer:
+    """
+    HTTP server with the liveness and readiness endpoints, and the metrics.
+
+    - GET /live: 200 while the event loop is responsive, 503 if its last lag sample is above MAX_LOOP_LAG (a restart
+      helps).
+    - GET /ready: 200 while the bot is polling and its dependencies answer in time, 503 otherwise (traffic is routed
+      elsewhere, the bot recovers on its own). Fails while shutting down, after an event loop stall within the last
+      LAG_WINDOW seconds, while Redis or the Bot API is degraded or slow, and while the outbox is backed up.
+    - GET /metrics: the metrics in the Prometheus text format.
+
+    Both checks return the measured values as JSON, with the names of the failed checks.
+    """
+
+    def __init__(
+            self,
+            config: HealthConfig,
+            tenants: Sequence[Tenant],
+            redis_health: RedisHealth,
+            loop_monitor: LoopMonitor,
+            retry: RetryMiddleware | None = None,
+    ) -> None:
+        """
+        Initializes the HealthServer instance.
+
+        :param config: The health configuration.
+        :param tenants: The bots served by the process.
+        :param redis_health: The Redis health monitor, its Redis instance is probed.
+        :param loop_monitor: The event loop monitor, its lag samples are checked.
+        :param retry: The RetryMiddleware of the Bot API session, with its circuit breaker and paused method groups.
+        """
+        self.config = config
+        self.tenants = tenants
+        self.redis_health = redis_health
+        self.loop_monitor = loop_monitor
+        self.retry = retry
+
+        # Whether the bot is polling, set by the startup and shutdown handlers
+        self.polling = False
+        self._runner: web.AppRunner | None = None
+
+    async def _probe_redis(self) -> float | None:
+        """
+        Ping Redis.
+
+        :return: The latency in seconds, None if Redis did not answer within MAX_REDIS_LATENCY.
+        """
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(self.redis_health.redis.ping(), self.config.MAX_REDIS_LATENCY)
+        except (RedisError, asyncio.TimeoutError):
+            return None
+        return time.monotonic() - started_at
+
+    async def _outbox_depth(self) -> int | None:
+        """
+        Get the number of operations waiting in the outboxes of the bots.
+
+        :return: The number of operations, None if Redis is unavailable.
+        """
+        if self.redis_health.degraded:
+            return None
+        try:
+            return sum([await tenant.outbox.depth() for tenant in self.tenants if tenant.outbox.enabled])
+        except RedisError:
+            return None
+
+    def live(self) -> Dict[str, Any]:
+        """
+        Check the liveness.
+
+        :return: The result, with "ok" and the failed checks.
+        """
+        # Only the last sample counts, a past stall is no reason to restart (a stalled loop does not answer at all)
+        lag = self.loop_monitor.lag
+        failed = ["loop_lag"] if lag > self.config.MAX_LOOP_LAG else []
+        return {"ok": not failed, "failed": failed, "loop_lag": round(lag, 4)}
+
+    async def ready(self) -> Dict[str, Any]:
+        """
+        Check the readiness.
+
+        :return: The result, with "ok" and the failed checks.
+        """
+        now = time.monotonic()
+        loop_lag = self.loop_monitor.max_lag
+        redis_latency, outbox_depth = await asyncio.gather(self._probe_redis(), self._outbox_depth())
+        update_ages = {
+            tenant.namespace or "main": None if tenant.drainer.handled_at is None else now - tenant.drainer.handled_at
+            for tenant in self.tenants
+        }
+
+        failed: List[str] = []
+        if not self.polling:
+            failed.append("polling")
+        if loop_lag > self.config.MAX_LOOP_LAG:
+            failed.append("loop_lag")
+        if redis_latency is None or self.redis_health.degraded:
+            failed.append("redis")
+        if self.retry is not None and self.retry.breaker.state == OPEN:
+            failed.append("bot_api")
+        if outbox_depth is not None and outbox_depth > self.config.MAX_OUTBOX_DEPTH:
+            failed.append("outbox")
+        if self.config.MAX_UPDATE_AGE and all(
+                age is None or age > self.config.MAX_UPDATE_AGE for age in update_ages.values()
+        ):
+            failed.append("updates")
+        READY.set(not failed)
+
+        return {
+            "ok": not failed,
+            "failed": failed,
+            "polling": self.polling,
+            "loop_lag": round(loop_lag, 4),
+            "redis": {
+                "latency": None if redis_latency is None else round(redis_latency, 4),
+                "breaker": self.redis_health.breaker.state,
+                "journal": len(self.redis_health.journal),
+            },
+            "bot_api": None if self.retry is None else {
+                "breaker": self.retry.breaker.state,
+                "paused_groups": self.retry.paused,
+            },
+            "outbox_depth": outbox_depth,
+            "update_age": {name: None if age is None else round(age, 1) for name, age in update_ages.items()},
+        }
+
+    async def start(self) -> None:
+        """
+        Start the HTTP server.
+        """
+        # aiohttp.web is only needed when the server is enabled, it is not imported at startup
+        from aiohttp import web
+
+        async def live(_: web.Request) -> web.Response:
+            result = self.live()
+            return web.json_response(result, status=200 if result["ok"] else 503)
+
+        async def ready(_: web.Request) -> web.Response:
+            result = await self.ready()
+            return web.json_response(result, status=200 if result["ok"] else 503)
+
+        async def metrics(_: web.Request) -> web.Response:
+            return web.Response(text=registry.render(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/live", live)
+        app.router.add_get("/ready", ready)
+        app.router.add_get("/metrics", metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.config.HOST, self.config.PORT).start()
+        logging.info(f"Health endpoints listening on {self.config.HOST}:{self.config.PORT}")
+
+    async def stop(self) -> None:
+        """
+        Stop the HTTP server.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from itertools import takewhile
+from types import FrameType
+from typing import Deque
+
+from app.config import LoopConfig
+from app.metrics import registry
+
+LOOP_LAG = registry.histogram("event_loop_lag_seconds", "Delay of the event loop lag samples.")
+LOOP_BLOCKED = registry.histogram("event_loop_blocked_seconds", "Duration of the event loop stalls over the threshold.")
+
+# Seconds of lag samples kept for the readiness check, so a stall between two checks is not missed
+LAG_WINDOW = 10
+
+
+class LoopMonitor:
+    """
+    Measures the event loop lag and records the synchronous work that blocks the loop.
+
+    A task on the loop sleeps for the interval and measures how late it wakes up, each sample is observed in the lag
+    histogram. A watchdog thread checks that the task keeps waking up: once the loop is blocked longer than the
+    threshold, the watchdog takes the stack of the loop thread, i.e. the code blocking it, and when the loop is free
+    again the stall is logged with its duration and that stack.
+    """
+
+    def __init__(self, config: LoopConfig) -> None:
+        """
+        Initializes the LoopMonitor instance.
+
+        :param config: The loop monitor configuration.
+        """
+        self.interval = config.INTERVAL
+        self.threshold = config.BLOCK_THRESHOLD
+
+        self.lags: Deque[float] = deque(maxlen=max(int(LAG_WINDOW / self.interval), 1))
+        self._heartbeat = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def lag(self) -> float:
+        """
+        The event loop lag of the last sample.
+        """
+        return self.lags[-1] if self.lags else 0.0
+
+    @property
+    def max_lag(self) -> float:
+        """
+        The highest event loop lag within the last LAG_WINDOW seconds.
+        """
+        return max(self.lags, default=0.0)
+
+    async def _sample(self) -> None:
+        """
+        Measure how late the event loop wakes up a sleeping task.
+        """
+        while True:
+            self._heartbeat = started_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started_at - self.interval, 0)
+            self.lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+    @staticmethod
+    def _stack(frame: FrameType | None) -> str:
+        """
+        Format a stack up to the callback run by the event loop, without the frames of the loop itself.
+        """
+        frames = takewhile(
+            lambda item: not item[0].f_code.co_filename.endswith(("asyncio/events.py", "asyncio\\events.py")),
+            traceback.walk_stack(frame),
+        ) if frame is not None else ()
+        summary = traceback.StackSummary.extract(frames)
+        summary.reverse()
+        return "".join(summary.format())
+
+    def _watch(self, thread_id: int) -> None:
+        """
+        Take the stack of the loop thread while the loop is blocked, log the stall when it is over.
+        """
+        blocked_since = None
+        stack = ""
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for > self.threshold:
+                if blocked_since != heartbeat:
+                    # A new stall, the loop thread is running the blocking code right now
+                    blocked_since = heartbeat
+                    stack = self._stack(sys._current_frames().get(thread_id))
+            elif blocked_since is not None:
+                duration = heartbeat - blocked_since - self.interval
+                LOOP_BLOCKED.observe(duration)
+                logging.warning(f"Event loop was blocked for {duration:.3f}s, stack at the stall:\n{stack}")
+                blocked_since = None
+
+    def start(self) -> None:
+        """
+        Start the sampling task and the watchdog thread.
+        """
+        self._stop.clear()
+        # A heartbeat left from before a restart would be reported as a stall
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            args=(threading.get_ident(),),
+            name="loop-watchdog",
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        """
+        Stop the sampling task and the watchdog thread.
+        """
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
@@ -0,0 +1,623 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import zlib
+from collections import defaultdict
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiogram.methods
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import PinChatMessage, TelegramMethod
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from app.config import Config
+from app.metrics import registry
+from app.serialization import json_dumps, json_loads
+from .drain import Drainer
+from .error_reporter import ErrorReporter
+from .redis import RedisHealth
+
+OUTBOX_ENQUEUED = registry.counter("outbox_enqueued_total", "Operations enqueued, by method.")
+OUTBOX_INLINE = registry.counter("outbox_inline_total", "Operations sent inline while the queue is unavailable.")
+OUTBOX_SENT = registry.counter("outbox_sent_total", "Operations sent by the workers, by method and result.")
+OUTBOX_DEDUPED = registry.counter("outbox_deduped_total", "Operations skipped because they were already sent.")
+OUTBOX_DEAD = registry.counter("outbox_dead_letters_total", "Operations moved to the dead letters, by method.")
+OUTBOX_LAG = registry.gauge("outbox_lag_seconds", "Time between enqueueing and sending the last operation.")
+
+# Errors after which an operation is attempted again, the others are final
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramRetryAfter, TelegramServerError)
+# Maximum number of seconds an ordering key waits after a transient error
+MAX_BACKOFF = 60
+# Extend a lock only if it is still held by the consumer, in one step so a lock taken over meanwhile is not extended
+RENEW_LOCK = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Bot API method classes by their API names
+METHODS: Dict[str, type] = {
+    cls.__api_method__: cls
+    for cls in vars(aiogram.methods).values()
+    if isinstance(cls, type) and issubclass(cls, TelegramMethod) and hasattr(cls, "__api_method__")
+}
+
+Callback = Callable[["Outbox", "Operation", Any, Optional[TelegramAPIError]], Awaitable[None]]
+CALLBACKS: Dict[str, Callback] = {}
+
+
+def outbox_callback(name: str) -> Callable[[Callback], Callback]:
+    """
+    Register a callback run after an operation is sent or has finally failed.
+
+    The callback is called with the Outbox, the operation, the result of the method (or None) and the error (or None).
+    Operations refer to their callback by name, so it is found again by a worker of another replica.
+
+    :param name: The name of the callback.
+    :return: The decorator.
+    """
+    def decorator(callback: Callback) -> Callback:
+        CALLBACKS[name] = callback
+        return callback
+
+    return decorator
+
+
+def result_message_ids(result: Any) -> List[int]:
+    """
+    Get the IDs of the messages sent by a method.
+
+    :param result: The result of the method: a Message or MessageId, or a list of them.
+    :return: The list of message IDs.
+    """
+    return [item.message_id for item in (result if isinstance(result, list) else [result])]
+
+
+def _strip_defaults(value: Any) -> Any:
+    """
+    Drop the unset values and the bot defaults, they are applied again when the method is sent.
+    """
+    if isinstance(value, dict):
+        return {k: _strip_defaults(v) for k, v in value.items() if v is not None and not isinstance(v, Default)}
+    if isinstance(value, list):
+        return [_strip_defaults(v) for v in value]
+    return value
+
+
+@dataclass
+class Operation:
+    """
+    Data class representing a queued Bot API call.
+
+    Attributes:
+    - key (str): The dedupe key, an operation with a key that was already sent is skipped.
+    - order (str): The ordering key (chat and topic), operations with the same key are sent in order.
+    - method (TelegramMethod): The Bot API method.
+    - callback (str | None): The name of the callback run after the operation.
+    - context (dict): The data passed to the callback.
+    - enqueued_at (float): The time the operation was enqueued.
+    """
+    key: str
+    order: str
+    method: TelegramMethod
+    callback: Optional[str] = None
+    context: Dict[str, Any] = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.time)
+
+    def to_fields(self) -> Dict[str, str]:
+        """
+        Convert the operation to the fields of a stream entry.
+        """
+        params = _strip_defaults(self.method.model_dump(exclude_unset=True))
+        return {
+            "key": self.key,
+            "order": self.order,
+            "method": self.method.__api_method__,
+            "params": json_dumps(params),
+            "callback": self.callback or "",
+            "context": json_dumps(self.context),
+            "enqueued_at": str(self.enqueued_at),
+        }
+
+    @classmethod
+    def from_fields(cls, fields: Dict[bytes, bytes]) -> "Operation":
+        """
+        Create the operation from the fields of a stream entry.
+        """
+        values = {k.decode(): v.decode() for k, v in fields.items()}
+        return cls(
+            key=values["key"],
+            order=values["order"],
+            method=METHODS[values["method"]].model_validate(json_loads(values["params"])),
+            callback=values["callback"] or None,
+            context=json_loads(values["context"]),
+            enqueued_at=float(values["enqueued_at"]),
+        )
+
+
+class RateLimiter:
+    """
+    Spaces the calls evenly, so no more than the rate is made per second.
+    """
+
+    def __init__(self, rate: float) -> None:
+        """
+        Initializes the RateLimiter instance.
+
+        :param rate: The maximum number of calls per second.
+        """
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        """
+        Wait until the next call may be made.
+        """
+        now = time.monotonic()
+        at = max(self._next, now)
+        self._next = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    def hold(self, seconds: float) -> None:
+        """
+        Make no calls for the given time, e.g. after a RetryAfter.
+
+        :param seconds: The number of seconds.
+        """
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class Outbox:
+    """
+    Outbound queue of Bot API calls on Redis Streams.
+
+    Handlers enqueue the calls they do not need the result of, so a slow Bot API or a RetryAfter does not hold
+    them. The operations are spread over partition streams by their ordering key (chat and topic). Each partition is
+    locked by one replica and sent by a single worker, which reads a batch and sends the operations of different
+    keys concurrently and those of the same key in order, under the shared rate limit of the replica.
+
+    Delivery is at least once: an operation is acknowledged after it is sent, and a sent operation's dedupe key is
+    remembered, so a redelivered or re-enqueued operation is skipped. An operation failing with a transient error is
+    attempted again after an exponential backoff, its ordering key is parked meanwhile (the following operations of
+    the key wait, the other keys are still sent). After DEAD_LETTER_AFTER attempts it is moved to the dead letters.
+
+    The lock of a partition is renewed every third of LOCK_TTL while the worker sends, however long a batch takes,
+    and the worker stops as soon as it loses the lock. A replica taking over a partition claims the operations
+    another replica left unacknowledged for LOCK_TTL, so those still being sent by a replica that lost the lock are
+    not sent twice.
+
+    While Redis is unavailable, or with the queue disabled, the operations are sent inline.
+
+    The errors of the callbacks are reported to DEV_ID by the ErrorReporter, the handler that enqueued the operation
+    is done by then.
+    """
+
+    NAME = "outbox"
+    GROUP = "senders"
+
+    def __init__(
+            self,
+            redis: Redis,
+            bot: Bot,
+            config: Config,
+            health: RedisHealth,
+            drainer: Drainer,
+            error_reporter: ErrorReporter | None = None,
+            name: str | None = None,
+    ) -> None:
+        """
+        Initializes the Outbox instance.
+
+        :param redis: The Redis instance.
+        :param bot: The Bot instance used to send the operations.
+        :param config: The Config object.
+        :param health: The RedisHealth instance.
+        :param drainer: The Drainer instance, used by the callbacks deleting messages later.
+        :param error_reporter: The ErrorReporter instance, or None to only log the errors of the callbacks.
+        :param name: The prefix of the keys, NAME by default (see BotConfig.key for the other bots).
+        """
+        self.redis = redis
+        self.bot = bot
+        self.config = config
+        self.health = health
+        self.drainer = drainer
+        self.error_reporter = error_reporter
+        if name is not None:
+            self.NAME = name
+
+        self.enabled = config.outbox.ENABLED
+        self.partitions = config.outbox.PARTITIONS
+        self.batch = config.outbox.BATCH
+        self.dead_letter_after = config.outbox.DEAD_LETTER_AFTER
+        self.dedupe_ttl = config.outbox.DEDUPE_TTL
+        self.maxlen = config.outbox.MAXLEN
+        self.lock_ttl = config.outbox.LOCK_TTL
+
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.limiter = RateLimiter(config.outbox.RATE)
+        self._tasks: List[asyncio.Task] = []
+        # Monotonic time until which an ordering key waits, by ordering key
+        self._parked: Dict[str, float] = {}
+        # Monotonic time of the next claim of the operations left by other replicas, by partition
+        self._claim_at: Dict[str, float] = {}
+
+    def _stream(self, order: str) -> str:
+        """
+        Get the partition stream of an ordering key.
+        """
+        return f"{self.NAME}_{zlib.crc32(order.encode()) % self.partitions}"
+
+    async def enqueue(
+            self,
+            method: TelegramMethod,
+            key: str,
+            callback: Optional[str] = None,
+            context: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Enqueue a Bot API call.
+
+        :param method: The Bot API method, its chat and topic are the ordering key.
+        :param key: The dedupe key, it identifies the operation across retries and replays of the update.
+        :param callback: The name of the callback run after the operation.
+        :param context: The data passed to the callback, it must be JSON serializable.
+        """
+        order = f"{getattr(method, 'chat_id', None)}:{getattr(method, 'message_thread_id', None) or 0}"
+        operation = Operation(key, order, method, callback, context or {})
+
+        if self.enabled and self.health.allow():
+            try:
+                await self.redis.xadd(
+                    self._stream(order), operation.to_fields(), maxlen=self.maxlen, approximate=True,
+                )
+            except RedisError:
+                self.health.record_failure("outbox_enqueue")
+            else:
+                self.health.record_success()
+                OUTBOX_ENQUEUED.inc(method=method.__api_method__)
+                return
+
+        OUTBOX_INLINE.inc(method=method.__api_method__)
+        try:
+            await self.send(operation)
+        except TRANSIENT_ERRORS as ex:
+            await self._run_callback(operation, None, ex)
+
+    async def send(self, operation: Operation) -> None:
+        """
+        Send an operation and run its callback.
+        Client errors (bad request, forbidden, ...) are passed to the callback, transient errors are raised.
+
+        :param operation: The operation.
+        """
+        await self.limiter.wait()
+        try:
+            result = await operation.method.as_(self.bot)
+        except TRANSIENT_ERRORS:
+            raise
+        except TelegramAPIError as ex:
+            OUTBOX_SENT.inc(method=operation.method.__api_method__, result="error")
+            await self._run_callback(operation, None, ex)
+            return
+
+        OUTBOX_SENT.inc(method=operation.method.__api_method__, result="ok")
+        OUTBOX_LAG.set(time.time() - operation.enqueued_at)
+        await self._run_callback(operation, result, None)
+
+    async def _run_callback(self, operation: Operation, result: Any, error: Optional[TelegramAPIError]) -> None:
+        """
+        Run the callback of an operation, its errors are reported.
+        """
+        if operation.callback is None:
+            if error is not None:
+                logging.warning(f"Outbox operation {operation.key!r} failed: {error!r}")
+            return
+        try:
+            await CALLBACKS[operation.callback](self, operation, result, error)
+        except Exception as ex:
+            logging.exception(f"Outbox callback {operation.callback!r} of {operation.key!r} failed: {ex!r}")
+            await self.report(operation, ex)
+
+    async def report(self, operation: Operation, error: Exception, text: Optional[str] = None) -> None:
+        """
+        Report an unexpected error of an operation or of its callback to DEV_ID.
+
+        :param operation: The operation.
+        :param error: The error.
+        :param text: The text sent on the first occurrence instead of the full report.
+        """
+        if self.error_reporter is None:
+            return
+        try:
+            await self.error_reporter.report_exception(
+                error, operation.key, f"Operation:\n{json_dumps(operation.to_fields())}", text,
+            )
+        except Exception as ex:
+            logging.warning(f"Failed to report the error of {operation.key!r}: {ex!r}")
+
+    async def _lock(self, stream: str) -> bool:
+        """
+        Acquire or renew the lock of a partition.
+
+        :return: True if the partition is locked by this replica.
+        """
+        lock = f"{stream}_lock"
+        if await self.redis.set(lock, self.consumer, nx=True, px=int(self.lock_ttl * 1000)):
+            # The previous owner stopped, its unacknowledged operations are taken over
+            self._claim_at[stream] = 0
+            return True
+        return bool(await self.redis.eval(RENEW_LOCK, 1, lock, self.consumer, int(self.lock_ttl * 1000)))
+
+    async def _keep_lock(self, stream: str) -> None:
+        """
+        Renew the lock of a partition every third of LOCK_TTL, however long a batch takes.
+
+        :return: When the lock is lost.
+        :raise RedisError: If the lock could not be renewed.
+        """
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            if not await self._lock(stream):
+                return
+
+    async def _claim(self, stream: str) -> None:
+        """
+        Take over the operations of a partition left unacknowledged by another replica for LOCK_TTL.
+        """
+        cursor = "0-0"
+        while True:
+            cursor, *_ = await self.redis.xautoclaim(
+                stream, self.GROUP, self.consumer,
+                min_idle_time=int(self.lock_ttl * 1000), start_id=cursor, count=self.batch,
+            )
+            if cursor in (b"0-0", "0-0"):
+                break
+
+    def _is_parked(self, fields: Dict[bytes, bytes] | None) -> bool:
+        """
+        Check whether the ordering key of a stream entry waits after a transient error.
+        """
+        if not fields:
+            return False
+        order = fields[b"order"].decode()
+        until = self._parked.get(order)
+        if until is not None and until <= time.monotonic():
+            del self._parked[order]
+            return False
+        return until is not None
+
+    def _park(self, order: str, attempts: int, error: TelegramAPIError) -> None:
+        """
+        Make an ordering key wait after a transient error, for the RetryAfter or an exponential backoff.
+        """
+        delay = error.retry_after if isinstance(error, TelegramRetryAfter) else min(2 ** attempts, MAX_BACKOFF)
+        self._parked[order] = time.monotonic() + delay
+
+    async def _read(self, stream: str) -> List[Tuple[bytes, Dict[bytes, bytes] | None]]:
+        """
+        Read the next batch of a partition, the unacknowledged operations first.
+        The operations of the parked ordering keys stay unacknowledged and are skipped until the keys are free.
+        """
+        entries = []
+        last_id = "0"
+        while len(entries) < self.batch:
+            response = await self.redis.xreadgroup(self.GROUP, self.consumer, {stream: last_id}, count=self.batch)
+            if not response or not response[0][1]:
+                break
+            entries += [entry for entry in response[0][1] if not self._is_parked(entry[1])]
+            last_id = response[0][1][-1][0]
+        if entries:
+            return entries
+        response = await self.redis.xreadgroup(self.GROUP, self.consumer, {stream: ">"}, count=self.batch, block=1000)
+        return [entry for entry in response[0][1] if not self._is_parked(entry[1])] if response else []
+
+    async def _process(self, stream: str, entries: List[Tuple[bytes, Dict[bytes, bytes] | None]]) -> None:
+        """
+        Send a batch of operations, those of the same ordering key in order.
+        """
+        orders: Dict[str, List[Tuple[bytes, Operation]]] = defaultdict(list)
+        for entry_id, fields in entries:
+            if not fields:
+                # Trimmed from the stream before it was sent
+                await self.redis.xack(stream, self.GROUP, entry_id)
+                continue
+            operation = Operation.from_fields(fields)
+            orders[operation.order].append((entry_id, operation))
+
+        await asyncio.gather(*(self._process_order(stream, items) for items in orders.values()))
+
+    async def _process_order(self, stream: str, items: List[Tuple[bytes, Operation]]) -> None:
+        """
+        Send the operations of an ordering key in order, parking the key at a transient error.
+        """
+        for entry_id, operation in items:
+            done_key = f"{self.NAME}_done_{operation.key}"
+            attempts_field = f"{stream}:{entry_id.decode()}"
+            if await self.redis.exists(done_key):
+                OUTBOX_DEDUPED.inc()
+                await self.redis.xack(stream, self.GROUP, entry_id)
+                continue
+
+            try:
+                await self.send(operation)
+            except TRANSIENT_ERRORS as ex:
+                attempts = await self.redis.hincrby(f"{self.NAME}_attempts", attempts_field, 1)
+                if attempts < self.dead_letter_after:
+                    # The following operations of the key wait, so the order is kept
+                    self._park(operation.order, attempts, ex)
+                    return
+                await self._dead_letter(stream, entry_id, operation, ex)
+                continue
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(done_key, 1, ex=self.dedupe_ttl)
+                pipe.xack(stream, self.GROUP, entry_id)
+                pipe.hdel(f"{self.NAME}_attempts", attempts_field)
+                await pipe.execute()
+
+    async def _dead_letter(self, stream: str, entry_id: bytes, operation: Operation, error: TelegramAPIError) -> None:
+        """
+        Move an operation that keeps failing to the dead letters.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(
+                f"{self.NAME}_dead",
+                {**operation.to_fields(), "error": repr(error)},
+                maxlen=self.maxlen,
+                approximate=True,
+            )
+            pipe.xack(stream, self.GROUP, entry_id)
+            pipe.hdel(f"{self.NAME}_attempts", f"{stream}:{entry_id.decode()}")
+            await pipe.execute()
+
+        OUTBOX_DEAD.inc(method=operation.method.__api_method__)
+        logging.error(f"Outbox operation {operation.key!r} dead-lettered: {error!r}")
+        await self._run_callback(operation, None, error)
+
+    async def _create_group(self, stream: str) -> None:
+        """
+        Create the consumer group of a partition, reading the operations enqueued before it existed too.
+        """
+        try:
+            await self.redis.xgroup_create(stream, self.GROUP, id="0", mkstream=True)
+        except ResponseError as ex:
+            if "BUSYGROUP" not in str(ex):
+                raise
+
+    async def _work(self, stream: str) -> None:
+        """
+        Send the operations of a partition while it is locked by this replica.
+        """
+        group_created = False
+        while True:
+            if self.health.degraded:
+                # The operations are sent inline until Redis is available again
+                await asyncio.sleep(1)
+                continue
+            try:
+                if not group_created:
+                    await self._create_group(stream)
+                    group_created = True
+                if not await self._lock(stream):
+                    await asyncio.sleep(self.lock_ttl / 3)
+                    continue
+                await self._serve(stream)
+            except RedisError as ex:
+                self.health.record_failure("outbox_worker")
+                logging.warning(f"Outbox worker of {stream} failed: {ex!r}")
+                await asyncio.sleep(1)
+
+    async def _serve(self, stream: str) -> None:
+        """
+        Send the operations of a locked partition until the lock is lost or Redis becomes unavailable.
+        """
+        sender = asyncio.create_task(self._send_batches(stream))
+        heartbeat = asyncio.create_task(self._keep_lock(stream))
+        try:
+            await asyncio.wait((sender, heartbeat), return_when=asyncio.FIRST_COMPLETED)
+            if not sender.done():
+                # The lock was lost (or could not be renewed), the batch is stopped before another replica claims it
+                sender.cancel()
+                with suppress(asyncio.CancelledError):
+                    await sender
+                heartbeat.result()
+                logging.warning(f"Outbox partition {stream} was taken over by another replica")
+                return
+            sender.result()
+        finally:
+            for task in (sender, heartbeat):
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+
+    async def _send_batches(self, stream: str) -> None:
+        """
+        Send the operations of a partition batch by batch, until Redis becomes unavailable.
+        """
+        while not self.health.degraded:
+            if self._claim_at.get(stream, 0) <= time.monotonic():
+                # Those the previous owner read less than LOCK_TTL ago may still be sent by it, they are claimed later
+                await self._claim(stream)
+                self._claim_at[stream] = time.monotonic() + self.lock_ttl
+            entries = await self._read(stream)
+            if entries:
+                await self._process(stream, entries)
+
+    async def depth(self) -> int:
+        """
+        Get the number of operations waiting in the partitions, read by no worker yet or not acknowledged.
+
+        :return: The number of operations.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for partition in range(self.partitions):
+                pipe.xinfo_groups(f"{self.NAME}_{partition}")
+            # A partition nothing was enqueued to does not exist yet
+            results = await pipe.execute(raise_on_error=False)
+
+        depth = 0
+        for groups in results:
+            if isinstance(groups, Exception):
+                continue
+            for group in groups:
+                if group["name"].decode() == self.GROUP:
+                    # The lag is only reported by Redis 7+
+                    depth += group["pending"] + (group.get("lag") or 0)
+        return depth
+
+    def start(self) -> None:
+        """
+        Start a worker per partition.
+        """
+        if not self.enabled:
+            return
+        for partition in range(self.partitions):
+            self._tasks.append(asyncio.create_task(self._work(f"{self.NAME}_{partition}")))
+
+    async def stop(self) -> None:
+        """
+        Stop the workers and release the partitions.
+        The operations not sent yet stay in the streams and are sent after the next start.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        for partition in range(self.partitions):
+            lock = f"{self.NAME}_{partition}_lock"
+            try:
+                if await self.redis.get(lock) == self.consumer.encode():
+                    await self.redis.delete(lock)
+            except RedisError:
+                break
+
+
+@outbox_callback("delete_later")
+async def delete_later(outbox: Outbox, operation: Operation, result: Any, error: Optional[TelegramAPIError]) -> None:
+    """
+    Delete the sent message after the delay from the context.
+    """
+    if error is None:
+        outbox.drainer.delete_later(result.chat.id, result.message_id, operation.context.get("delay", 5))
+
+
+@outbox_callback("pin")
+async def pin(outbox: Outbox, operation: Operation, result: Any, error: Optional[TelegramAPIError]) -> None:
+    """
+    Pin the sent message.
+    """
+    if error is None:
+        await outbox.enqueue(
+            PinChatMessage(chat_id=result.chat.id, message_id=result.message_id, disable_notification=True),
+            key=f"pin:{result.chat.id}:{result.message_id}",
+        )
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+# Modules of the code the time is attributed to in the report
+COMPONENT_MODULES = ("app.bot.handlers.", "app.bot.middlewares.")
+
+
+class SamplingProfiler:
+    """
+    Profiles the event loop thread of the live process by sampling its stack.
+
+    A background thread takes the stack of the event loop thread every interval, nothing is hooked into the profiled
+    code, so the overhead is a stack walk per sample whatever the load. The samples taken while the loop waits for
+    events are counted as idle. The time of a function is estimated from the share of the samples it is on the stack
+    of, the handlers and middlewares are named like in the logs (module.function:line).
+
+    Only one profile runs at a time.
+    """
+
+    def __init__(self, interval: float = 0.01, max_duration: float = 60) -> None:
+        """
+        Initializes the SamplingProfiler instance.
+
+        :param interval: The number of seconds between the samples.
+        :param max_duration: The maximum number of seconds a profile runs.
+        """
+        self.interval = interval
+        self.max_duration = max_duration
+        self._task: asyncio.Task | None = None
+        self._labels: Dict[CodeType, Tuple[str, str]] = {}
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether a profile is running.
+        """
+        return self._task is not None and not self._task.done()
+
+    def start(self, seconds: float, send: Callable[[str, str], Awaitable[None]]) -> bool:
+        """
+        Start profiling in the background, the report is sent when it is done.
+
+        :param seconds: The duration of the profile, capped at max_duration.
+        :param send: The coroutine function sending the report, called with the summary and the report.
+        :return: False if a profile is already running.
+        """
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._run(min(seconds, self.max_duration), send))
+        return True
+
+    async def _run(self, seconds: float, send: Callable[[str, str], Awaitable[None]]) -> None:
+        """
+        Profile and send the report.
+        """
+        try:
+            summary, report = await self.profile(seconds)
+            await send(summary, report)
+        except Exception as ex:
+            logging.warning(f"Profiling failed: {ex!r}")
+
+    async def profile(self, seconds: float) -> Tuple[str, str]:
+        """
+        Profile the event loop thread.
+
+        :param seconds: The duration of the profile.
+        :return: The summary and the report.
+        """
+        stacks: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), stacks, stop),
+            name="profiler",
+            daemon=True,
+        )
+        started_at = time.monotonic()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+        return self._report(stacks, time.monotonic() - started_at)
+
+    def _label(self, frame: FrameType) -> Tuple[str, str]:
+        """
+        Get the module and the name of the function of a frame.
+        """
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            module = frame.f_globals.get("__name__") or code.co_filename
+            label = self._labels[code] = (module, f"{module}.{code.co_name}:{code.co_firstlineno}")
+        return label
+
+    def _sample(self, thread_id: int, stacks: Counter, stop: threading.Event) -> None:
+        """
+        Take samples of the stack of a thread until stopped.
+        """
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack: List[Tuple[str, str]] = []
+            while frame is not None:
+                stack.append(self._label(frame))
+                frame = frame.f_back
+            # Innermost frame first
+            stacks[tuple(stack)] += 1
+
+    @staticmethod
+    def _idle(stack: Tuple[Tuple[str, str], ...]) -> bool:
+        """
+        Check whether a sample was taken while the event loop waited for events.
+        """
+        if not stack:
+            return True
+        module, name = stack[0]
+        # The selector of the default loop, or the C code of uvloop below its Python caller
+        return module == "selectors" or (module.startswith("asyncio.") and ".run" in name)
+
+    def _report(self, stacks: Counter, elapsed: float) -> Tuple[str, str]:
+        """
+        Build the summary and the report from the samples.
+        """
+        total = sum(stacks.values())
+        busy = {stack: count for stack, count in stacks.items() if not self._idle(stack)}
+        busy_total = sum(busy.values())
+        per_sample = elapsed / total if total else 0
+
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        components: Counter = Counter()
+        for stack, count in busy.items():
+            own[stack[0][1]] += count
+            for module, name in set(stack):
+                cumulative[name] += count
+                if module.startswith(COMPONENT_MODULES):
+                    components[name] += count
+
+        def table(title: str, counter: Counter, limit: int) -> List[str]:
+            lines = [title, f"{'seconds':>9} {'busy %':>7}  function"]
+            for name, count in counter.most_common(limit):
+                lines.append(f"{count * per_sample:9.3f} {count / busy_total * 100 if busy_total else 0:6.1f}%  {name}")
+            return lines + [""]
+
+        summary = (
+            f"{elapsed:.1f}s, {total} samples, the loop was busy {busy_total / total * 100 if total else 0:.1f}% "
+            f"of the time ({busy_total * per_sample:.2f}s)"
+        )
+        lines = [
+            f"Profile of the event loop thread: {summary}",
+            f"Sampling interval: {self.interval * 1000:.0f} ms, each sample counts as {per_sample * 1000:.1f} ms",
+            "",
+            *table("Handlers and middlewares (cumulative)", components, 50),
+            *table("Top functions (own time)", own, 40),
+            *table("Top functions (cumulative)", cumulative, 40),
+        ]
+        return summary, "\n".join(lines)
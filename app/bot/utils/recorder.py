@@ -0,0 +1,206 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Iterator, Tuple
+
+# Keys whose string values carry personal data and are masked before recording
+SENSITIVE_KEYS = {
+    "first_name",
+    "last_name",
+    "username",
+    "phone_number",
+    "email",
+    "bio",
+    "vcard",
+    "address",
+    "text",
+    "caption",
+    "query",
+}
+# Keys whose numeric values carry personal data and are zeroed before recording
+SENSITIVE_NUMBERS = {
+    "latitude",
+    "longitude",
+}
+
+
+def mask(text: str) -> str:
+    """
+    Replace a string with a placeholder of the same length.
+
+    A leading bot command (e.g. "/start") is kept, so replayed updates are routed to the same handlers.
+
+    :param text: The string to mask.
+    :return: The masked string.
+    """
+    command, separator, rest = text.partition(" ") if text.startswith("/") else ("", "", text)
+    return command + separator + "x" * len(rest)
+
+
+def sanitize(value: Any) -> Any:
+    """
+    Recursively masks personal data in a raw update.
+
+    Identifiers, dates, file IDs and callback data are kept as is, since the replay depends on them.
+
+    :param value: The raw update or a part of it.
+    :return: The sanitized copy.
+    """
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in SENSITIVE_KEYS and isinstance(item, str):
+                result[key] = mask(item)
+            elif key in SENSITIVE_NUMBERS and isinstance(item, (int, float)):
+                result[key] = 0.0
+            else:
+                result[key] = sanitize(item)
+        return result
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    return value
+
+
+class UpdateRecorder:
+    """
+    Writes sanitized raw updates to gzip-compressed JSON lines files.
+
+    Sanitizing, encoding and compression happen in a background thread, so recording never blocks the event loop.
+    Files are rotated after ROTATE_SIZE updates or ROTATE_INTERVAL seconds, whichever comes first.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            rotate_size: int = 100_000,
+            rotate_interval: int = 3600,
+            backup_count: int = 48,
+    ) -> None:
+        """
+        Initialize the UpdateRecorder.
+
+        :param path: The directory where the recordings are written.
+        :param rotate_size: The number of updates after which the file is rotated.
+        :param rotate_interval: The number of seconds after which the file is rotated.
+        :param backup_count: The number of recording files to keep.
+        """
+        self.path = path
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._file: gzip.GzipFile | None = None
+        self._file_count = 0
+        self._file_opened_at = 0.0
+
+    def start(self) -> None:
+        """
+        Start the background writer thread.
+        """
+        if self._thread is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="update-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Flush the pending updates and stop the background writer thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def record(self, update: dict) -> None:
+        """
+        Queue a raw update for recording.
+
+        :param update: The raw update as a JSON-compatible dictionary.
+        """
+        self._queue.put((time.time(), update))
+
+    def _open(self) -> None:
+        """
+        Open a new recording file and remove the oldest ones beyond backup_count.
+        """
+        filename = f"updates_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.path, filename), "wt", encoding="utf-8")
+        self._file_count = 0
+        self._file_opened_at = time.monotonic()
+
+        files = sorted(glob.glob(os.path.join(self.path, "updates_*.jsonl.gz")))
+        for filename in files[:max(len(files) - self.backup_count, 0)]:
+            os.remove(filename)
+
+    def _close(self) -> None:
+        """
+        Close the current recording file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self) -> None:
+        """
+        Background thread loop writing queued updates to disk.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            if self._file is None or (
+                    self._file_count >= self.rotate_size or
+                    time.monotonic() - self._file_opened_at >= self.rotate_interval
+            ):
+                self._close()
+                self._open()
+
+            timestamp, update = item
+            try:
+                line = json.dumps({"t": timestamp, "update": sanitize(update)}, ensure_ascii=False)
+                self._file.write(line + "\n")
+                self._file_count += 1
+            except Exception as ex:
+                logging.warning(f"Failed to record update: {ex}")
+
+        self._close()
+
+
+def read_records(*paths: str) -> Iterator[Tuple[float, dict]]:
+    """
+    Read recorded updates in the order they were received.
+
+    Directories are expanded to the recording files they contain. A file cut off by a crash is read up to the
+    last complete line.
+
+    :param paths: Recording files or directories.
+    :return: An iterator of (timestamp, raw update) tuples.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "updates_*.jsonl.gz"))))
+        else:
+            files.append(path)
+
+    for filename in files:
+        with gzip.open(filename, "rt", encoding="utf-8") as file:
+            try:
+                for line in file:
+                    if not line.endswith("\n"):
+                        break
+                    record = json.loads(line)
+                    yield record["t"], record["update"]
+            except EOFError:
+                logging.warning(f"Recording {filename} is truncated, the rest is skipped.")
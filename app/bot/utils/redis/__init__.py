@@ -1,5 +1,20 @@
+from .connection import create_redis
+from .fsm import FallbackStorage, TenantKeyBuilder
+from .health import RedisHealth
+from .messages import MessageStorage
 from .redis import RedisStorage
+from .segments import Segment, SegmentIndex
+from .stats import Stats, StatsStorage
 
 __all__ = [
+    "FallbackStorage",
+    "MessageStorage",
+    "RedisHealth",
     "RedisStorage",
+    "Segment",
+    "SegmentIndex",
+    "Stats",
+    "StatsStorage",
+    "TenantKeyBuilder",
+    "create_redis",
 ]
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+if TYPE_CHECKING:
+    from .health import RedisHealth
+
+
+class GuardedStorage:
+    """
+    Base class for the storages whose operations are served locally while Redis is unavailable.
+    """
+
+    NAME: str
+
+    def __init__(self, redis: Redis, health: RedisHealth | None = None, name: str | None = None) -> None:
+        """
+        Initializes the storage.
+
+        :param redis: The Redis instance to be used for data storage.
+        :param health: The RedisHealth instance or None to always use Redis.
+        :param name: The prefix of the keys, NAME by default (see BotConfig.key for the other bots).
+        """
+        self.redis = redis
+        self.health = health
+        if name is not None:
+            self.NAME = name
+
+    async def _guarded(self, operation: str, call: Callable[[], Awaitable[Any]], fallback: Callable[[], Any]) -> Any:
+        """
+        Call Redis, or serve the operation locally while Redis is unavailable.
+
+        :param operation: The name of the operation, used in the metrics.
+        :param call: The function making the Redis call.
+        :param fallback: The function serving the operation locally.
+        :return: The result of the call or of the fallback.
+        """
+        if self.health is None:
+            return await call()
+        if not self.health.allow():
+            return fallback()
+
+        try:
+            result = await call()
+        except RedisError:
+            self.health.record_failure(operation)
+            return fallback()
+
+        self.health.record_success()
+        return result
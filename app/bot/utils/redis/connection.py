@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import contextlib
+from typing import Any, AsyncContextManager, Dict, List, Tuple
+
+import redis
+from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.cluster import ClusterNode, RedisCluster
+from redis.asyncio.sentinel import Sentinel
+from redis.exceptions import RedisClusterException
+
+from app.config import RedisConfig
+
+
+class ClusterTransaction(Pipeline):
+    """
+    Transaction (MULTI/EXEC) of a Redis Cluster, sent to the node holding the slot of its keys.
+
+    redis-py does not run transactions on a cluster, but a transaction whose keys share a hash tag is valid on the
+    node holding their slot. The node is only known when the commands are queued, so it is picked on execute.
+    """
+
+    def __init__(self, cluster: Cluster) -> None:
+        """
+        Initializes the ClusterTransaction instance.
+
+        :param cluster: The Cluster instance.
+        """
+        super().__init__(None, cluster.response_callbacks, True, None)
+        self.cluster = cluster
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        """
+        Execute the queued commands in a transaction on the node of their slot.
+
+        :param raise_on_error: Whether the first error of a command is raised.
+        :return: The results of the commands.
+        :raise RedisClusterException: If the keys are on different slots.
+        """
+        if self.command_stack and self.connection is None:
+            # The key is the first argument of all the commands the bot runs in a transaction
+            keys = [args[1] for args, _ in self.command_stack]
+            if len({self.cluster.keyslot(key) for key in keys}) > 1:
+                raise RedisClusterException(f"The keys of a transaction are on different slots: {keys}")
+            await self.cluster.initialize()
+            self.connection_pool = self.cluster.get_node_pool(self.cluster.get_node_from_key(keys[0]))
+        return await super().execute(raise_on_error)
+
+
+class Cluster(RedisCluster):
+    """
+    RedisCluster usable where the bot expects a Redis instance.
+
+    Transactions are run on the node of their slot (see ClusterTransaction), client() returns the cluster itself
+    and aclose() accepts the arguments of Redis.aclose(), which the aiogram storage passes.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._node_pools: Dict[str, ConnectionPool] = {}
+
+    def get_node_pool(self, node: ClusterNode) -> ConnectionPool:
+        """
+        Get the connection pool of the transactions sent to a node.
+
+        :param node: The node.
+        :return: The connection pool.
+        """
+        if node.name not in self._node_pools:
+            self._node_pools[node.name] = ConnectionPool(
+                connection_class=node.connection_class,
+                **node.connection_kwargs,
+            )
+        return self._node_pools[node.name]
+
+    def pipeline(self, transaction: bool | None = None, shard_hint: Any = None) -> Any:
+        if transaction:
+            return ClusterTransaction(self)
+        return super().pipeline(shard_hint=shard_hint)
+
+    def client(self) -> AsyncContextManager[Cluster]:
+        # Connections are picked per node, so there is no single connection to hold
+        return contextlib.nullcontext(self)
+
+    async def aclose(self, close_connection_pool: bool | None = None) -> None:
+        for pool in self._node_pools.values():
+            await pool.disconnect()
+        self._node_pools.clear()
+        await super().aclose()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    Parse a "host:port" address.
+
+    :param address: The address.
+    :return: The host and the port.
+    """
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def create_redis(config: RedisConfig) -> Redis:
+    """
+    Create the Redis client of the configured mode.
+
+    - standalone: a single node at HOST:PORT.
+    - sentinel: the master monitored by the SENTINELS, the client reconnects to the new master after a failover.
+    - cluster: a Redis Cluster discovered from the HOST:PORT seed node, see Cluster.
+
+    :param config: The Redis configuration.
+    :return: The Redis instance (a Cluster in the cluster mode).
+    :raise ValueError: If the mode is not known.
+    """
+    # Fail fast instead of blocking the updates while Redis is slow or unreachable
+    timeouts = {"socket_timeout": config.TIMEOUT, "socket_connect_timeout": config.TIMEOUT}
+
+    if config.MODE == "standalone":
+        return Redis(host=config.HOST, port=config.PORT, db=config.DB, **timeouts)
+    if config.MODE == "sentinel":
+        sentinels = [parse_address(address) for address in config.SENTINELS]
+        return Sentinel(sentinels, **timeouts).master_for(config.SENTINEL_MASTER, db=config.DB, **timeouts)
+    if config.MODE == "cluster":
+        return Cluster(host=config.HOST, port=config.PORT, **timeouts)
+    raise ValueError(f"Unknown Redis mode {config.MODE!r}")
+
+
+def create_sync_redis(config: RedisConfig, key: str) -> redis.Redis:
+    """
+    Create a synchronous Redis client of the configured mode, for the libraries which use one (apscheduler).
+
+    In the cluster mode the client connects to the node holding the slot of the key, the keys of the library must
+    share its hash tag.
+
+    :param config: The Redis configuration.
+    :param key: A key of the library.
+    :return: The Redis instance.
+    :raise ValueError: If the mode is not known.
+    """
+    from redis.cluster import RedisCluster as SyncRedisCluster
+    from redis.sentinel import Sentinel as SyncSentinel
+
+    timeouts = {"socket_timeout": config.TIMEOUT, "socket_connect_timeout": config.TIMEOUT}
+
+    if config.MODE == "standalone":
+        return redis.Redis(host=config.HOST, port=config.PORT, db=config.DB, **timeouts)
+    if config.MODE == "sentinel":
+        sentinels = [parse_address(address) for address in config.SENTINELS]
+        return SyncSentinel(sentinels, **timeouts).master_for(config.SENTINEL_MASTER, db=config.DB, **timeouts)
+    if config.MODE == "cluster":
+        return SyncRedisCluster(host=config.HOST, port=config.PORT, **timeouts).get_node_from_key(key).redis_connection
+    raise ValueError(f"Unknown Redis mode {config.MODE!r}")
@@ -0,0 +1,138 @@
+import copy
+from typing import Any, Dict, Literal, MutableMapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from cachetools import LRUCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.config import BotConfig
+from .health import RedisHealth
+
+# Returned by _call when the operation has to be served locally
+FAILED = object()
+
+
+class TenantKeyBuilder(DefaultKeyBuilder):
+    """
+    Key builder prefixing the FSM keys of the other bots of the multi-bot mode with their namespace.
+
+    The default keys do not include the bot, so a user talking to several bots would share the state. The main bot
+    keeps its keys.
+    """
+
+    def __init__(self, bots: Dict[int, BotConfig]) -> None:
+        """
+        Initializes the TenantKeyBuilder instance.
+
+        :param bots: The configs of the bots by their ID.
+        """
+        super().__init__()
+        self.bots = bots
+
+    def build(self, key: StorageKey, part: Optional[Literal["data", "state", "lock"]] = None) -> str:
+        built = super().build(key, part)
+        bot_config = self.bots.get(key.bot_id)
+        return built if bot_config is None else bot_config.key(built)
+
+
+class FallbackStorage(BaseStorage):
+    """
+    FSM storage that keeps working while Redis is unavailable.
+
+    The states and data read from Redis are cached locally. During an outage they are read from the cache, and
+    writes are kept as pending until they are flushed back to Redis on recovery. Pending keys are served locally
+    until then, so a stale value in Redis never wins over a newer local one.
+    """
+
+    def __init__(self, storage: RedisStorage, health: RedisHealth, cache_size: int) -> None:
+        """
+        Initializes the FallbackStorage instance.
+
+        :param storage: The Redis FSM storage.
+        :param health: The RedisHealth instance.
+        :param cache_size: The number of keys kept in the local cache.
+        """
+        self.storage = storage
+        self.health = health
+
+        self.states: MutableMapping[StorageKey, Optional[str]] = LRUCache(maxsize=cache_size)
+        self.data: MutableMapping[StorageKey, Dict[str, Any]] = LRUCache(maxsize=cache_size)
+        self.pending_states: Dict[StorageKey, Optional[str]] = {}
+        self.pending_data: Dict[StorageKey, Dict[str, Any]] = {}
+
+        health.on_recovery(self.flush)
+
+    @property
+    def redis(self) -> Redis:
+        """
+        The Redis instance of the underlying storage.
+        """
+        return self.storage.redis
+
+    async def _call(self, operation: str, key: StorageKey, *args: Any) -> Any:
+        """
+        Call the Redis storage if it is available.
+
+        :param operation: The name of the storage method.
+        :param key: The storage key.
+        :param args: The arguments of the method.
+        :return: The result of the method or FAILED if it has to be served locally.
+        """
+        if not self.health.allow():
+            return FAILED
+        try:
+            result = await getattr(self.storage, operation)(key, *args)
+        except RedisError:
+            self.health.record_failure(f"fsm_{operation}")
+            return FAILED
+        self.health.record_success()
+        return result
+
+    async def flush(self) -> None:
+        """
+        Write the keys changed during an outage back to Redis.
+        """
+        # A key written again meanwhile stays pending and is flushed on the next recovery check
+        for key, state in list(self.pending_states.items()):
+            await self.storage.set_state(key, state)
+            if self.pending_states.get(key, FAILED) == state:
+                del self.pending_states[key]
+        for key, data in list(self.pending_data.items()):
+            await self.storage.set_data(key, data)
+            if self.pending_data.get(key) is data:
+                del self.pending_data[key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        self.states[key] = state
+        if key in self.pending_states or await self._call("set_state", key, state) is FAILED:
+            self.pending_states[key] = state
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        if key in self.pending_states:
+            return self.pending_states[key]
+        state = await self._call("get_state", key)
+        if state is FAILED:
+            return self.states.get(key)
+        self.states[key] = state
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self.data[key] = copy.deepcopy(data)
+        if key in self.pending_data or await self._call("set_data", key, data) is FAILED:
+            self.pending_data[key] = copy.deepcopy(data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        if key in self.pending_data:
+            return copy.deepcopy(self.pending_data[key])
+        data = await self._call("get_data", key)
+        if data is FAILED:
+            return copy.deepcopy(self.data.get(key, {}))
+        self.data[key] = copy.deepcopy(data)
+        return data
+
+    async def close(self) -> None:
+        await self.storage.close()
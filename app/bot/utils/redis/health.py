@@ -0,0 +1,292 @@
+import asyncio
+import dataclasses
+import logging
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from typing import Awaitable, Callable, List, MutableMapping, Tuple
+
+from cachetools import LRUCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.bot.utils.circuit_breaker import CircuitBreaker, CLOSED
+from app.config import RedisConfig
+from app.metrics import registry
+from app.serialization import json_loads
+from .models import UserData
+from .redis import RedisStorage
+
+REDIS_PING = registry.gauge("redis_ping_seconds", "Latency of the last Redis health check.")
+REDIS_FALLBACKS = registry.counter("redis_fallbacks_total", "Storage operations served locally, by operation.")
+JOURNAL_SIZE = registry.gauge("redis_journal_size", "User writes waiting in the local journal.")
+JOURNAL_DROPPED = registry.counter("redis_journal_dropped_total", "User writes dropped from the full local journal.")
+CACHE_LOOKUPS = registry.counter("redis_cache_lookups_total", "Local cache lookups, by cache and result.")
+WARMUP_SECONDS = registry.gauge("redis_warmup_seconds", "Duration of the cache warm-up.")
+WARMUP_ENTRIES = registry.gauge("redis_warmup_entries", "Entries loaded by the cache warm-up, by cache.")
+
+
+class RedisHealth:
+    """
+    Monitors Redis and keeps the bot working while it is unavailable.
+
+    Storage operations report their outcome to a circuit breaker. Once it opens, the bot is in the degraded local
+    mode: users are read from the local cache and user writes go to a bounded local journal (the latest write per
+    user). A background health check closes the breaker when Redis answers again, then the journal is replayed and
+    the recovery callbacks (e.g. the FSM storage flush) are run.
+
+    In the multi-bot mode one instance serves all the bots, their users are cached and journaled under the name of
+    their users hash.
+    """
+
+    def __init__(self, redis: Redis, config: RedisConfig) -> None:
+        """
+        Initializes the RedisHealth instance.
+
+        :param redis: The Redis instance.
+        :param config: The Redis configuration.
+        """
+        self.redis = redis
+        self.interval = config.HEALTH_INTERVAL
+        self.breaker = CircuitBreaker("redis", config.BREAKER_THRESHOLD, config.BREAKER_RECOVERY)
+
+        self.users: MutableMapping[Tuple[str, int], UserData] = LRUCache(maxsize=config.CACHE_SIZE)
+        self.threads: MutableMapping[Tuple[str, int | None, int], int] = LRUCache(maxsize=config.CACHE_SIZE)
+        self.journal: OrderedDict[Tuple[str, int], UserData] = OrderedDict()
+        self.journal_size = config.JOURNAL_SIZE
+        self.warm_up_users = config.WARMUP_USERS if config.WARMUP else 0
+        # The users hashes warmed up, one per bot
+        self.names: List[str] = [RedisStorage.NAME]
+
+        self._callbacks: List[Callable[[], Awaitable[None]]] = []
+        self._task: asyncio.Task | None = None
+        self._warm_up_task: asyncio.Task | None = None
+
+    @property
+    def degraded(self) -> bool:
+        """
+        Whether the bot is in the degraded local mode.
+        """
+        return self.breaker.state != CLOSED
+
+    def allow(self) -> bool:
+        """
+        Check whether Redis should be called.
+
+        :return: True if Redis should be called, False if the operation should be served locally.
+        """
+        return self.breaker.allow()
+
+    def record_success(self) -> None:
+        """
+        Record a successful Redis call.
+        """
+        self.breaker.record_success()
+
+    def record_failure(self, operation: str) -> None:
+        """
+        Record a failed Redis call, the operation is served locally.
+
+        :param operation: The name of the operation.
+        """
+        self.breaker.record_failure()
+        REDIS_FALLBACKS.inc(operation=operation)
+
+    def on_recovery(self, callback: Callable[[], Awaitable[None]]) -> None:
+        """
+        Register a callback run when Redis is available again.
+
+        :param callback: The async callback.
+        """
+        self._callbacks.append(callback)
+
+    def remember(self, user: UserData, name: str = RedisStorage.NAME) -> None:
+        """
+        Put a user into the local cache.
+
+        :param user: The user data.
+        :param name: The name of the users hash.
+        """
+        self.users[name, user.id] = dataclasses.replace(user)
+        if user.message_thread_id is not None:
+            self.threads[name, user.group_id, user.message_thread_id] = user.id
+
+    def get_user(self, id_: int, name: str = RedisStorage.NAME) -> UserData | None:
+        """
+        Get a user from the local cache.
+
+        :param id_: The ID of the user.
+        :param name: The name of the users hash.
+        :return: A copy of the cached user data or None if not cached.
+        """
+        user = self.users.get((name, id_))
+        return None if user is None else dataclasses.replace(user)
+
+    def get_thread_user(
+            self,
+            message_thread_id: int,
+            group_id: int | None = None,
+            name: str = RedisStorage.NAME,
+    ) -> int | None:
+        """
+        Get the ID of the user a topic belongs to from the local cache.
+
+        :param message_thread_id: The ID of the message thread.
+        :param group_id: The key of the group of the thread.
+        :param name: The name of the users hash.
+        :return: The ID of the user or None if not cached.
+        """
+        user_id = self.threads.get((name, group_id, message_thread_id))
+        CACHE_LOOKUPS.inc(cache="threads", result="miss" if user_id is None else "hit")
+        return user_id
+
+    async def warm_up(self, batch: int = 1_000) -> None:
+        """
+        Load the most recently active users and the topic to user mapping into the local cache.
+
+        The hot users are read with pipelined HMGET, then the users hash is streamed with HSCAN until the topic
+        cache is full. Entries cached meanwhile by the handled updates are newer and are kept.
+
+        :param batch: The number of users read per command.
+        """
+        started_at = time.monotonic()
+        users = threads = 0
+        for name in self.names:
+            hot_ids = await self.redis.zrevrange(f"{name}_activity", 0, self.warm_up_users - 1)
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for i in range(0, len(hot_ids), batch):
+                    pipe.hmget(name, hot_ids[i:i + batch])
+                results = await pipe.execute()
+            for values in results:
+                for raw in values:
+                    if raw is None:
+                        continue
+                    user = UserData(**json_loads(raw))
+                    if (name, user.id) not in self.users:
+                        self.remember(user, name)
+                        users += 1
+
+        for name in self.names:
+            async for id_, raw in self.redis.hscan_iter(name, count=batch):
+                if len(self.threads) >= self.threads.maxsize:
+                    break
+                data = json_loads(raw)
+                thread = name, data.get("group_id"), data.get("message_thread_id")
+                if thread[2] is not None and thread not in self.threads:
+                    self.threads[thread] = int(id_)
+                    threads += 1
+
+        elapsed = time.monotonic() - started_at
+        WARMUP_SECONDS.set(elapsed)
+        WARMUP_ENTRIES.set(users, cache="users")
+        WARMUP_ENTRIES.set(threads, cache="threads")
+        logging.info(f"Cache warmed up with {users} users and {threads} topics in {elapsed:.2f}s")
+
+    async def _run_warm_up(self) -> None:
+        """
+        Run the warm-up, a failure only leaves the cache cold.
+        """
+        try:
+            await self.warm_up()
+        except Exception as ex:
+            logging.warning(f"Cache warm-up failed: {ex!r}")
+
+    def write_journal(self, user: UserData, name: str = RedisStorage.NAME) -> None:
+        """
+        Keep a user write in the local journal until Redis is available again.
+
+        :param user: The user data.
+        :param name: The name of the users hash.
+        """
+        self.remember(user, name)
+        self.journal.pop((name, user.id), None)
+        self.journal[name, user.id] = dataclasses.replace(user)
+        while len(self.journal) > self.journal_size:
+            self.journal.popitem(last=False)
+            JOURNAL_DROPPED.inc()
+        JOURNAL_SIZE.set(len(self.journal))
+
+    def forget_journal(self, id_: int, name: str = RedisStorage.NAME) -> None:
+        """
+        Drop the journaled write of a user that was written to Redis directly.
+
+        :param id_: The ID of the user.
+        :param name: The name of the users hash.
+        """
+        if self.journal.pop((name, id_), None) is not None:
+            JOURNAL_SIZE.set(len(self.journal))
+
+    async def replay(self) -> None:
+        """
+        Write the journaled users to Redis, oldest first.
+        """
+        while self.journal:
+            (name, id_), user = next(iter(self.journal.items()))
+            await RedisStorage(self.redis, name=name).update_user(id_, user)
+            # A newer write may have replaced the entry meanwhile, it is replayed on the next iteration
+            if self.journal.get((name, id_)) is user:
+                del self.journal[name, id_]
+            JOURNAL_SIZE.set(len(self.journal))
+        logging.info("Redis journal replayed")
+
+    async def check(self) -> None:
+        """
+        Ping Redis and recover from the degraded local mode if it answers.
+        """
+        started_at = time.monotonic()
+        try:
+            await self.redis.ping()
+        except RedisError as ex:
+            if not self.degraded:
+                logging.warning(f"Redis health check failed: {ex!r}")
+            self.breaker.record_failure()
+            return
+
+        REDIS_PING.set(time.monotonic() - started_at)
+        if self.breaker.state != CLOSED:
+            # The ping only closes the breaker, the failures counted by the operations are not reset by it
+            self.breaker.record_success()
+
+        if self.journal:
+            await self.replay()
+        for callback in self._callbacks:
+            await callback()
+
+    async def _run(self) -> None:
+        """
+        Run the health check periodically.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as ex:
+                logging.warning(f"Redis recovery failed: {ex!r}")
+
+    def start(self) -> None:
+        """
+        Start the periodic health check and the cache warm-up if it is enabled.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        # Warm up in the background, so polling is not delayed
+        if self.warm_up_users and self._warm_up_task is None:
+            self._warm_up_task = asyncio.create_task(self._run_warm_up())
+
+    async def stop(self) -> None:
+        """
+        Stop the periodic health check, trying to write the journal one last time.
+        """
+        for task in (self._task, self._warm_up_task):
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        self._task = self._warm_up_task = None
+
+        if self.journal:
+            try:
+                await self.replay()
+            except RedisError as ex:
+                logging.error(f"Lost {len(self.journal)} journaled user writes: {ex!r}")
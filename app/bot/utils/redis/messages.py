@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable, Tuple
+
+from redis.asyncio import Redis
+
+from .base import GuardedStorage
+
+if TYPE_CHECKING:
+    from .health import RedisHealth
+
+# Message IDs per hash, kept below hash-max-listpack-entries so the hashes stay listpack-encoded
+BUCKET_SIZE = 128
+
+
+class MessageStorage(GuardedStorage):
+    """
+    Class for managing the mapping between the messages in the user chats and in the group topics.
+
+    Message IDs grow sequentially in a chat, so the mappings are grouped into small hashes of BUCKET_SIZE IDs instead
+    of a key per message, which keeps them compact. Each hash expires TTL seconds after its last write. While Redis
+    is unavailable nothing is mapped, the messages are relayed without replies and edits.
+
+    Message IDs are only unique within a group, so the group messages are mapped per group key (None for the first
+    group, see app.bot.utils.groups.get_group_key).
+    """
+
+    NAME = "messages"
+
+    def __init__(
+            self,
+            redis: Redis,
+            health: RedisHealth | None = None,
+            ttl: int = 7 * 24 * 60 * 60,
+            name: str | None = None,
+    ) -> None:
+        """
+        Initializes the MessageStorage instance.
+
+        :param redis: The Redis instance to be used for data storage.
+        :param health: The RedisHealth instance or None to always use Redis.
+        :param ttl: The number of seconds the mappings are kept.
+        :param name: The prefix of the keys, NAME by default.
+        """
+        super().__init__(redis, health, name)
+        self.ttl = ttl
+
+    def _user_bucket(self, chat_id: int, message_id: int) -> Tuple[str, int]:
+        """
+        Get the hash key and field of a message in a user chat.
+        """
+        return f"{self.NAME}_user_{chat_id}_{message_id // BUCKET_SIZE}", message_id % BUCKET_SIZE
+
+    def _group_bucket(self, message_id: int, group_id: int | None) -> Tuple[str, int]:
+        """
+        Get the hash key and field of a message in a group.
+        """
+        if group_id is None:
+            return f"{self.NAME}_group_{message_id // BUCKET_SIZE}", message_id % BUCKET_SIZE
+        return f"{self.NAME}_group_{group_id}_{message_id // BUCKET_SIZE}", message_id % BUCKET_SIZE
+
+    async def add(self, chat_id: int, pairs: Iterable[Tuple[int, int]], group_id: int | None = None) -> None:
+        """
+        Map messages in a user chat to messages in the group, in both directions.
+
+        :param chat_id: The ID of the user chat.
+        :param pairs: Pairs of the message ID in the user chat and the message ID in the group.
+        :param group_id: The key of the group.
+        """
+        async def write() -> None:
+            # Both directions of all the pairs are written in a single round trip
+            async with self.redis.pipeline(transaction=False) as pipe:
+                keys = set()
+                for user_message_id, group_message_id in pairs:
+                    user_key, user_field = self._user_bucket(chat_id, user_message_id)
+                    group_key, group_field = self._group_bucket(group_message_id, group_id)
+                    # The group is kept with the message ID, the user may get a topic in another group later
+                    value = group_message_id if group_id is None else f"{group_id}:{group_message_id}"
+                    pipe.hset(user_key, user_field, value)
+                    pipe.hset(group_key, group_field, f"{chat_id}:{user_message_id}")
+                    keys.update((user_key, group_key))
+                for key in keys:
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+
+        await self._guarded("messages_add", write, lambda: None)
+
+    async def get_group_message(self, chat_id: int, message_id: int) -> Tuple[int | None, int] | None:
+        """
+        Get the group message mapped to a message in a user chat.
+
+        :param chat_id: The ID of the user chat.
+        :param message_id: The ID of the message in the user chat.
+        :return: The key of the group and the ID of the message in it, or None if not mapped.
+        """
+        async def read() -> Tuple[int | None, int] | None:
+            value = await self.redis.hget(*self._user_bucket(chat_id, message_id))
+            if value is None:
+                return None
+            group_id, _, group_message_id = value.decode().rpartition(":")
+            return int(group_id) if group_id else None, int(group_message_id)
+
+        return await self._guarded("messages_get", read, lambda: None)
+
+    async def get_user_message(self, message_id: int, group_id: int | None = None) -> Tuple[int, int] | None:
+        """
+        Get the user chat message mapped to a message in a group.
+
+        :param message_id: The ID of the message in the group.
+        :param group_id: The key of the group.
+        :return: The ID of the user chat and the ID of the message in it, or None if not mapped.
+        """
+        async def read() -> Tuple[int, int] | None:
+            value = await self.redis.hget(*self._group_bucket(message_id, group_id))
+            if value is None:
+                return None
+            chat_id, user_message_id = map(int, value.decode().split(":"))
+            return chat_id, user_message_id
+
+        return await self._guarded("messages_get", read, lambda: None)
@@ -1,3 +1,4 @@
+import time
 from dataclasses import dataclass, asdict
 from datetime import datetime, timezone, timedelta
 
@@ -16,6 +17,17 @@ class UserData:
     is_banned: bool = False
     language_code: str | None = None
     created_at: str = datetime.now(timezone(timedelta(hours=3))).strftime("%Y-%m-%d %H:%M:%S %Z")
+    undeliverable: str | None = None
+    undeliverable_until: float | None = None
+    group_id: int | None = None
+
+    def is_undeliverable(self) -> bool:
+        """
+        Checks whether messages to the user are skipped after a delivery failure (blocked, deactivated, etc.).
+
+        :return: True until the failure expires.
+        """
+        return self.undeliverable is not None and (self.undeliverable_until or 0) > time.time()
 
     def to_dict(self) -> dict:
         """
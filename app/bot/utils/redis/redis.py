@@ -1,22 +1,27 @@
-import json
+from __future__ import annotations
 
-from redis.asyncio import Redis
+import time
 
+from app.serialization import json_dumps, json_loads
+from .base import GuardedStorage
 from .models import UserData
+from .segments import activity_index, index_user, undeliverable_index, undeliverable_reasons
 
 
-class RedisStorage:
-    """Class for managing user data storage using Redis."""
+class RedisStorage(GuardedStorage):
+    """
+    Class for managing user data storage using Redis.
 
-    NAME = "users"
+    With a RedisHealth instance, users are also cached locally, and while Redis is unavailable they are read from
+    the cache and written to the local journal instead.
 
-    def __init__(self, redis: Redis) -> None:
-        """
-        Initializes the RedisStorage instance.
+    The undeliverable mark of a user is kept apart from the user data, in the sorted set of the undeliverable users
+    and the hash of their reasons, and is only written by mark_undeliverable and clear_undeliverable. So a user
+    written from a stale read neither loses a fresh mark nor brings back a cleared one, and the mark does not
+    overwrite the other fields.
+    """
 
-        :param redis: The Redis instance to be used for data storage.
-        """
-        self.redis = redis
+    NAME = "users"
 
     async def _get(self, name: str, key: str | int) -> bytes | None:
         """
@@ -29,45 +34,43 @@ class RedisStorage:
         async with self.redis.client() as client:
             return await client.hget(name, key)
 
-    async def _set(self, name: str, key: str | int, value: any) -> None:
+    def _thread_index(self, group_id: int | None, message_thread_id: int | None) -> str:
         """
-        Sets data in Redis.
-
-        :param name: The name of the Redis hash.
-        :param key: The key to be set.
-        :param value: The value to be set.
+        Get the key of the index of the users of a topic.
         """
-        async with self.redis.client() as client:
-            await client.hset(name, key, value)
+        if group_id is None:
+            return f"{self.NAME}_index_{message_thread_id}"
+        return f"{self.NAME}_index_{group_id}_{message_thread_id}"
 
-    async def _update_index(self, message_thread_id: int, user_id: int) -> None:
-        """
-        Updates the user index in Redis.
-
-        :param message_thread_id: The ID of the message thread.
-        :param user_id: The ID of the user to be updated in the index.
-        """
-        index_key = f"{self.NAME}_index_{message_thread_id}"
-        await self._set(index_key, user_id, "1")
-
-    async def get_by_message_thread_id(self, message_thread_id: int) -> UserData | None:
+    async def get_by_message_thread_id(self, message_thread_id: int, group_id: int | None = None) -> UserData | None:
         """
         Retrieves user data based on message thread ID.
 
         :param message_thread_id: The ID of the message thread.
+        :param group_id: The key of the group of the thread, see app.bot.utils.groups.get_group_key.
         :return: The user data or None if not found.
         """
-        user_id = await self._get_user_id_by_message_thread_id(message_thread_id)
+        # A topic always belongs to the same user, so the cached mapping never goes stale
+        user_id = None if self.health is None else self.health.get_thread_user(message_thread_id, group_id, self.NAME)
+        if user_id is None:
+            user_id = await self._guarded(
+                "get_by_message_thread_id",
+                lambda: self._get_user_id_by_message_thread_id(message_thread_id, group_id),
+                lambda: None,
+            )
+            if user_id is not None and self.health is not None:
+                self.health.threads[self.NAME, group_id, message_thread_id] = user_id
         return None if user_id is None else await self.get_user(user_id)
 
-    async def _get_user_id_by_message_thread_id(self, message_thread_id: int) -> int | None:
+    async def _get_user_id_by_message_thread_id(self, message_thread_id: int, group_id: int | None) -> int | None:
         """
         Retrieves user ID based on message thread ID.
 
         :param message_thread_id: The ID of the message thread.
+        :param group_id: The key of the group of the thread.
         :return: The user ID or None if not found.
         """
-        index_key = f"{self.NAME}_index_{message_thread_id}"
+        index_key = self._thread_index(group_id, message_thread_id)
         async with self.redis.client() as client:
             user_ids = await client.hkeys(index_key)
             return int(user_ids[0]) if user_ids else None
@@ -79,11 +82,27 @@ class RedisStorage:
         :param id_: The ID of the user.
         :return: The user data or None if not found.
         """
-        data = await self._get(self.NAME, id_)
-        if data is not None:
-            decoded_data = json.loads(data)
-            return UserData(**decoded_data)
-        return None
+        async def read() -> UserData | None:
+            # The user and the mark in a single round trip
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hget(self.NAME, id_)
+                pipe.zscore(undeliverable_index(self.NAME), id_)
+                pipe.hget(undeliverable_reasons(self.NAME), id_)
+                data, until, reason = await pipe.execute()
+            if data is None:
+                return None
+            user = UserData(**json_loads(data))
+            # Marks written into the user data before the reasons hash existed keep their reason
+            if isinstance(reason, bytes):
+                reason = reason.decode()
+            user.undeliverable = None if until is None else reason or user.undeliverable
+            user.undeliverable_until = until
+            return user
+
+        user = await self._guarded("get_user", read, lambda: self.health.get_user(id_, self.NAME))
+        if user is not None and self.health is not None:
+            self.health.remember(user, self.NAME)
+        return user
 
     async def update_user(self, id_: int, data: UserData) -> None:
         """
@@ -92,9 +111,67 @@ class RedisStorage:
         :param id_: The ID of the user to be updated.
         :param data: The updated user data.
         """
-        json_data = json.dumps(data.to_dict())
-        await self._set(self.NAME, id_, json_data)
-        await self._update_index(data.message_thread_id, id_)
+        async def write() -> bool:
+            json_data = json_dumps(data.to_dict())
+            # Write the user, the topic index, the last activity and the segment indexes in a single round trip
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hset(self.NAME, id_, json_data)
+                pipe.hset(self._thread_index(data.group_id, data.message_thread_id), id_, "1")
+                pipe.zadd(activity_index(self.NAME), {id_: time.time()})
+                index_user(pipe, self.NAME, data)
+                await pipe.execute()
+            return True
+
+        written = await self._guarded("update_user", write, lambda: self.health.write_journal(data, self.NAME))
+        if written and self.health is not None:
+            # The direct write is newer than a journaled one
+            self.health.remember(data, self.NAME)
+            self.health.forget_journal(id_, self.NAME)
+
+    async def mark_undeliverable(self, id_: int, error: str, ttl: int) -> None:
+        """
+        Marks a user who can not receive messages, so the messages to the user are skipped until the mark expires.
+
+        Only the mark is written, so the concurrent writes of the user data are kept.
+
+        :param id_: The ID of the user.
+        :param error: The reason, see app.bot.utils.delivery.
+        :param ttl: The number of seconds the mark is kept.
+        """
+        until = time.time() + ttl
+
+        async def write() -> None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zadd(undeliverable_index(self.NAME), {id_: until})
+                pipe.hset(undeliverable_reasons(self.NAME), id_, error)
+                # Marking users is rare, so the expired marks are dropped along the way
+                pipe.zremrangebyscore(undeliverable_index(self.NAME), "-inf", time.time())
+                await pipe.execute()
+
+        await self._guarded("mark_undeliverable", write, lambda: self._mark_locally(id_, error, until))
+
+    async def clear_undeliverable(self, id_: int) -> None:
+        """
+        Clears the undeliverable mark of a user who can receive messages again.
+
+        :param id_: The ID of the user.
+        """
+        async def write() -> None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zrem(undeliverable_index(self.NAME), id_)
+                pipe.hdel(undeliverable_reasons(self.NAME), id_)
+                await pipe.execute()
+
+        await self._guarded("clear_undeliverable", write, lambda: self._mark_locally(id_, None, None))
+
+    def _mark_locally(self, id_: int, error: str | None, until: float | None) -> None:
+        """
+        Set the undeliverable mark of a cached user while Redis is unavailable, it is not written to Redis.
+        """
+        user_data = self.health.get_user(id_, self.NAME)
+        if user_data is not None:
+            user_data.undeliverable, user_data.undeliverable_until = error, until
+            self.health.remember(user_data, self.NAME)
 
     async def get_all_users_ids(self) -> list[int]:
         """
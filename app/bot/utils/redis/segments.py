@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+from aiogram.enums import ChatMemberStatus
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from app.bot.utils.texts import SUPPORTED_LANGUAGES
+from app.serialization import json_loads
+from .models import UserData
+
+
+def language_index(name: str, language_code: str | None) -> str:
+    """
+    Get the key of the set of users with a language.
+    """
+    return f"{name}_language_{language_code or 'none'}"
+
+
+def state_index(name: str, state: str) -> str:
+    """
+    Get the key of the set of users with a chat member state.
+    """
+    return f"{name}_state_{ChatMemberStatus(state).value}"
+
+
+def banned_index(name: str) -> str:
+    """
+    Get the key of the set of banned users.
+    """
+    return f"{name}_banned"
+
+
+def activity_index(name: str) -> str:
+    """
+    Get the key of the sorted set of users scored by their last activity.
+    """
+    return f"{name}_activity"
+
+
+def undeliverable_index(name: str) -> str:
+    """
+    Get the key of the sorted set of undeliverable users scored by the time it expires.
+    """
+    return f"{name}_undeliverable"
+
+
+def undeliverable_reasons(name: str) -> str:
+    """
+    Get the key of the hash of the reasons the undeliverable users can not receive messages.
+    """
+    return f"{name}_undeliverable_reasons"
+
+
+def index_user(pipe: Pipeline, name: str, data: UserData) -> None:
+    """
+    Queue the updates of the segment indexes of a user.
+
+    The previous values are not known, so the user is removed from the sets of all the other values, which keeps
+    each user in exactly one language and one state set. The undeliverable mark is not written here, see
+    RedisStorage.mark_undeliverable.
+
+    :param pipe: The pipeline the commands are queued on.
+    :param name: The name of the users hash.
+    :param data: The user data.
+    """
+    for language_code in {*SUPPORTED_LANGUAGES, None, data.language_code}:
+        command = pipe.sadd if language_code == data.language_code else pipe.srem
+        command(language_index(name, language_code), data.id)
+    for state in ChatMemberStatus:
+        command = pipe.sadd if state == data.state else pipe.srem
+        command(state_index(name, state), data.id)
+    command = pipe.sadd if data.is_banned else pipe.srem
+    command(banned_index(name), data.id)
+
+
+@dataclass(frozen=True)
+class Segment:
+    """
+    Data class representing the users targeted by a newsletter.
+
+    Attributes:
+    - language_code (str | None): Only the users with the language, None for any language.
+    - state (str | None): Only the users with the chat member state, None for any state.
+    - banned (bool | None): Only the banned (True) or not banned (False) users, None for both.
+    - active_days (int | None): Only the users active in the last number of days, None for any time.
+    """
+    language_code: str | None = None
+    state: str | None = ChatMemberStatus.MEMBER.value
+    banned: bool | None = False
+    active_days: int | None = None
+
+    @classmethod
+    def parse(cls, text: str | None) -> Segment:
+        """
+        Parse a segment from the arguments of a command, e.g. "language=en active=30".
+
+        Omitted filters keep the default (members who are not banned), "any" disables a filter.
+
+        :param text: The arguments or None for the default segment.
+        :return: The segment.
+        :raise ValueError: If an argument is not valid.
+        """
+        values: Dict[str, Any] = {}
+        for argument in (text or "").split():
+            key, _, value = argument.partition("=")
+            value = None if value == "any" else value
+            if key == "language":
+                values["language_code"] = value
+            elif key == "state":
+                values["state"] = None if value is None else ChatMemberStatus(value).value
+            elif key == "banned":
+                values["banned"] = None if value is None else value in ("yes", "true", "1")
+            elif key == "active":
+                values["active_days"] = None if value is None else int(value)
+            else:
+                raise ValueError(f"Unknown segment filter {key!r}")
+        return cls(**values)
+
+    def to_dict(self) -> dict:
+        """
+        Converts Segment object to a dictionary.
+
+        :return: Dictionary representation of Segment.
+        """
+        return dataclasses.asdict(self)
+
+
+class SegmentIndex:
+    """
+    Resolves segments of users from the Redis indexes, without reading the user data.
+
+    Users are indexed in a set per language and per chat member state, in the set of banned users (see index_user)
+    and in the sorted set of the last activity written by RedisStorage.update_user. A segment is streamed a batch at
+    a time: one index (the driver) is scanned from a cursor, and the batch is filtered by the other indexes with
+    SMISMEMBER and ZMSCORE in a single round trip. The cursor can be checkpointed and resumed. Users who can not
+    receive messages (see RedisStorage.mark_undeliverable) are left out of every segment until the mark expires.
+    """
+
+    def __init__(self, redis: Redis, name: str) -> None:
+        """
+        Initializes the SegmentIndex instance.
+
+        :param redis: The Redis instance.
+        :param name: The name of the users hash.
+        """
+        self.redis = redis
+        self.name = name
+
+    def _driver(self, segment: Segment) -> str:
+        """
+        Get the index scanned for a segment, it is the same every time for the cursors to stay valid.
+        """
+        if segment.language_code is not None:
+            return language_index(self.name, segment.language_code)
+        if segment.state is not None:
+            return state_index(self.name, segment.state)
+        if segment.banned:
+            return banned_index(self.name)
+        if segment.active_days is not None:
+            return activity_index(self.name)
+        return self.name
+
+    async def scan(self, segment: Segment, cursor: int, count: int) -> Tuple[int, List[int]]:
+        """
+        Get the next batch of users of a segment.
+
+        :param segment: The segment.
+        :param cursor: The cursor returned for the previous batch, 0 for the first one.
+        :param count: The approximate number of users scanned.
+        :return: The cursor of the next batch (0 after the last one) and the IDs of the users.
+        """
+        driver = self._driver(segment)
+        since = None if segment.active_days is None else time.time() - segment.active_days * 24 * 60 * 60
+        if driver == self.name:
+            cursor, users = await self.redis.hscan(driver, cursor, count=count)
+        elif driver == activity_index(self.name):
+            cursor, scores = await self.redis.zscan(driver, cursor, count=count)
+            # The scores come with the batch, so the activity is filtered right away
+            users = [user_id for user_id, score in scores if score >= since]
+        else:
+            cursor, users = await self.redis.sscan(driver, cursor, count=count)
+        user_ids = [int(user_id) for user_id in users]
+        if not user_ids:
+            return cursor, []
+
+        # Filter the batch by the other indexes in a single round trip, each check gets the reply of its command
+        now = time.time()
+        checks: List[Callable[[Any], bool]] = []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zmscore(undeliverable_index(self.name), user_ids)
+            checks.append(lambda until: until is None or until <= now)
+            if segment.language_code is not None and driver != language_index(self.name, segment.language_code):
+                pipe.smismember(language_index(self.name, segment.language_code), user_ids)
+                checks.append(bool)
+            if segment.state is not None and driver != state_index(self.name, segment.state):
+                pipe.smismember(state_index(self.name, segment.state), user_ids)
+                checks.append(bool)
+            if segment.banned is not None and driver != banned_index(self.name):
+                pipe.smismember(banned_index(self.name), user_ids)
+                checks.append(lambda member: bool(member) == segment.banned)
+            if since is not None and driver != activity_index(self.name):
+                pipe.zmscore(activity_index(self.name), user_ids)
+                checks.append(lambda score: score is not None and score >= since)
+            replies = await pipe.execute()
+
+        return cursor, [
+            user_id for i, user_id in enumerate(user_ids)
+            if all(check(reply[i]) for check, reply in zip(checks, replies))
+        ]
+
+    async def count(self, segment: Segment, batch: int = 1_000) -> int:
+        """
+        Count the users of a segment.
+
+        :param segment: The segment.
+        :param batch: The number of users scanned per round trip.
+        :return: The number of users.
+        """
+        if segment == Segment(state=None, banned=None):
+            # All the users, but the undeliverable ones
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hlen(self.name)
+                pipe.zcount(undeliverable_index(self.name), f"({time.time()}", "+inf")
+                users, undeliverable = await pipe.execute()
+            return users - undeliverable
+
+        total, cursor = 0, 0
+        while True:
+            cursor, user_ids = await self.scan(segment, cursor, batch)
+            total += len(user_ids)
+            if cursor == 0:
+                return total
+
+    async def build(self, batch: int = 1_000) -> None:
+        """
+        Index the users written before the indexes existed, once.
+
+        The users hash is streamed with HSCAN, the users written meanwhile are indexed by RedisStorage.update_user.
+        Only the first replica to start builds the indexes, if it stops midway the marker expires and the next
+        replica to start builds them again.
+
+        :param batch: The number of users indexed per round trip.
+        """
+        marker = f"{self.name}_segments_built"
+        if not await self.redis.set(marker, "building", nx=True, ex=60 * 60):
+            return
+
+        started_at, users = time.monotonic(), 0
+        cursor = 0
+        while True:
+            cursor, values = await self.redis.hscan(self.name, cursor, count=batch)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for raw in values.values():
+                    index_user(pipe, self.name, UserData(**json_loads(raw)))
+                await pipe.execute()
+            users += len(values)
+            if cursor == 0:
+                break
+        await self.redis.set(marker, "done")
+        logging.info(f"Segment indexes built for {users} users in {time.monotonic() - started_at:.2f}s")
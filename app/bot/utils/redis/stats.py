@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from redis.asyncio import Redis
+
+from .base import GuardedStorage
+
+if TYPE_CHECKING:
+    from .health import RedisHealth
+
+# Upper bounds in seconds of the first response time buckets, the last bucket has no bound
+RESPONSE_BUCKETS = (60, 5 * 60, 15 * 60, 60 * 60, 4 * 60 * 60, 24 * 60 * 60)
+
+
+@dataclass
+class Stats:
+    """
+    Data class representing the support statistics of a day.
+
+    Attributes:
+    - day (str): The day, e.g. "2024-05-01".
+    - users (int): The approximate number of users who wrote during the day.
+    - users_week (int): The approximate number of users who wrote during the last 7 days.
+    - incoming (Dict[int, int]): The number of messages from the users per hour.
+    - outgoing (Dict[int, int]): The number of messages to the users per hour.
+    - waiting (int): The number of topics waiting for a reply.
+    - longest_wait (float | None): The number of seconds the oldest topic has been waiting, None if none is.
+    - responses (List[int]): The number of first responses per bucket of RESPONSE_BUCKETS, and above the last one.
+    - response_time (float): The total first response time in seconds.
+    """
+    day: str
+    users: int = 0
+    users_week: int = 0
+    incoming: Dict[int, int] = field(default_factory=dict)
+    outgoing: Dict[int, int] = field(default_factory=dict)
+    waiting: int = 0
+    longest_wait: float | None = None
+    responses: List[int] = field(default_factory=lambda: [0] * (len(RESPONSE_BUCKETS) + 1))
+    response_time: float = 0
+
+    @property
+    def answered(self) -> int:
+        """
+        The number of topics answered for the first time.
+        """
+        return sum(self.responses)
+
+    @property
+    def average_response(self) -> float | None:
+        """
+        The average first response time in seconds, None if no topic was answered.
+        """
+        return self.response_time / self.answered if self.answered else None
+
+    @property
+    def median_response(self) -> float | None:
+        """
+        The upper bound of the bucket of the median first response time, inf above the last bucket, None if no topic
+        was answered.
+        """
+        seen = 0
+        for bound, count in zip((*RESPONSE_BUCKETS, float("inf")), self.responses):
+            seen += count
+            if seen * 2 >= self.answered > 0:
+                return bound
+        return None
+
+
+class StatsStorage(GuardedStorage):
+    """
+    Class for maintaining the support statistics incrementally, so they are read in constant time.
+
+    The relay handlers update a few small structures per day: a HyperLogLog of the users who wrote, a hash of the
+    message counts per hour in each direction and a hash of the first response times in RESPONSE_BUCKETS. The topics
+    waiting for a reply are kept in a sorted set scored by the time of their first unanswered message, the reply of a
+    moderator removes the topic and records the time it waited. The daily keys expire after RETENTION days, the
+    topics left waiting longer (e.g. banned users) are dropped along the way. While Redis is unavailable nothing is
+    counted.
+
+    Days start at midnight in the UTC offset of the configuration.
+    """
+
+    NAME = "stats"
+
+    def __init__(
+            self,
+            redis: Redis,
+            health: RedisHealth | None = None,
+            retention: int = 35,
+            utc_offset: int = 3,
+            name: str | None = None,
+    ) -> None:
+        """
+        Initializes the StatsStorage instance.
+
+        :param redis: The Redis instance to be used for data storage.
+        :param health: The RedisHealth instance or None to always use Redis.
+        :param retention: The number of days the statistics are kept.
+        :param utc_offset: The UTC offset in hours of the days.
+        :param name: The prefix of the keys, NAME by default.
+        """
+        super().__init__(redis, health, name)
+        self.retention = retention
+        self.utc_offset = utc_offset
+
+    def _day(self, timestamp: float) -> Tuple[str, int]:
+        """
+        Get the day and the hour of a time.
+        """
+        local = time.gmtime(timestamp + self.utc_offset * 60 * 60)
+        return time.strftime("%Y-%m-%d", local), local.tm_hour
+
+    async def user_message(self, user_id: int, count: int = 1) -> None:
+        """
+        Count the messages of a user relayed to the topic, the topic waits for a reply.
+
+        :param user_id: The ID of the user.
+        :param count: The number of messages, e.g. of an album.
+        """
+        async def write() -> None:
+            now = time.time()
+            day, hour = self._day(now)
+            ttl = self.retention * 24 * 60 * 60
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.pfadd(f"{self.NAME}_users_{day}", user_id)
+                pipe.expire(f"{self.NAME}_users_{day}", ttl)
+                pipe.hincrby(f"{self.NAME}_messages_{day}", f"in_{hour}", count)
+                pipe.expire(f"{self.NAME}_messages_{day}", ttl)
+                # Only the first unanswered message sets the time the topic waits from
+                pipe.zadd(f"{self.NAME}_waiting", {user_id: now}, nx=True)
+                pipe.zremrangebyscore(f"{self.NAME}_waiting", "-inf", now - ttl)
+                await pipe.execute()
+
+        await self._guarded("stats_user_message", write, lambda: None)
+
+    async def moderator_message(self, user_id: int, count: int = 1) -> None:
+        """
+        Count the messages of a moderator relayed to a user, the first one since the user wrote is a response.
+
+        :param user_id: The ID of the user.
+        :param count: The number of messages, e.g. of an album.
+        """
+        async def write() -> None:
+            now = time.time()
+            day, hour = self._day(now)
+            ttl = self.retention * 24 * 60 * 60
+            # Of concurrent replies, only the one removing the topic records the response
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zscore(f"{self.NAME}_waiting", user_id)
+                pipe.zrem(f"{self.NAME}_waiting", user_id)
+                pipe.hincrby(f"{self.NAME}_messages_{day}", f"out_{hour}", count)
+                pipe.expire(f"{self.NAME}_messages_{day}", ttl)
+                waiting_since, removed, *_ = await pipe.execute()
+            if not removed:
+                return
+
+            waited = max(now - waiting_since, 0)
+            bucket = next((i for i, bound in enumerate(RESPONSE_BUCKETS) if waited <= bound), len(RESPONSE_BUCKETS))
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hincrby(f"{self.NAME}_responses_{day}", f"le_{bucket}", 1)
+                pipe.hincrbyfloat(f"{self.NAME}_responses_{day}", "time", waited)
+                pipe.expire(f"{self.NAME}_responses_{day}", ttl)
+                await pipe.execute()
+
+        await self._guarded("stats_moderator_message", write, lambda: None)
+
+    async def close(self, user_id: int) -> None:
+        """
+        Stop waiting for a reply to a topic, e.g. when the user is banned.
+
+        :param user_id: The ID of the user.
+        """
+        async def write() -> None:
+            await self.redis.zrem(f"{self.NAME}_waiting", user_id)
+
+        await self._guarded("stats_close", write, lambda: None)
+
+    async def get(self) -> Stats | None:
+        """
+        Get the statistics of the current day, in a single round trip whatever the number of users.
+
+        :return: The statistics or None if Redis is unavailable.
+        """
+        async def read() -> Stats:
+            now = time.time()
+            day, _ = self._day(now)
+            # The topics left waiting longer than the retention are not counted, they are dropped on the next write
+            since = now - self.retention * 24 * 60 * 60
+            week = [f"{self.NAME}_users_{self._day(now - i * 24 * 60 * 60)[0]}" for i in range(7)]
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.pfcount(week[0])
+                pipe.pfcount(*week)
+                pipe.hgetall(f"{self.NAME}_messages_{day}")
+                pipe.hgetall(f"{self.NAME}_responses_{day}")
+                pipe.zcount(f"{self.NAME}_waiting", since, "+inf")
+                pipe.zrangebyscore(f"{self.NAME}_waiting", since, "+inf", start=0, num=1, withscores=True)
+                users, users_week, messages, responses, waiting, oldest = await pipe.execute()
+
+            stats = Stats(day=day, users=users, users_week=users_week, waiting=waiting)
+            for key, value in messages.items():
+                direction, hour = (key.decode() if isinstance(key, bytes) else key).split("_")
+                counts = stats.incoming if direction == "in" else stats.outgoing
+                counts[int(hour)] = int(value)
+            for key, value in responses.items():
+                key = key.decode() if isinstance(key, bytes) else key
+                if key == "time":
+                    stats.response_time = float(value)
+                else:
+                    stats.responses[int(key.removeprefix("le_"))] = int(value)
+            if oldest:
+                stats.longest_wait = now - oldest[0][1]
+            return stats
+
+        return await self._guarded("stats_get", read, lambda: None)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from redis.asyncio import Redis
+
+from .base import GuardedStorage
+
+if TYPE_CHECKING:
+    from .health import RedisHealth
+
+# Update IDs per bitmap, 8 KB at most
+BUCKET_SIZE = 65_536
+
+
+class UpdateStorage(GuardedStorage):
+    """
+    Class for claiming the updates of a bot, so an update delivered twice is handled once.
+
+    Update IDs grow sequentially per bot, so an update is claimed by setting its bit in a bitmap of BUCKET_SIZE IDs,
+    and the previous bit tells whether it was claimed before. Each bitmap expires TTL seconds after its last write,
+    so only the bitmaps of the recent updates are kept. While Redis is unavailable every update is handled.
+    """
+
+    NAME = "updates"
+
+    def __init__(
+            self,
+            redis: Redis,
+            health: RedisHealth | None = None,
+            ttl: int = 60 * 60,
+            name: str | None = None,
+    ) -> None:
+        """
+        Initializes the UpdateStorage instance.
+
+        :param redis: The Redis instance to be used for data storage.
+        :param health: The RedisHealth instance or None to always use Redis.
+        :param ttl: The number of seconds the claims are kept.
+        :param name: The prefix of the keys, NAME by default.
+        """
+        super().__init__(redis, health, name)
+        self.ttl = ttl
+
+    async def claim(self, update_id: int) -> bool:
+        """
+        Claim an update.
+
+        :param update_id: The ID of the update.
+        :return: True if the update was not claimed before.
+        """
+        async def write() -> bool:
+            key = f"{self.NAME}_{update_id // BUCKET_SIZE}"
+            # Claim and refresh the TTL in a single round trip
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.setbit(key, update_id % BUCKET_SIZE, 1)
+                pipe.expire(key, self.ttl)
+                claimed_before, _ = await pipe.execute()
+            return not claimed_before
+
+        return await self._guarded("updates_claim", write, lambda: True)
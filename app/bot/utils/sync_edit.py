@@ -0,0 +1,47 @@
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+# Content types whose caption can be edited
+CAPTION_TYPES = {
+    ContentType.ANIMATION,
+    ContentType.AUDIO,
+    ContentType.DOCUMENT,
+    ContentType.PHOTO,
+    ContentType.VIDEO,
+    ContentType.VOICE,
+}
+
+
+async def sync_edit(message: Message, chat_id: int, message_id: int) -> bool:
+    """
+    Propagate an edited message to its copy in another chat.
+
+    The text is edited with editMessageText, the caption of a media message with editMessageCaption. Replacing the
+    media itself is not propagated.
+
+    :param message: The edited message.
+    :param chat_id: The ID of the chat of the copy.
+    :param message_id: The ID of the copy.
+    :return: True if the copy is up to date, False if it could not be edited (e.g. it was deleted).
+    """
+    if message.text is None and message.content_type not in CAPTION_TYPES:
+        return False
+
+    try:
+        if message.text is not None:
+            await message.bot.edit_message_text(
+                text=message.html_text,
+                chat_id=chat_id,
+                message_id=message_id,
+            )
+        else:
+            await message.bot.edit_message_caption(
+                chat_id=chat_id,
+                message_id=message_id,
+                caption=message.html_text if message.caption else None,
+            )
+    except TelegramBadRequest as ex:
+        # The copy already has the same content, e.g. the edit changed only the media
+        return "message is not modified" in ex.message
+    return True
@@ -80,6 +80,9 @@ class TextMessage(Text):
                 "user_blocked": "<b>User blocked!</b> Messages from the user are not accepted.",
                 "user_unblocked": "<b>User unblocked!</b> Messages from the user are being accepted again.",
                 "blocked_by_user": "<b>Message not sent!</b> The bot has been blocked by the user.",
+                "user_unreachable": (
+                    "<b>Message not sent!</b> The user deleted the account or the chat was not found."
+                ),
                 "user_information": (
                     "<b>ID:</b>\n"
                     "- <code>{id}</code>\n"
@@ -95,6 +98,10 @@ class TextMessage(Text):
                     "- {created_at}"
                 ),
                 "message_not_sent": "<b>Message not sent!</b> An unexpected error occurred.",
+                "message_edited_not_sent": (
+                    "<b>The message was edited only in this chat.</b> "
+                    "The user still sees the previous version."
+                ),
                 "message_sent_to_user": "<b>Message sent to user!</b>",
                 "silent_mode_enabled": (
                     "<b>Silent mode activated!</b> Messages will not be delivered to the user."
@@ -102,5 +109,54 @@ class TextMessage(Text):
                 "silent_mode_disabled": (
                     "<b>Silent mode deactivated!</b> The user will receive all messages."
                 ),
+                "newsletter_segment_invalid": (
+                    "<b>Unknown segment!</b> Filter the users with language, state, banned and active, "
+                    "e.g. <code>/newsletter language=en active=30</code>, or <code>any</code> to drop a filter."
+                ),
+                "profile_started": (
+                    "⏱ <b>Profiling for {seconds:.0f} seconds...</b> The report will be sent as a document."
+                ),
+                "profile_busy": "<b>A profile is already running!</b> Wait for its report.",
+                "stats": (
+                    "📊 <b>Statistics for {day}</b>\n\n"
+                    "Users wrote: <b>{users}</b> • Last 7 days: <b>{users_week}</b>\n"
+                    "Messages from users: <b>{incoming}</b> • To users: <b>{outgoing}</b>\n"
+                    "Busiest hour: <b>{busiest_hour}</b> ({busiest_count} messages)\n\n"
+                    "Topics waiting for a reply: <b>{waiting}</b> • Longest wait: <b>{longest_wait}</b>\n"
+                    "Topics answered: <b>{answered}</b> • First response: <b>{average}</b> on average, "
+                    "median <b>{median}</b>"
+                ),
+                "stats_unavailable": "<b>Statistics are unavailable!</b> Redis is not responding.",
+                "newsletter_progress": (
+                    "📨 <b>Newsletter #{id} is being sent</b>\n\n"
+                    "Processed: <b>{processed}</b> of {total} ({percent:.1f}%)\n"
+                    "Delivered: <b>{delivered}</b> • Blocked: <b>{blocked}</b> • "
+                    "Deactivated: <b>{deactivated}</b> • Failed: <b>{failed}</b>\n\n"
+                    "Speed: <b>{rate:.1f}</b> messages/s • ETA: <b>{eta}</b>"
+                ),
+                "newsletter_finished": (
+                    "✅ <b>Newsletter #{id} is finished</b> in {elapsed}\n\n"
+                    "Processed: <b>{processed}</b>\n"
+                    "Delivered: <b>{delivered}</b> • Blocked: <b>{blocked}</b> • "
+                    "Deactivated: <b>{deactivated}</b> • Failed: <b>{failed}</b>"
+                ),
             },
         }
+
+
+def format_duration(seconds: float | None) -> str:
+    """
+    Format a duration for the reports, e.g. "1h 05m".
+
+    :param seconds: The duration in seconds or None if unknown.
+    :return: The formatted duration.
+    """
+    if seconds is None:
+        return "—"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
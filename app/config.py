@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Dict, List
 
 from environs import Env
 
@@ -11,13 +12,31 @@ class BotConfig:
     Attributes:
     - TOKEN (str): The bot token.
     - DEV_ID (int): The developer's user ID.
-    - GROUP_ID (int): The group chat ID.
+    - GROUP_ID (int): The first group chat ID, it keeps the topics created before the groups were sharded.
     - BOT_EMOJI_ID (str): The custom emoji ID for the group's topic.
+    - GROUP_IDS (List[int]): The IDs of all the group chats the topics are sharded across, the first one included.
+    - NAMESPACE (str): The prefix of the Redis keys of the bot in the multi-bot mode, empty for the main bot.
+    - HASH_TAGS (bool): Whether the keys used together are hash-tagged, so they stay on one Redis Cluster slot.
     """
     TOKEN: str
     DEV_ID: int
     GROUP_ID: int
     BOT_EMOJI_ID: str
+    GROUP_IDS: List[int]
+    NAMESPACE: str = ""
+    HASH_TAGS: bool = False
+
+    def key(self, name: str, tag: bool = False) -> str:
+        """
+        Get the name of a Redis key (or of a group of keys) of the bot, prefixed with the namespace.
+
+        :param name: The name used by the main bot.
+        :param tag: Whether the keys derived from the name are used together (in a transaction or a pipeline), they
+            get a hash tag in the cluster mode, e.g. "{users}" and "{users}_activity".
+        :return: The name used by this bot.
+        """
+        name = f"{self.NAMESPACE}_{name}" if self.NAMESPACE else name
+        return f"{{{name}}}" if tag and self.HASH_TAGS else name
 
 
 @dataclass
@@ -26,13 +45,41 @@ class RedisConfig:
     Data class representing the configuration for Redis.
 
     Attributes:
-    - HOST (str): The Redis host.
+    - HOST (str): The Redis host, the seed node in the cluster mode.
     - PORT (int): The Redis port.
-    - DB (int): The Redis database number.
+    - DB (int): The Redis database number, only 0 in the cluster mode.
+    - MODE (str): "standalone", "sentinel" or "cluster".
+    - SENTINELS (List[str]): The "host:port" addresses of the sentinels in the sentinel mode.
+    - SENTINEL_MASTER (str): The name of the master monitored by the sentinels.
+    - TIMEOUT (float): The connect and command timeout in seconds.
+    - BREAKER_THRESHOLD (int): The number of consecutive failures that switch the bot to the degraded local mode.
+    - BREAKER_RECOVERY (float): The number of seconds between attempts to leave the degraded local mode.
+    - HEALTH_INTERVAL (float): The number of seconds between health checks.
+    - CACHE_SIZE (int): The number of users kept in the local cache.
+    - JOURNAL_SIZE (int): The number of user writes kept in the local journal while Redis is unavailable.
+    - WARMUP (bool): Whether the local cache is warmed up from Redis in the background on startup.
+    - WARMUP_USERS (int): The number of the most recently active users loaded by the warm-up.
+    - MESSAGES_TTL (int): The number of seconds the mapping between user and group messages is kept.
+    - UNDELIVERABLE_TTL (int): The number of seconds messages are skipped for a user who can not receive them.
+    - DEDUP_TTL (int): The number of seconds handled updates are remembered to drop duplicates, 0 disables it.
     """
     HOST: str
     PORT: int
     DB: int
+    MODE: str = "standalone"
+    SENTINELS: List[str] = field(default_factory=list)
+    SENTINEL_MASTER: str = "mymaster"
+    TIMEOUT: float = 2
+    BREAKER_THRESHOLD: int = 3
+    BREAKER_RECOVERY: float = 5
+    HEALTH_INTERVAL: float = 1
+    CACHE_SIZE: int = 10_000
+    JOURNAL_SIZE: int = 10_000
+    WARMUP: bool = False
+    WARMUP_USERS: int = 1_000
+    MESSAGES_TTL: int = 7 * 24 * 60 * 60
+    UNDELIVERABLE_TTL: int = 30 * 24 * 60 * 60
+    DEDUP_TTL: int = 60 * 60
 
     def dsn(self) -> str:
         """
@@ -43,6 +90,250 @@ class RedisConfig:
         return f"redis://{self.HOST}:{self.PORT}/{self.DB}"
 
 
+@dataclass
+class RecorderConfig:
+    """
+    Data class representing the configuration for the update recorder.
+
+    Attributes:
+    - ENABLED (bool): Whether incoming updates are recorded.
+    - PATH (str): The directory where the recordings are written.
+    - ROTATE_SIZE (int): The number of updates after which the recording file is rotated.
+    - ROTATE_INTERVAL (int): The number of seconds after which the recording file is rotated.
+    - BACKUP_COUNT (int): The number of recording files to keep.
+    """
+    ENABLED: bool = False
+    PATH: str = ".recordings"
+    ROTATE_SIZE: int = 100_000
+    ROTATE_INTERVAL: int = 3600
+    BACKUP_COUNT: int = 48
+
+
+@dataclass
+class LoggingConfig:
+    """
+    Data class representing the configuration for logging.
+
+    Attributes:
+    - FORMAT (str): The log format, "text" or "json".
+    - QUEUE_SIZE (int): The maximum number of records waiting to be written.
+    - RATE_LIMIT (float): The number of records per second allowed per logger, 0 disables the limit.
+    - BURST (int): The number of records a logger may emit at once.
+    - SAMPLING (dict): Mapping of logger names to the share of records below ERROR that are kept.
+    """
+    FORMAT: str = "text"
+    QUEUE_SIZE: int = 10_000
+    RATE_LIMIT: float = 50
+    BURST: int = 200
+    SAMPLING: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class ProfilerConfig:
+    """
+    Data class representing the configuration for the live profiler of DEV_ID.
+
+    Attributes:
+    - ENABLED (bool): Whether DEV_ID may profile the live process with the /profile command.
+    - INTERVAL (float): The number of seconds between the stack samples.
+    - DURATION (float): The number of seconds a profile runs when no duration is given.
+    - MAX_DURATION (float): The maximum number of seconds a profile runs.
+    """
+    ENABLED: bool = False
+    INTERVAL: float = 0.01
+    DURATION: float = 10
+    MAX_DURATION: float = 60
+
+
+@dataclass
+class StatsConfig:
+    """
+    Data class representing the configuration for the support statistics.
+
+    Attributes:
+    - ENABLED (bool): Whether the statistics are counted and served with the /stats command.
+    - RETENTION (int): The number of days the statistics are kept.
+    - UTC_OFFSET (int): The UTC offset in hours of the days, the same as UserData.created_at by default.
+    """
+    ENABLED: bool = True
+    RETENTION: int = 35
+    UTC_OFFSET: int = 3
+
+
+@dataclass
+class LoopConfig:
+    """
+    Data class representing the configuration for the event loop monitor.
+
+    Attributes:
+    - INTERVAL (float): The number of seconds between the event loop lag samples.
+    - BLOCK_THRESHOLD (float): The number of seconds the event loop is blocked for before the stall is logged with the
+      stack of the blocking code.
+    """
+    INTERVAL: float = 0.1
+    BLOCK_THRESHOLD: float = 0.25
+
+
+@dataclass
+class RuntimeConfig:
+    """
+    Data class representing the configuration for the runtime.
+
+    Attributes:
+    - UVLOOP (bool): Whether uvloop is used as the event loop, the default asyncio loop is used if it is not installed.
+    """
+    UVLOOP: bool = False
+
+
+@dataclass
+class ErrorsConfig:
+    """
+    Data class representing the configuration for error reporting to DEV_ID.
+
+    Attributes:
+    - WINDOW (int): The number of seconds during which repeats of an error are only counted.
+    - DIGEST_INTERVAL (int): The number of seconds between digests of the repeated errors.
+    - SAMPLES (int): The number of sample update IDs kept per error.
+    """
+    WINDOW: int = 3600
+    DIGEST_INTERVAL: int = 300
+    SAMPLES: int = 5
+
+
+@dataclass
+class DrainConfig:
+    """
+    Data class representing the configuration for draining on shutdown.
+
+    Attributes:
+    - TIMEOUT (float): The number of seconds the in-flight updates get to finish before they are persisted.
+    """
+    TIMEOUT: float = 10
+
+
+# Short timeouts for cheap calls, long ones for uploads and topic creation
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "deleteMessage": 10,
+    "editMessageText": 10,
+    "getMe": 10,
+    "createForumTopic": 30,
+    "sendDocument": 120,
+    "sendMediaGroup": 120,
+    "copyMessages": 60,
+    "forwardMessages": 60,
+}
+
+
+@dataclass
+class SessionConfig:
+    """
+    Data class representing the configuration for the Bot API HTTP session.
+
+    Attributes:
+    - POOL_SIZE (int): The maximum number of open connections, 0 means no limit.
+    - KEEPALIVE (float): The number of seconds an idle connection is kept open.
+    - DNS_CACHE_TTL (int): The number of seconds resolved addresses are cached.
+    - TIMEOUT (float): The default request timeout in seconds.
+    - TIMEOUTS (dict): Mapping of Bot API method names to their request timeouts in seconds.
+    """
+    POOL_SIZE: int = 100
+    KEEPALIVE: float = 60
+    DNS_CACHE_TTL: int = 300
+    TIMEOUT: float = 30
+    TIMEOUTS: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_TIMEOUTS))
+
+
+@dataclass
+class RetryConfig:
+    """
+    Data class representing the configuration for retrying Bot API calls.
+
+    Attributes:
+    - ATTEMPTS (int): The maximum number of attempts per call.
+    - BACKOFF_BASE (float): The base delay in seconds of the exponential backoff.
+    - BACKOFF_CAP (float): The maximum delay in seconds of the exponential backoff.
+    - MAX_RETRY_AFTER (float): The longest RetryAfter in seconds that is waited for instead of failing the call.
+    - BREAKER_THRESHOLD (int): The number of consecutive failures that open the circuit breaker.
+    - BREAKER_RECOVERY (float): The number of seconds the circuit breaker stays open.
+    """
+    ATTEMPTS: int = 3
+    BACKOFF_BASE: float = 0.5
+    BACKOFF_CAP: float = 10
+    MAX_RETRY_AFTER: float = 60
+    BREAKER_THRESHOLD: int = 10
+    BREAKER_RECOVERY: float = 30
+
+
+@dataclass
+class OutboxConfig:
+    """
+    Data class representing the configuration for the outbound queue.
+
+    Attributes:
+    - ENABLED (bool): Whether the sends are queued, otherwise they are made inline by the handlers.
+    - PARTITIONS (int): The number of streams the operations are spread over, each one is sent by a single worker.
+    - BATCH (int): The number of operations a worker reads at once.
+    - RATE (float): The maximum number of operations sent per second by the workers of a replica.
+    - DEAD_LETTER_AFTER (int): The number of failed attempts after which an operation is dead-lettered.
+    - DEDUPE_TTL (int): The number of seconds a sent operation is remembered, so it is not sent twice.
+    - MAXLEN (int): The approximate maximum length of a stream.
+    - LOCK_TTL (float): The number of seconds a partition stays locked by a replica that stopped renewing it.
+    """
+    ENABLED: bool = True
+    PARTITIONS: int = 8
+    BATCH: int = 50
+    RATE: float = 25
+    DEAD_LETTER_AFTER: int = 5
+    DEDUPE_TTL: int = 24 * 60 * 60
+    MAXLEN: int = 100_000
+    LOCK_TTL: float = 90
+
+
+@dataclass
+class NewsletterConfig:
+    """
+    Data class representing the configuration for the newsletter delivery.
+
+    Attributes:
+    - RATE (float): The maximum number of messages sent per second by a newsletter, within the outbox rate.
+    - CONCURRENCY (int): The number of messages of a newsletter in flight at once.
+    - BATCH (int): The number of recipients read from Redis at once.
+    - PROGRESS_INTERVAL (float): The number of seconds between the progress reports to DEV_ID.
+    - LOCK_TTL (float): The number of seconds a newsletter stays locked by a replica that stopped renewing it.
+    - RESULT_TTL (int): The number of seconds the outcomes of a finished newsletter are kept.
+    """
+    RATE: float = 20
+    CONCURRENCY: int = 10
+    BATCH: int = 500
+    PROGRESS_INTERVAL: float = 10
+    LOCK_TTL: float = 60
+    RESULT_TTL: int = 30 * 24 * 60 * 60
+
+
+@dataclass
+class HealthConfig:
+    """
+    Data class representing the configuration for the health and readiness endpoints.
+
+    Attributes:
+    - ENABLED (bool): Whether the HTTP server with the endpoints is started.
+    - HOST (str): The host the server listens on.
+    - PORT (int): The port the server listens on.
+    - MAX_LOOP_LAG (float): The event loop lag in seconds above which the bot is not live.
+    - MAX_REDIS_LATENCY (float): The Redis ping latency in seconds above which the bot is not ready.
+    - MAX_OUTBOX_DEPTH (int): The number of operations waiting in the outbox above which the bot is not ready.
+    - MAX_UPDATE_AGE (float): The number of seconds without a handled update after which the bot is not ready, 0
+      disables the check (a quiet bot receives no updates).
+    """
+    ENABLED: bool = False
+    HOST: str = "0.0.0.0"
+    PORT: int = 8080
+    MAX_LOOP_LAG: float = 1
+    MAX_REDIS_LATENCY: float = 0.5
+    MAX_OUTBOX_DEPTH: int = 10_000
+    MAX_UPDATE_AGE: float = 0
+
+
 @dataclass
 class Config:
     """
@@ -51,9 +342,58 @@ class Config:
     Attributes:
     - bot (BotConfig): The bot configuration.
     - redis (RedisConfig): The Redis configuration.
+    - recorder (RecorderConfig): The update recorder configuration.
+    - logging (LoggingConfig): The logging configuration.
+    - errors (ErrorsConfig): The error reporting configuration.
+    - drain (DrainConfig): The shutdown drain configuration.
+    - session (SessionConfig): The Bot API HTTP session configuration.
+    - retry (RetryConfig): The Bot API retry configuration.
+    - outbox (OutboxConfig): The outbound queue configuration.
+    - newsletter (NewsletterConfig): The newsletter delivery configuration.
+    - health (HealthConfig): The health and readiness endpoints configuration.
+    - loop (LoopConfig): The event loop monitor configuration.
+    - stats (StatsConfig): The support statistics configuration.
+    - runtime (RuntimeConfig): The runtime configuration.
+    - profiler (ProfilerConfig): The live profiler configuration.
+    - tenants (List[BotConfig]): The other bots served by the process in the multi-bot mode.
     """
     bot: BotConfig
     redis: RedisConfig
+    recorder: RecorderConfig
+    logging: LoggingConfig
+    errors: ErrorsConfig
+    drain: DrainConfig
+    session: SessionConfig
+    retry: RetryConfig
+    outbox: OutboxConfig
+    newsletter: NewsletterConfig
+    health: HealthConfig = field(default_factory=HealthConfig)
+    loop: LoopConfig = field(default_factory=LoopConfig)
+    stats: StatsConfig = field(default_factory=StatsConfig)
+    runtime: RuntimeConfig = field(default_factory=RuntimeConfig)
+    profiler: ProfilerConfig = field(default_factory=ProfilerConfig)
+    tenants: List[BotConfig] = field(default_factory=list)
+
+
+def load_bot_config(env: Env, namespace: str = "", hash_tags: bool = False) -> BotConfig:
+    """
+    Load the configuration of a bot from the BOT_* environment variables.
+
+    :param env: The Env instance, prefixed with the namespace for the other bots of the multi-bot mode.
+    :param namespace: The namespace of the bot, empty for the main bot.
+    :param hash_tags: Whether the keys used together are hash-tagged (in the cluster mode).
+    :return: The BotConfig object.
+    """
+    group_ids = env.list("BOT_GROUP_ID", subcast=int)
+    return BotConfig(
+        TOKEN=env.str("BOT_TOKEN"),
+        DEV_ID=env.int("BOT_DEV_ID"),
+        GROUP_ID=group_ids[0],
+        BOT_EMOJI_ID=env.str("BOT_EMOJI_ID"),
+        GROUP_IDS=group_ids,
+        NAMESPACE=namespace,
+        HASH_TAGS=hash_tags,
+    )
 
 
 def load_config() -> Config:
@@ -65,16 +405,117 @@ def load_config() -> Config:
     env = Env()
     env.read_env()
 
+    redis_mode = env.str("REDIS_MODE", "standalone")
+    hash_tags = redis_mode == "cluster"
+
+    # The other bots of the multi-bot mode are configured with prefixed variables, e.g. ACME_BOT_TOKEN
+    tenants = []
+    for namespace in env.list("BOT_TENANTS", []):
+        with env.prefixed(f"{namespace.upper()}_"):
+            tenants.append(load_bot_config(env, namespace, hash_tags))
+
     return Config(
-        bot=BotConfig(
-            TOKEN=env.str("BOT_TOKEN"),
-            DEV_ID=env.int("BOT_DEV_ID"),
-            GROUP_ID=env.int("BOT_GROUP_ID"),
-            BOT_EMOJI_ID=env.str("BOT_EMOJI_ID"),
-        ),
+        bot=load_bot_config(env, hash_tags=hash_tags),
         redis=RedisConfig(
             HOST=env.str("REDIS_HOST"),
             PORT=env.int("REDIS_PORT"),
             DB=env.int("REDIS_DB"),
+            MODE=redis_mode,
+            SENTINELS=env.list("REDIS_SENTINELS", []),
+            SENTINEL_MASTER=env.str("REDIS_SENTINEL_MASTER", "mymaster"),
+            TIMEOUT=env.float("REDIS_TIMEOUT", 2),
+            BREAKER_THRESHOLD=env.int("REDIS_BREAKER_THRESHOLD", 3),
+            BREAKER_RECOVERY=env.float("REDIS_BREAKER_RECOVERY", 5),
+            HEALTH_INTERVAL=env.float("REDIS_HEALTH_INTERVAL", 1),
+            CACHE_SIZE=env.int("REDIS_CACHE_SIZE", 10_000),
+            JOURNAL_SIZE=env.int("REDIS_JOURNAL_SIZE", 10_000),
+            WARMUP=env.bool("REDIS_WARMUP", False),
+            WARMUP_USERS=env.int("REDIS_WARMUP_USERS", 1_000),
+            MESSAGES_TTL=env.int("REDIS_MESSAGES_TTL", 7 * 24 * 60 * 60),
+            UNDELIVERABLE_TTL=env.int("REDIS_UNDELIVERABLE_TTL", 30 * 24 * 60 * 60),
+            DEDUP_TTL=env.int("REDIS_DEDUP_TTL", 60 * 60),
+        ),
+        recorder=RecorderConfig(
+            ENABLED=env.bool("RECORDER_ENABLED", False),
+            PATH=env.str("RECORDER_PATH", ".recordings"),
+            ROTATE_SIZE=env.int("RECORDER_ROTATE_SIZE", 100_000),
+            ROTATE_INTERVAL=env.int("RECORDER_ROTATE_INTERVAL", 3600),
+            BACKUP_COUNT=env.int("RECORDER_BACKUP_COUNT", 48),
+        ),
+        logging=LoggingConfig(
+            FORMAT=env.str("LOG_FORMAT", "text"),
+            QUEUE_SIZE=env.int("LOG_QUEUE_SIZE", 10_000),
+            RATE_LIMIT=env.float("LOG_RATE_LIMIT", 50),
+            BURST=env.int("LOG_BURST", 200),
+            SAMPLING=env.dict("LOG_SAMPLING", {}, subcast_values=float),
+        ),
+        errors=ErrorsConfig(
+            WINDOW=env.int("ERRORS_WINDOW", 3600),
+            DIGEST_INTERVAL=env.int("ERRORS_DIGEST_INTERVAL", 300),
+            SAMPLES=env.int("ERRORS_SAMPLES", 5),
+        ),
+        drain=DrainConfig(
+            TIMEOUT=env.float("DRAIN_TIMEOUT", 10),
+        ),
+        session=SessionConfig(
+            POOL_SIZE=env.int("SESSION_POOL_SIZE", 100),
+            KEEPALIVE=env.float("SESSION_KEEPALIVE", 60),
+            DNS_CACHE_TTL=env.int("SESSION_DNS_CACHE_TTL", 300),
+            TIMEOUT=env.float("SESSION_TIMEOUT", 30),
+            TIMEOUTS={**DEFAULT_TIMEOUTS, **env.dict("SESSION_TIMEOUTS", {}, subcast_values=float)},
+        ),
+        retry=RetryConfig(
+            ATTEMPTS=env.int("RETRY_ATTEMPTS", 3),
+            BACKOFF_BASE=env.float("RETRY_BACKOFF_BASE", 0.5),
+            BACKOFF_CAP=env.float("RETRY_BACKOFF_CAP", 10),
+            MAX_RETRY_AFTER=env.float("RETRY_MAX_RETRY_AFTER", 60),
+            BREAKER_THRESHOLD=env.int("RETRY_BREAKER_THRESHOLD", 10),
+            BREAKER_RECOVERY=env.float("RETRY_BREAKER_RECOVERY", 30),
+        ),
+        outbox=OutboxConfig(
+            ENABLED=env.bool("OUTBOX_ENABLED", True),
+            PARTITIONS=env.int("OUTBOX_PARTITIONS", 8),
+            BATCH=env.int("OUTBOX_BATCH", 50),
+            RATE=env.float("OUTBOX_RATE", 25),
+            DEAD_LETTER_AFTER=env.int("OUTBOX_DEAD_LETTER_AFTER", 5),
+            DEDUPE_TTL=env.int("OUTBOX_DEDUPE_TTL", 24 * 60 * 60),
+            MAXLEN=env.int("OUTBOX_MAXLEN", 100_000),
+            LOCK_TTL=env.float("OUTBOX_LOCK_TTL", 90),
+        ),
+        newsletter=NewsletterConfig(
+            RATE=env.float("NEWSLETTER_RATE", 20),
+            CONCURRENCY=env.int("NEWSLETTER_CONCURRENCY", 10),
+            BATCH=env.int("NEWSLETTER_BATCH", 500),
+            PROGRESS_INTERVAL=env.float("NEWSLETTER_PROGRESS_INTERVAL", 10),
+            LOCK_TTL=env.float("NEWSLETTER_LOCK_TTL", 60),
+            RESULT_TTL=env.int("NEWSLETTER_RESULT_TTL", 30 * 24 * 60 * 60),
+        ),
+        health=HealthConfig(
+            ENABLED=env.bool("HEALTH_ENABLED", False),
+            HOST=env.str("HEALTH_HOST", "0.0.0.0"),
+            PORT=env.int("HEALTH_PORT", 8080),
+            MAX_LOOP_LAG=env.float("HEALTH_MAX_LOOP_LAG", 1),
+            MAX_REDIS_LATENCY=env.float("HEALTH_MAX_REDIS_LATENCY", 0.5),
+            MAX_OUTBOX_DEPTH=env.int("HEALTH_MAX_OUTBOX_DEPTH", 10_000),
+            MAX_UPDATE_AGE=env.float("HEALTH_MAX_UPDATE_AGE", 0),
+        ),
+        loop=LoopConfig(
+            INTERVAL=env.float("LOOP_INTERVAL", 0.1),
+            BLOCK_THRESHOLD=env.float("LOOP_BLOCK_THRESHOLD", 0.25),
+        ),
+        stats=StatsConfig(
+            ENABLED=env.bool("STATS_ENABLED", True),
+            RETENTION=env.int("STATS_RETENTION", 35),
+            UTC_OFFSET=env.int("STATS_UTC_OFFSET", 3),
+        ),
+        runtime=RuntimeConfig(
+            UVLOOP=env.bool("RUNTIME_UVLOOP", False),
+        ),
+        profiler=ProfilerConfig(
+            ENABLED=env.bool("PROFILER_ENABLED", False),
+            INTERVAL=env.float("PROFILER_INTERVAL", 0.01),
+            DURATION=env.float("PROFILER_DURATION", 10),
+            MAX_DURATION=env.float("PROFILER_MAX_DURATION", 60),
         ),
+        tenants=tenants,
     )
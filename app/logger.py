@@ -1,44 +1,196 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import random
+import time
+from contextvars import ContextVar
 from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Tuple
 
+from app.config import LoggingConfig
+from app.metrics import registry
 
-def setup_logger() -> None:
+# Context of the update being handled, attached to every log record
+update_id_var: ContextVar[int | None] = ContextVar("update_id", default=None)
+chat_id_var: ContextVar[int | None] = ContextVar("chat_id", default=None)
+handler_var: ContextVar[str | None] = ContextVar("handler", default=None)
+
+LOG_RECORDS = registry.counter("log_records_total", "Log records accepted by the logging queue.")
+LOG_DROPPED = registry.counter("log_records_dropped_total", "Log records dropped by sampling, rate limit or a full queue.")
+LOG_LOOP_SECONDS = registry.counter("log_loop_seconds_total", "Time spent in logging calls on the calling thread.")
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attaches the update context (update_id, chat_id, handler) to log records.
+
+    It runs on the calling thread, where the context variables of the handled update are visible.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.chat_id = chat_id_var.get()
+        record.handler = handler_var.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per-logger sampling and token bucket rate limiting.
+
+    Records of ERROR level and above are never sampled out, but they are still rate limited, so an error storm cannot
+    flood the queue. The number of dropped records is prepended to the next record that passes.
+    """
+
+    def __init__(self, rate: float, burst: int, sampling: Dict[str, float]) -> None:
+        """
+        :param rate: The number of records per second allowed per logger, 0 disables the limit.
+        :param burst: The number of records a logger may emit at once.
+        :param sampling: Mapping of logger names to the share of records below ERROR that are kept.
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sampling = sampling
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._dropped: Dict[str, int] = {}
+
+    def _drop(self, name: str) -> bool:
+        """
+        Count a dropped record of the logger.
+        """
+        self._dropped[name] = self._dropped.get(name, 0) + 1
+        LOG_DROPPED.inc(logger=name)
+        return False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = record.name
+        if record.levelno < logging.ERROR and random.random() >= self.sampling.get(name, 1.0):
+            return self._drop(name)
+
+        if self.rate:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[name] = (tokens, now)
+                return self._drop(name)
+            self._buckets[name] = (tokens - 1, now)
+
+        dropped = self._dropped.pop(name, 0)
+        if dropped:
+            record.msg = f"[{dropped} records dropped] {record.msg}"
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the calling thread.
+
+    Formatting (including tracebacks) is left to the listener thread, records are dropped when the queue is full,
+    and the time spent on the calling thread is measured.
+    """
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        started_at = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            LOG_LOOP_SECONDS.inc(time.perf_counter() - started_at)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener lives in the same process, so the record is passed as is and formatted there
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.inc()
+        except queue.Full:
+            LOG_DROPPED.inc(logger=record.name)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as JSON lines carrying the update context.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "update_id": getattr(record, "update_id", None),
+            "chat_id": getattr(record, "chat_id", None),
+            "handler": getattr(record, "handler", None),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logger(config: LoggingConfig) -> None:
     """
     Set up the logger configuration for the application.
 
     This function ensures that the logs directory exists, configures basic logging,
     and sets the log level for specific loggers.
 
-    Logs are written to both a timed rotating file handler and a stream handler.
+    Records are put on a queue by the root logger and written by a background listener thread to both a timed
+    rotating file handler and a stream handler, so logging never does disk I/O on the event loop.
 
     - Logs are saved to files in the ".logs" directory with a one-day rotation.
     - The console (stream) handler displays logs on the console.
+    - Records are formatted as text or as JSON lines with update_id, chat_id and handler (config.FORMAT).
+    - Records are sampled and rate limited per logger before they are queued.
 
-    The log level for the "aiogram.event" and "httpx" loggers is set to CRITICAL.
+    The log level for the "aiogram.event" logger is set to CRITICAL.
 
+    :param config: The logging configuration.
     :return: None
     """
     # Ensure the logs directory exists
     os.makedirs(".logs", exist_ok=True)
 
+    if config.FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')  # noqa
+
+    handlers = [
+        # Add a timed rotating file handler to log to a file
+        TimedRotatingFileHandler(
+            filename=f".logs/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log",
+            when="midnight",
+            interval=1,
+            backupCount=7,  # Keep logs for 7 days
+        ),
+        # Add a stream handler to log to the console
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # Write records from a background thread
+    log_queue: queue.Queue = queue.Queue(maxsize=config.QUEUE_SIZE)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter(config.RATE_LIMIT, config.BURST, config.SAMPLING))
+
     # Set up basic logging configuration
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # noqa
-        handlers=[
-            # Add a timed rotating file handler to log to a file
-            TimedRotatingFileHandler(
-                filename=f".logs/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log",
-                when="midnight",
-                interval=1,
-                backupCount=7,  # Keep logs for 7 days
-            ),
-            # Add a stream handler to log to the console
-            logging.StreamHandler(),
-        ]
+        handlers=[queue_handler],
     )
-    # Set the log level for aiogram.event and httpx logger to CRITICAL
+    # Set the log level for aiogram.event logger to CRITICAL
     aiogram_logger = logging.getLogger("aiogram.event")
     aiogram_logger.setLevel(logging.CRITICAL)
@@ -0,0 +1,176 @@
+import bisect
+import threading
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+# The bot the current update or background task belongs to in the multi-bot mode, it labels the samples
+tenant_var: ContextVar[str] = ContextVar("tenant", default="")
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    """
+    Convert labels to a hashable key, with the tenant label in the multi-bot mode.
+    """
+    tenant = tenant_var.get()
+    if tenant:
+        labels = {"tenant": tenant, **labels}
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format(name: str, key: LabelKey, value: float) -> str:
+    """
+    Render a single sample in the Prometheus text format.
+    """
+    labels = ",".join(f'{k}="{v}"' for k, v in key)
+    return f"{name}{{{labels}}} {value}" if labels else f"{name} {value}"
+
+
+class Metric:
+    """
+    Base class for metrics stored in the process-wide registry.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        """
+        :param name: The metric name.
+        :param documentation: The metric description.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[str]:
+        """
+        Render the metric samples in the Prometheus text format.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        super().__init__(name, documentation)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        """
+        Increase the value by amount.
+        """
+        key = _key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: object) -> float:
+        """
+        Get the current value.
+        """
+        return self.values.get(_key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in list(self.values.items()):
+            yield _format(self.name, key, value)
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down.
+    """
+    type = "gauge"
+
+    def set(self, value: float, **labels: object) -> None:
+        """
+        Set the current value.
+        """
+        with self._lock:
+            self.values[_key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    Observations counted in cumulative buckets.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        self.values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        """
+        Record an observation.
+        """
+        key = _key(labels)
+        with self._lock:
+            counts, totals = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            totals[0] += value
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, totals) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield _format(f"{self.name}_bucket", (*key, ("le", str(bound))), cumulative)
+            yield _format(f"{self.name}_sum", key, totals[0])
+            yield _format(f"{self.name}_count", key, cumulative)
+
+
+class Registry:
+    """
+    Process-wide collection of metrics.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def _get_or_create(self, cls: type, name: str, documentation: str, **kwargs) -> Metric:
+        """
+        Get a registered metric or register a new one.
+        """
+        if name not in self.metrics:
+            self.metrics[name] = cls(name, documentation, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        """
+        Get or create a counter.
+        """
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        """
+        Get or create a gauge.
+        """
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Get or create a histogram.
+        """
+        return self._get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        :return: The rendered metrics.
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
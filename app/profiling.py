@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+
+class StartupProfiler:
+    """
+    Collects the duration of the startup stages and the import times of the application.
+    """
+
+    def __init__(self) -> None:
+        self.stages: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measure the duration of a startup stage.
+
+        :param name: The name of the stage.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - started_at))
+
+    @staticmethod
+    def import_times(module: str = "app.__main__", limit: int = 30) -> List[Tuple[int, int, str]]:
+        """
+        Measure the import times of a module and its dependencies in a fresh interpreter.
+
+        :param module: The module to import.
+        :param limit: The number of the slowest imports to return.
+        :return: (cumulative us, self us, module name) tuples sorted by the cumulative time.
+        """
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        times = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            times.append((int(cumulative_us), int(self_us), name.rstrip()))
+        return sorted(times, reverse=True)[:limit]
+
+    def report(self) -> str:
+        """
+        Render the startup report.
+
+        :return: The report text.
+        """
+        lines = ["Initialization:"]
+        for name, duration in self.stages:
+            lines.append(f"  {duration * 1000:9.1f} ms  {name}")
+        lines.append(f"  {sum(duration for _, duration in self.stages) * 1000:9.1f} ms  total")
+
+        lines.append("")
+        lines.append("Slowest imports (cumulative / self):")
+        for cumulative_us, self_us, name in self.import_times():
+            lines.append(f"  {cumulative_us / 1000:9.1f} ms  {self_us / 1000:9.1f} ms  {name}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Write the startup report to a file.
+
+        :param path: The file path.
+        """
+        with open(path, "w") as file:
+            file.write(self.report())
@@ -0,0 +1,18 @@
+import asyncio
+import logging
+
+
+def install_uvloop() -> bool:
+    """
+    Use uvloop as the event loop of the loops created from now on, e.g. by asyncio.run.
+
+    :return: True if uvloop is installed, False if it is not available and the default loop is kept.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("uvloop is not installed, the default event loop is used")
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
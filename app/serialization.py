@@ -0,0 +1,47 @@
+"""
+JSON encoding used on the hot path: the Bot API requests and responses, the user records and the FSM data.
+
+orjson is used when it is installed, the standard library otherwise. What orjson refuses is handled by the standard
+library, so both produce the same documents: integers beyond 64 bits and types orjson does not know are encoded,
+NaN and Infinity are decoded the way the standard library does. orjson encodes non-string keys as strings, like the
+standard library, and keeps non-ASCII characters as they are.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def json_loads(data: str | bytes) -> Any:
+    """
+    Decode a JSON document.
+
+    :param data: The JSON document.
+    :return: The decoded value.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity are accepted by the standard library, it raises the same error for invalid documents
+            pass
+    return json.loads(data)
+
+
+def json_dumps(value: Any) -> str:
+    """
+    Encode a value as a JSON document.
+
+    :param value: The value.
+    :return: The JSON document.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # Integers beyond 64 bits, or a type only the standard library encodes (or rejects with its own error)
+            pass
+    return json.dumps(value, ensure_ascii=False)
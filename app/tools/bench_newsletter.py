@@ -0,0 +1,140 @@
+"""
+Benchmark the newsletter engine against the fake Bot API.
+
+The given number of users is written to a separate hash with their segment indexes, and a newsletter is sent to the
+default segment (members who are not banned) by the NewsletterEngine with the production retry policy, against the
+fake Bot API started in-process with the global send limit and a share of blocked and deactivated users. With --interrupt the engine is stopped after the given number of seconds, the
+way a restart stops it, and a new engine resumes the newsletter from the checkpoint.
+
+The report shows the throughput, the outcomes, the calls rejected with 429, and the users the message reached twice
+or not at all, as seen by the fake Bot API. The keys are deleted afterwards.
+
+Usage:
+    python -m app.tools.bench_newsletter --redis-url redis://localhost:6379/15 --users 10000 --interrupt 60
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.types import Chat, Message
+from aiohttp import web
+from redis.asyncio import Redis
+
+from app.bot.newsletter import NewsletterEngine
+from app.bot.session import RetryMiddleware
+from app.bot.utils.outbox import RateLimiter
+from app.bot.utils.redis.models import UserData
+from app.bot.utils.redis.segments import index_user
+from app.config import NewsletterConfig, RetryConfig
+from app.serialization import json_dumps
+from app.tools.fake_api import FakeBotAPI
+
+# Chat the progress is reported to, it is not counted as a recipient
+DEV_ID = -1
+
+
+def create_engine(redis: Redis, api_url: str, args: argparse.Namespace) -> NewsletterEngine:
+    """
+    Create an engine sending through its own Bot, the way a replica does.
+    """
+    bot = Bot(
+        token="42:BENCH",
+        session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    bot.session.middleware(RetryMiddleware(RetryConfig()))
+
+    config = NewsletterConfig(
+        RATE=args.rate,
+        CONCURRENCY=args.concurrency,
+        BATCH=args.batch,
+        PROGRESS_INTERVAL=args.progress_interval,
+        LOCK_TTL=5,
+    )
+    engine = NewsletterEngine(redis, bot, config, RateLimiter(args.outbox_rate))
+    engine.NAME = f"{NewsletterEngine.NAME}_bench"
+    engine.USERS = f"{engine.NAME}_users"
+    return engine
+
+
+async def run(args: argparse.Namespace) -> None:
+    redis = Redis.from_url(args.redis_url)
+    api = FakeBotAPI(latency=args.latency, blocked=args.blocked, deactivated=args.deactivated)
+    runner = web.AppRunner(api.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    api_url = f"http://127.0.0.1:{args.port}"
+
+    engine = create_engine(redis, api_url, args)
+    user_ids = range(10 ** 9, 10 ** 9 + args.users)
+    try:
+        for start in range(0, args.users, 1_000):
+            async with redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids[start:start + 1_000]:
+                    user = UserData(None, None, False, user_id, f"User {user_id}", None, language_code="en")
+                    pipe.hset(engine.USERS, user_id, json_dumps(user.to_dict()))
+                    index_user(pipe, engine.USERS, user)
+                await pipe.execute()
+
+        message = Message(message_id=1, date=int(time.time()), chat=Chat(id=DEV_ID, type="private"), text="Hello!")
+        started_at = time.perf_counter()
+        engine.start()
+        id_ = await engine.create(DEV_ID, "en", message)
+
+        if args.interrupt:
+            await asyncio.sleep(args.interrupt)
+            await engine.stop()
+            await engine.bot.session.close()
+            print(f"Interrupted after {args.interrupt}s, resuming with a new engine")
+            engine = create_engine(redis, api_url, args)
+            engine.start()
+
+        while await redis.sismember(f"{engine.NAME}_active", id_):
+            await asyncio.sleep(0.5)
+        elapsed = time.perf_counter() - started_at
+
+        newsletter = await engine.get(id_)
+        reached = [api.sent_to[user_id] for user_id in user_ids]
+        print(f"Users:             {args.users}")
+        print(f"Elapsed:           {elapsed:.1f}s")
+        print(f"Messages/s:        {newsletter.processed / elapsed:.1f}")
+        for outcome, count in newsletter.counts.items():
+            print(f"{outcome.capitalize() + ':':<19}{count}")
+        print(f"Rejected (429):    {api.stats['429']}")
+        print(f"Reached twice:     {sum(count > 1 for count in reached)}")
+        print(f"Not reached:       {sum(count == 0 for count in reached)}")
+    finally:
+        await engine.stop()
+        await engine.bot.session.close()
+        async for key in redis.scan_iter(match=f"{engine.NAME}_*", count=1_000):
+            await redis.delete(key)
+        await redis.aclose()
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the newsletter engine against the fake Bot API.")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15", help="Redis to write the users to.")
+    parser.add_argument("--users", type=int, default=10_000, help="Number of users.")
+    parser.add_argument("--rate", type=float, default=20, help="Newsletter rate (NEWSLETTER_RATE).")
+    parser.add_argument("--outbox-rate", type=float, default=25, help="Shared rate (OUTBOX_RATE).")
+    parser.add_argument("--concurrency", type=int, default=10, help="Messages in flight (NEWSLETTER_CONCURRENCY).")
+    parser.add_argument("--batch", type=int, default=500, help="Recipients read at once (NEWSLETTER_BATCH).")
+    parser.add_argument("--progress-interval", type=float, default=10, help="Seconds between progress reports.")
+    parser.add_argument("--blocked", type=float, default=0.05, help="Share of the users who blocked the bot.")
+    parser.add_argument("--deactivated", type=float, default=0.01, help="Share of the users who deleted their account.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latency of the in-process fake Bot API.")
+    parser.add_argument("--port", type=int, default=8083, help="Port of the in-process fake Bot API.")
+    parser.add_argument("--interrupt", type=float, default=0, help="Seconds after which the engine is restarted.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
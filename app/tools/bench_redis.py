@@ -0,0 +1,105 @@
+"""
+Benchmark the Redis operations on the hot path of an update, against a standalone, sentinel or cluster deployment.
+
+Every simulated update does what the handlers of a user message do: it reads the user and the FSM state, writes the
+user back with its indexes, maps the relayed message and reads the mapping back. The updates of different users run
+concurrently, and the keys are written under separate prefixes (tagged in the cluster mode, the way the bot tags
+them) and deleted afterwards.
+
+The report shows the updates per second and the latency percentiles of each operation. Run it with the same
+arguments against each deployment to compare them: in the cluster mode the users hash and its indexes stay on the
+node of their slot, while the message mappings and the FSM keys spread across the masters.
+
+Usage:
+    python -m app.tools.bench_redis --mode standalone --host localhost --port 6379 --db 15 --users 1000
+    python -m app.tools.bench_redis --mode cluster --host localhost --port 7000 --users 1000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List
+
+from app.bot.utils.redis import MessageStorage, RedisStorage, create_redis
+from app.bot.utils.redis.models import UserData
+from app.config import RedisConfig
+
+PREFIX = "bench_redis"
+
+
+async def run(args: argparse.Namespace) -> None:
+    config = RedisConfig(
+        HOST=args.host,
+        PORT=args.port,
+        DB=args.db,
+        MODE=args.mode,
+        SENTINELS=args.sentinels.split(",") if args.sentinels else [],
+        SENTINEL_MASTER=args.sentinel_master,
+    )
+    redis = create_redis(config)
+    # The users hash and its indexes share a slot in the cluster mode, see BotConfig.key
+    users_name = f"{{{PREFIX}_users}}" if args.mode == "cluster" else f"{PREFIX}_users"
+    users = RedisStorage(redis, name=users_name)
+    messages = MessageStorage(redis, name=f"{PREFIX}_messages")
+    timings: Dict[str, List[float]] = defaultdict(list)
+
+    async def timed(operation: str, call: Callable[[], Awaitable]) -> None:
+        started_at = time.perf_counter()
+        await call()
+        timings[operation].append(time.perf_counter() - started_at)
+
+    async def update(user_id: int, message_id: int) -> None:
+        state_key = f"{PREFIX}_fsm:{user_id}:{user_id}:state"
+        user = UserData(None, None, False, user_id, f"User {user_id}", None, language_code="en")
+        await timed("get_user", lambda: users.get_user(user_id))
+        await timed("get_state", lambda: redis.get(state_key))
+        await timed("update_user", lambda: users.update_user(user_id, user))
+        await timed("messages_add", lambda: messages.add(user_id, [(message_id, message_id)]))
+        await timed("get_group_message", lambda: messages.get_group_message(user_id, message_id))
+
+    async def worker(user_ids: range) -> None:
+        for message_id in range(1, args.updates + 1):
+            for user_id in user_ids:
+                await update(user_id, message_id)
+
+    user_ids = range(10 ** 9, 10 ** 9 + args.users)
+    step = max(1, args.users // args.concurrency)
+    try:
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker(user_ids[start:start + step]) for start in range(0, args.users, step)))
+        elapsed = time.perf_counter() - started_at
+
+        total = args.users * args.updates
+        print(f"Mode:              {args.mode}")
+        print(f"Updates:           {total}")
+        print(f"Elapsed:           {elapsed:.1f}s")
+        print(f"Updates/s:         {total / elapsed:.1f}")
+        for operation, values in timings.items():
+            quantiles = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+            print(f"{operation + ':':<19}p50 {quantiles[49] * 1000:.2f}ms  p99 {quantiles[98] * 1000:.2f}ms")
+    finally:
+        async for key in redis.scan_iter(match=f"*{PREFIX}_*", count=1_000):
+            await redis.delete(key)
+        await redis.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the Redis operations on the hot path of an update.")
+    parser.add_argument("--mode", default="standalone", choices=["standalone", "sentinel", "cluster"],
+                        help="Redis mode (REDIS_MODE).")
+    parser.add_argument("--host", default="localhost", help="Redis host, the seed node in the cluster mode.")
+    parser.add_argument("--port", type=int, default=6379, help="Redis port.")
+    parser.add_argument("--db", type=int, default=15, help="Redis database, only 0 in the cluster mode.")
+    parser.add_argument("--sentinels", default="", help="Sentinel addresses, separated by commas (REDIS_SENTINELS).")
+    parser.add_argument("--sentinel-master", default="mymaster", help="Master name (REDIS_SENTINEL_MASTER).")
+    parser.add_argument("--users", type=int, default=1_000, help="Number of users.")
+    parser.add_argument("--updates", type=int, default=10, help="Updates per user.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Updates in flight.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
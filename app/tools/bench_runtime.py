@@ -0,0 +1,129 @@
+"""
+Benchmark the CPU time per update saved by the fast runtime: orjson and uvloop.
+
+JSON: the encoding and decoding done for a relayed user message (the getUpdates response with the update, the user
+record read and written back, the FSM data read and written, the entities of the copied message and the response of
+the copy) is timed with the standard library and with app.serialization, in CPU time per update.
+
+Event loop: the asyncio work done for an update (a task per update awaiting a few futures, like the Redis and Bot API
+calls complete) is timed on the default loop and on uvloop, if it is installed.
+
+Usage:
+    python -m app.tools.bench_runtime --updates 50000
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict
+
+from app.bot.utils.redis.models import UserData
+from app.runtime import install_uvloop
+from app.serialization import json_dumps, json_loads, orjson
+
+MESSAGE = {
+    "message_id": 4242,
+    "date": 1700000000,
+    "chat": {"id": 123456789, "type": "private", "first_name": "Анна", "username": "anna"},
+    "from": {"id": 123456789, "is_bot": False, "first_name": "Анна", "username": "anna", "language_code": "ru"},
+    "text": "Hello! I have a question about my order #12345, could you help me? " * 2,
+    "entities": [{"type": "hashtag", "offset": 44, "length": 6}, {"type": "bold", "offset": 0, "length": 6}],
+}
+UPDATES_RESPONSE = {"ok": True, "result": [{"update_id": 987654321, "message": MESSAGE}]}
+COPY_RESPONSE = {"ok": True, "result": {
+    **MESSAGE, "message_id": 777, "message_thread_id": 55, "is_topic_message": True,
+    "chat": {"id": -100123456789, "type": "supergroup", "title": "Support", "is_forum": True},
+}}
+USER = UserData(55, None, False, 123456789, "Анна", "@anna", language_code="ru").to_dict()
+FSM_DATA = {"language_code": "ru", "last_message_id": 4242, "pending": {"1": [1, 2, 3]}}
+
+
+def per_update(loads: Callable[[Any], Any], dumps: Callable[[Any], str]) -> Callable[[], None]:
+    """
+    Get the JSON work done for a relayed user message.
+    """
+    updates_body = json.dumps(UPDATES_RESPONSE).encode()
+    copy_body = json.dumps(COPY_RESPONSE).encode()
+    user_raw = json.dumps(USER).encode()
+    fsm_raw = json.dumps(FSM_DATA).encode()
+
+    def work() -> None:
+        loads(updates_body)
+        loads(user_raw)
+        dumps(USER)
+        loads(fsm_raw)
+        dumps(FSM_DATA)
+        dumps(MESSAGE["entities"])
+        loads(copy_body)
+
+    return work
+
+
+def cpu_per_call(call: Callable[[], None], count: int) -> float:
+    """
+    Measure the CPU time of a call, the best of 3 runs.
+
+    :return: The CPU time per call in seconds.
+    """
+    best = float("inf")
+    for _ in range(3):
+        started_at = time.process_time()
+        for _ in range(count):
+            call()
+        best = min(best, time.process_time() - started_at)
+    return best / count
+
+
+async def loop_work(count: int, concurrency: int) -> float:
+    """
+    Run the asyncio work of the updates on the running loop.
+
+    :return: The CPU time per update in seconds.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def update() -> None:
+        # The Redis and Bot API calls of an update, completed from the loop
+        for _ in range(4):
+            future = loop.create_future()
+            loop.call_soon(future.set_result, None)
+            await future
+
+    started_at = time.process_time()
+    for start in range(0, count, concurrency):
+        await asyncio.gather(*(update() for _ in range(min(concurrency, count - start))))
+    return (time.process_time() - started_at) / count
+
+
+def report(name: str, results: Dict[str, float]) -> None:
+    baseline, fast = results.values()
+    print(f"{name}:")
+    for label, seconds in results.items():
+        print(f"  {label:<10}{seconds * 1e6:8.2f} µs/update")
+    print(f"  {'saved':<10}{(baseline - fast) * 1e6:8.2f} µs/update ({(1 - fast / baseline) * 100:.0f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the CPU time per update saved by the fast runtime.")
+    parser.add_argument("--updates", type=int, default=50_000, help="Number of updates.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Updates in flight on the event loop.")
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("JSON: orjson is not installed, app.serialization uses the standard library")
+    else:
+        report("JSON", {
+            "json": cpu_per_call(per_update(json.loads, json.dumps), args.updates),
+            "orjson": cpu_per_call(per_update(json_loads, json_dumps), args.updates),
+        })
+
+    results = {"asyncio": asyncio.run(loop_work(args.updates, args.concurrency))}
+    if install_uvloop():
+        results["uvloop"] = asyncio.run(loop_work(args.updates, args.concurrency))
+        report("Event loop", results)
+    else:
+        print(f"Event loop: asyncio {results['asyncio'] * 1e6:.2f} µs/update, uvloop is not installed")
+
+
+if __name__ == "__main__":
+    main()
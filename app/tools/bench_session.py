@@ -0,0 +1,103 @@
+"""
+Benchmark the Bot API HTTP session against the fake Bot API.
+
+The same load (sendMessage calls with the given concurrency) is sent through the default AiohttpSession and the
+TunedAiohttpSession, and the requests per second and the latency percentiles of both are reported. The fake Bot API
+is started in-process with the rate limits disabled, unless --api-url points to a running one.
+
+Usage:
+    python -m app.tools.bench_session --requests 5000 --concurrency 100 --latency 0.02
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from app.bot.session import TunedAiohttpSession
+from app.config import SessionConfig
+from app.tools.fake_api import FakeBotAPI
+from app.tools.replay import percentile
+
+
+async def bench(session: BaseSession, requests: int, concurrency: int) -> List[float]:
+    """
+    Send sendMessage calls through the session.
+
+    :param session: The session under test.
+    :param requests: The total number of calls.
+    :param concurrency: The number of calls in flight at once.
+    :return: The latencies of the calls in seconds.
+    """
+    bot = Bot(token="42:BENCH", session=session)
+    latencies: List[float] = []
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for i in counter:
+            started_at = time.perf_counter()
+            await bot.send_message(chat_id=1, text=f"Message #{i} " + "x" * 200)
+            latencies.append(time.perf_counter() - started_at)
+
+    try:
+        # Warm up the connection pool, so both sessions are measured in steady state
+        await asyncio.gather(*(bot.get_me() for _ in range(concurrency)))
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        await bot.session.close()
+    return latencies
+
+
+async def run(args: argparse.Namespace) -> None:
+    runner = None
+    api_url = args.api_url
+    if api_url is None:
+        api = FakeBotAPI(latency=args.latency, send_limit=None, topic_limit=None)
+        runner = web.AppRunner(api.create_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.port).start()
+        api_url = f"http://127.0.0.1:{args.port}"
+
+    api_server = TelegramAPIServer.from_base(api_url)
+    sessions = {
+        "default": lambda: AiohttpSession(api=api_server),
+        "tuned": lambda: TunedAiohttpSession(SessionConfig(POOL_SIZE=args.pool_size), api=api_server),
+    }
+    try:
+        print(f"{'Session':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, factory in sessions.items():
+            started_at = time.perf_counter()
+            latencies = await bench(factory(), args.requests, args.concurrency)
+            elapsed = time.perf_counter() - started_at
+            print(
+                f"{name:<10}"
+                f"{len(latencies) / elapsed:>10.0f}"
+                f"{percentile(latencies, .5) * 1000:>10.1f}"
+                f"{percentile(latencies, .99) * 1000:>10.1f}"
+                f"{max(latencies, default=0) * 1000:>10.1f}"
+            )
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the Bot API HTTP session against the fake Bot API.")
+    parser.add_argument("--requests", type=int, default=5000, help="Total number of calls per session.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Number of calls in flight at once.")
+    parser.add_argument("--pool-size", type=int, default=100, help="Connection pool size of the tuned session.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latency of the in-process fake Bot API.")
+    parser.add_argument("--port", type=int, default=8082, help="Port of the in-process fake Bot API.")
+    parser.add_argument("--api-url", default=None, help="Base URL of a running fake Bot API.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
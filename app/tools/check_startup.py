@@ -0,0 +1,62 @@
+"""
+Check the startup time of the bot against a budget.
+
+The import of app.__main__ is timed in a fresh interpreter (the best of --runs), and the modules that must be loaded
+lazily are checked not to be imported at startup. The exit code is non-zero if the budget is exceeded or a lazy
+module is imported eagerly, so the check can run in CI.
+
+Usage:
+    python -m app.tools.check_startup --budget 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Modules only DEV_ID needs, they must not be imported at startup
+LAZY_MODULES = ("aiogram_newsletter", "apscheduler")
+
+SCRIPT = """
+import json, sys, time
+started_at = time.perf_counter()
+import app.__main__
+print(json.dumps({"seconds": time.perf_counter() - started_at, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure() -> Tuple[float, List[str]]:
+    """
+    Import app.__main__ in a fresh interpreter.
+
+    :return: The import time in seconds and the names of the imported modules.
+    """
+    result = subprocess.run([sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout.splitlines()[-1])
+    return data["seconds"], data["modules"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the startup time against a budget.")
+    parser.add_argument("--budget", type=float, default=5.0, help="Maximum import time in seconds.")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs, the best one is compared.")
+    args = parser.parse_args()
+
+    timings, modules = [], []
+    for _ in range(args.runs):
+        seconds, modules = measure()
+        timings.append(seconds)
+
+    best = min(timings)
+    eager = [name for name in LAZY_MODULES if name in modules]
+    print(f"Import time:  {best:.2f}s (budget {args.budget:.2f}s, runs: {', '.join(f'{t:.2f}' for t in timings)})")
+    print(f"Eager lazies: {', '.join(eager) or 'none'}")
+
+    if best > args.budget or eager:
+        print("Startup check failed")
+        sys.exit(1)
+    print("Startup check passed")
+
+
+if __name__ == "__main__":
+    main()
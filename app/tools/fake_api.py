@@ -0,0 +1,297 @@
+"""
+A fake Telegram Bot API server for replays and benchmarks.
+
+It answers every method with a plausible result and emulates the rate limits that matter for the bot: about 30
+messages per second globally and about 20 created topics per minute per group. Exceeding them returns the same
+429 "Too Many Requests" response Telegram sends. A share of the users can be emulated as having blocked the bot or
+deleted their account, the sends to them fail with the same 403 responses Telegram sends.
+
+Usage:
+    python -m app.tools.fake_api --port 8081 --latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict
+
+from aiohttp import web
+
+SEND_METHODS = {
+    "sendMessage",
+    "sendDocument",
+    "sendPhoto",
+    "sendMediaGroup",
+    "copyMessage",
+    "copyMessages",
+    "forwardMessage",
+    "forwardMessages",
+}
+
+
+class SlidingWindow:
+    """
+    Sliding window counter used to emulate Telegram rate limits.
+    """
+
+    def __init__(self, limit: int, period: float) -> None:
+        """
+        :param limit: The number of calls allowed per period.
+        :param period: The period in seconds.
+        """
+        self.limit = limit
+        self.period = period
+        self.calls: Deque[float] = deque()
+
+    def acquire(self) -> float:
+        """
+        Register a call.
+
+        :return: 0 if the call is allowed, otherwise the number of seconds to wait.
+        """
+        now = time.monotonic()
+        while self.calls and now - self.calls[0] >= self.period:
+            self.calls.popleft()
+        if len(self.calls) >= self.limit:
+            return self.period - (now - self.calls[0])
+        self.calls.append(now)
+        return 0
+
+
+class FakeBotAPI:
+    """
+    In-memory implementation of the Bot API methods used by the bot.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            send_limit: int | None = 30,
+            topic_limit: int | None = 20,
+            blocked: float = 0.0,
+            deactivated: float = 0.0,
+    ) -> None:
+        """
+        :param latency: The base response latency in seconds.
+        :param jitter: The maximum random latency added on top of the base latency.
+        :param send_limit: The number of sends allowed per second or None to disable the limit.
+        :param topic_limit: The number of topics allowed per minute per group or None to disable the limit.
+        :param blocked: The share of the users who blocked the bot.
+        :param deactivated: The share of the users who deleted their account.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.send_limit = send_limit
+        self.topic_limit = topic_limit
+        self.blocked = blocked
+        self.deactivated = deactivated
+
+        self.stats: Counter = Counter()
+        # Number of sends that reached each user chat
+        self.sent_to: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self._thread_ids = itertools.count(1000)
+        self._send_window = SlidingWindow(send_limit, 1) if send_limit else None
+        self._topic_windows: Dict[int, SlidingWindow] = {}
+
+    def create_app(self) -> web.Application:
+        """
+        Create the aiohttp application serving the fake API.
+
+        :return: The web application.
+        """
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def handle_stats(self, _: web.Request) -> web.Response:
+        """
+        Return the number of calls per method and the number of rate limited calls.
+        """
+        return web.json_response(dict(self.stats))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Handle a Bot API method call.
+        """
+        token, method = request.match_info["token"], request.match_info["method"]
+        params = dict(await request.post())
+        self.stats[method] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+        retry_after = self._check_limits(method, params)
+        if retry_after:
+            self.stats["429"] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                },
+                status=429,
+            )
+
+        if method in SEND_METHODS and self._int(params.get("chat_id")) > 0:
+            self.sent_to[self._int(params["chat_id"])] += 1
+
+        forbidden = self._check_forbidden(method, params)
+        if forbidden:
+            self.stats["403"] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": f"Forbidden: {forbidden}"},
+                status=403,
+            )
+
+        if method == "getUpdates":
+            # Nothing to deliver, emulate long polling
+            await asyncio.sleep(min(int(params.get("timeout", 0)), 1))
+
+        return web.json_response({"ok": True, "result": self._result(token, method, params)})
+
+    def _check_limits(self, method: str, params: Dict[str, Any]) -> int:
+        """
+        Check the emulated rate limits.
+
+        :return: 0 if the call is allowed, otherwise the retry_after value.
+        """
+        wait = 0.0
+        if method in SEND_METHODS and self._send_window:
+            wait = self._send_window.acquire()
+        elif method == "createForumTopic" and self.topic_limit:
+            chat_id = self._int(params.get("chat_id"))
+            window = self._topic_windows.setdefault(chat_id, SlidingWindow(self.topic_limit, 60))
+            wait = window.acquire()
+        return int(wait) + 1 if wait else 0
+
+    def _check_forbidden(self, method: str, params: Dict[str, Any]) -> str | None:
+        """
+        Check whether the user the message is sent to blocked the bot or deleted their account.
+
+        :return: None if the call is allowed, otherwise the reason.
+        """
+        chat_id = self._int(params.get("chat_id"))
+        if method not in SEND_METHODS or chat_id <= 0 or not (self.blocked or self.deactivated):
+            return None
+        # The same users are always forbidden
+        share = random.Random(chat_id).random()
+        if share < self.blocked:
+            return "bot was blocked by the user"
+        if share < self.blocked + self.deactivated:
+            return "user is deactivated"
+        return None
+
+    @staticmethod
+    def _int(value: Any, default: int = 0) -> int:
+        """
+        Convert a form value to int.
+        """
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def _message(self, token: str, params: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+        """
+        Build a Message object sent by the bot.
+        """
+        chat_id = self._int(params.get("chat_id"))
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": self._me(token),
+            **extra,
+        }
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = self._int(params["message_thread_id"])
+            message["is_topic_message"] = True
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    @staticmethod
+    def _me(token: str) -> Dict[str, Any]:
+        """
+        Build the bot User object from its token.
+        """
+        bot_id = int(token.split(":")[0]) if token.split(":")[0].isdigit() else 1
+        return {"id": bot_id, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    def _result(self, token: str, method: str, params: Dict[str, Any]) -> Any:
+        """
+        Build the result of a method call.
+        """
+        if method == "getMe":
+            return self._me(token)
+        if method == "getUpdates":
+            return []
+        if method == "createForumTopic":
+            return {
+                "message_thread_id": next(self._thread_ids),
+                "name": params.get("name", ""),
+                "icon_color": 7322096,
+            }
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in {"copyMessages", "forwardMessages"}:
+            message_ids = json.loads(params.get("message_ids", "[]"))
+            return [{"message_id": next(self._message_ids)} for _ in message_ids]
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return [self._message(token, params) for _ in media]
+        if method.startswith("send") or method == "forwardMessage":
+            return self._message(token, params)
+        if method in {"editMessageText", "editMessageCaption"}:
+            return self._message(token, params)
+        return True
+
+
+async def run(host: str, port: int, api: FakeBotAPI) -> None:
+    """
+    Run the fake API until cancelled.
+    """
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Fake Bot API listening on http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Base latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum random extra latency in seconds.")
+    parser.add_argument("--no-limits", action="store_true", help="Disable the emulated rate limits.")
+    parser.add_argument("--blocked", type=float, default=0.0, help="Share of the users who blocked the bot.")
+    parser.add_argument("--deactivated", type=float, default=0.0, help="Share of the users who deleted their account.")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        send_limit=None if args.no_limits else 30,
+        topic_limit=None if args.no_limits else 20,
+        blocked=args.blocked,
+        deactivated=args.deactivated,
+    )
+    try:
+        asyncio.run(run(args.host, args.port, api))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
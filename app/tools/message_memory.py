@@ -0,0 +1,67 @@
+"""
+Report the Redis memory used by the mapping between user and group messages.
+
+The given number of mappings is written with the MessageStorage under a separate prefix, the way the bot writes
+them (user message IDs grow per chat, group message IDs for the whole group, both with gaps for the messages that
+are not mapped, e.g. the confirmations). The memory of the written keys is measured with MEMORY USAGE, reported per
+1M mappings, and the keys are deleted again.
+
+Usage:
+    python -m app.tools.message_memory --redis-url redis://localhost:6379/15 --mappings 100000
+"""
+import argparse
+import asyncio
+import random
+
+from redis.asyncio import Redis
+
+from app.bot.utils.redis import MessageStorage
+
+
+async def run(args: argparse.Namespace) -> None:
+    redis = Redis.from_url(args.redis_url)
+    storage = MessageStorage(redis)
+    storage.NAME = f"{MessageStorage.NAME}_memory_report"
+
+    try:
+        chat_ids = list(range(10 ** 9, 10 ** 9 + args.users))
+        user_message_ids = dict.fromkeys(chat_ids, 0)
+        group_message_id = 0
+        for start in range(0, args.mappings, args.batch):
+            writes = []
+            for _ in range(min(args.batch, args.mappings - start)):
+                chat_id = random.choice(chat_ids)
+                user_message_ids[chat_id] += args.gap
+                group_message_id += args.gap
+                writes.append(storage.add(chat_id, [(user_message_ids[chat_id], group_message_id)]))
+            await asyncio.gather(*writes)
+
+        keys, used = 0, 0
+        async for key in redis.scan_iter(match=f"{storage.NAME}_*", count=1_000):
+            used += await redis.memory_usage(key, samples=0) or 0
+            keys += 1
+            await redis.delete(key)
+
+        print(f"Mappings:          {args.mappings}")
+        print(f"Keys:              {keys}")
+        print(f"Memory:            {used / 2 ** 20:.1f} MiB")
+        print(f"Per mapping:       {used / args.mappings:.1f} bytes")
+        print(f"Per 1M mappings:   {used / args.mappings * 10 ** 6 / 2 ** 20:.1f} MiB")
+    finally:
+        await redis.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Report the Redis memory used by the message mapping.")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15", help="Redis to write the mappings to.")
+    parser.add_argument("--mappings", type=int, default=100_000, help="Number of mappings written.")
+    parser.add_argument("--users", type=int, default=1_000, help="Number of user chats.")
+    parser.add_argument("--gap", type=int, default=2, help="Step between the mapped message IDs of a chat.")
+    parser.add_argument("--batch", type=int, default=1_000, help="Number of mappings written concurrently.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Replay recorded updates into the dispatcher for capacity testing.
+
+Updates recorded by the RecorderMiddleware are fed into a dispatcher built exactly like the production one, with
+the Bot API calls going to the fake Bot API (see app.tools.fake_api) and the storage to the Redis from the
+environment. The original timing between updates is kept and scaled by --speed, and updates of the same chat are
+processed strictly in order.
+
+Usage:
+    python -m app.tools.fake_api --port 8081 &
+    python -m app.tools.replay .recordings --speed 10 --api-url http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.types import Update
+from aiohttp import ClientSession
+
+from app.__main__ import create_dispatcher
+from app.bot.session import RetryMiddleware, TunedAiohttpSession
+from app.bot.utils.recorder import read_records
+from app.config import load_config
+from app.serialization import json_dumps, json_loads
+
+
+def chat_key(update: Update) -> int:
+    """
+    Get the ID of the chat the update belongs to, used to keep per-chat order.
+
+    :param update: The update.
+    :return: The chat ID, or the user ID for updates without a chat.
+    """
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else 0
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Get the q-th percentile of the values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class Replayer:
+    """
+    Feeds recorded updates into the dispatcher, keeping per-chat order and the scaled original timing.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, speed: float | None) -> None:
+        """
+        :param dp: The dispatcher to feed.
+        :param bot: The bot the updates are fed for.
+        :param speed: The speed multiplier, or None to replay as fast as possible.
+        """
+        self.dp = dp
+        self.bot = bot
+        self.speed = speed
+
+        self.queues: Dict[int, asyncio.Queue] = {}
+        self.workers: List[asyncio.Task] = []
+        self.latencies: List[float] = []
+        self.lags: List[float] = []
+        self.errors = 0
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        """
+        Process the updates of a single chat one by one.
+        """
+        loop = asyncio.get_running_loop()
+        while (item := await queue.get()) is not None:
+            scheduled_at, update = item
+            started_at = loop.time()
+            self.lags.append(started_at - scheduled_at)
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as ex:
+                self.errors += 1
+                logging.warning(f"Update {update.update_id} failed: {ex!r}")
+            self.latencies.append(loop.time() - started_at)
+
+    async def run(self, records: Iterable[Tuple[float, dict]]) -> Tuple[int, float]:
+        """
+        Replay the records.
+
+        :param records: (timestamp, raw update) tuples in the recorded order.
+        :return: The number of replayed updates and the recorded duration in seconds.
+        """
+        loop = asyncio.get_running_loop()
+        started_at, first_ts, last_ts, count = loop.time(), None, None, 0
+
+        for ts, raw in records:
+            first_ts = ts if first_ts is None else first_ts
+            last_ts = ts
+            scheduled_at = loop.time()
+            if self.speed:
+                scheduled_at = started_at + (ts - first_ts) / self.speed
+                delay = scheduled_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            update = Update.model_validate(raw, context={"bot": self.bot})
+            key = chat_key(update)
+            if key not in self.queues:
+                self.queues[key] = asyncio.Queue()
+                self.workers.append(asyncio.create_task(self._worker(self.queues[key])))
+            self.queues[key].put_nowait((scheduled_at, update))
+            count += 1
+
+        for queue in self.queues.values():
+            queue.put_nowait(None)
+        await asyncio.gather(*self.workers)
+        return count, (last_ts - first_ts) if count else 0.0
+
+
+async def replay(args: argparse.Namespace) -> None:
+    config = load_config()
+    if args.group_id is not None:
+        config.bot.GROUP_ID = args.group_id
+        config.bot.GROUP_IDS = [args.group_id]
+
+    # A recording may be replayed more than once, its updates are not duplicates
+    config.redis.DEDUP_TTL = 0
+
+    storage = RedisStorage.from_url(url=config.redis.dsn(), json_loads=json_loads, json_dumps=json_dumps)
+    bot = Bot(
+        token=config.bot.TOKEN,
+        session=TunedAiohttpSession(config.session, api=TelegramAPIServer.from_base(args.api_url)),
+        default=DefaultBotProperties(
+            parse_mode=ParseMode.HTML,
+        ),
+    )
+    bot.session.middleware(RetryMiddleware(config.retry))
+    dp = create_dispatcher(config, bot, storage)
+
+    speed = None if args.speed == "max" else float(args.speed)
+    replayer = Replayer(dp, bot, speed)
+
+    # Same startup and shutdown data as start_polling provides
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    workflow_data.pop("bot", None)
+
+    await dp.emit_startup(bot=bot, **workflow_data)
+    started_at = time.monotonic()
+    try:
+        count, recorded = await replayer.run(read_records(*args.paths))
+    finally:
+        elapsed = time.monotonic() - started_at
+        async with ClientSession() as session:
+            async with session.get(f"{args.api_url.rstrip('/')}/stats") as resp:
+                api_stats = await resp.json()
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+
+    print(f"Updates:          {count} in {len(replayer.queues)} chats, {replayer.errors} failed")
+    print(f"Recorded:         {recorded:.1f}s")
+    print(f"Replayed:         {elapsed:.1f}s ({recorded / elapsed if elapsed else 0:.1f}x, {count / elapsed:.1f} upd/s)")
+    for name, values in (("Handling time", replayer.latencies), ("Schedule lag", replayer.lags)):
+        print(
+            f"{name + ':':<18}"
+            f"p50={percentile(values, .5) * 1000:.0f}ms "
+            f"p99={percentile(values, .99) * 1000:.0f}ms "
+            f"max={max(values, default=0) * 1000:.0f}ms"
+        )
+    print(f"Bot API calls:    {json.dumps(api_stats, sort_keys=True)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded updates against the fake Bot API.")
+    parser.add_argument("paths", nargs="+", help="Recording files or directories.")
+    parser.add_argument("--speed", default="1", help="Speed multiplier (e.g. 1, 10) or 'max'.")
+    parser.add_argument("--api-url", default="http://127.0.0.1:8081", help="Base URL of the fake Bot API.")
+    parser.add_argument("--group-id", type=int, default=None, help="Override BOT_GROUP_ID of the recording.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()